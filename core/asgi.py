@@ -5,6 +5,27 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Deployment
+----------
+Under WSGI (gunicorn's sync workers) a worker is busy for the whole request,
+so a slow list or PDF download caps concurrency at the worker count. The
+read-heavy views (dashboard, patient and electronic invoice lists, the
+unassigned invoice picker, the treatment lookup and the PDF download) are
+async: under ASGI one worker keeps serving other requests while they wait on
+the database, and PDF cache misses render in a pool of
+INVOICE_PDF_RENDER_WORKERS threads (see invoicing/pdf.py). The other views
+stay sync and Django runs each of them in a thread.
+
+Run one worker per CPU with an ASGI server, e.g.::
+
+    pip install "uvicorn[standard]" gunicorn
+    DJANGO_SETTINGS_MODULE=core.settings.production DB_CONN_MAX_AGE=0 \\
+        gunicorn core.asgi:application -k uvicorn.workers.UvicornWorker -w 4
+
+Django's database connections belong to the thread of each request, so under
+ASGI persistent connections are never reused and must be disabled with
+DB_CONN_MAX_AGE=0 (opening a SQLite connection is cheap).
 """
 
 import os
@@ -16,6 +16,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'invoicing.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -23,6 +24,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'invoicing.middleware.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -87,3 +89,18 @@ DECIMAL_SEPARATOR = '.'
 STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Electronic invoice PDF cache (see invoicing/pdf.py)
+INVOICE_PDF_CACHE_DIR = Path.joinpath(BASE_DIR, 'var', 'pdf_cache')
+INVOICE_PDF_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Threads the async PDF view renders cache misses in (WeasyPrint is CPU-bound)
+INVOICE_PDF_RENDER_WORKERS = 2
+
+# Per-view request/SQL metrics at /metrics/ (see invoicing/metrics.py)
+INVOICING_METRICS_ENABLED = os.getenv('INVOICING_METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+# Read replicas: aliases in DATABASES that serve the read-only views (see
+# invoicing/routers.py). Browsers stay on the primary this long after a write.
+DATABASE_ROUTERS = ['invoicing.routers.ReplicaRouter']
+INVOICING_READ_REPLICAS = []
+INVOICING_REPLICA_PIN_SECONDS = 10
@@ -18,6 +18,16 @@ DATABASES = {
     }
 }
 
+# Optional local read replica: a second SQLite file refreshed with
+# `python manage.py sync_replica`
+if os.getenv('REPLICA_DB_NAME'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('REPLICA_DB_NAME'),
+        'TEST': {'MIRROR': 'default'},
+    }
+    INVOICING_READ_REPLICAS = ['replica']
+
 STATIC_ROOT = Path.joinpath(BASE_DIR, 'staticfiles')
 STATICFILES_DIRS = [
     Path.joinpath(BASE_DIR, 'static'),
@@ -0,0 +1,79 @@
+import os
+from core.settings.base import *
+
+SECRET_KEY = os.environ['SECRET_KEY']
+
+DEBUG = False
+
+ALLOWED_HOSTS = [host for host in os.getenv('ALLOWED_HOSTS', '').split(',') if host]
+CSRF_TRUSTED_ORIGINS = [origin for origin in os.getenv('CSRF_TRUSTED_ORIGINS', '').split(',') if origin]
+
+SESSION_COOKIE_SECURE = True
+CSRF_COOKIE_SECURE = True
+
+# SQLite tuned for several gunicorn workers writing at once:
+# - WAL lets readers run while a writer commits, and synchronous=NORMAL only
+#   syncs at checkpoints (still safe against corruption; a power loss can
+#   drop the last commits)
+# - BEGIN IMMEDIATE takes the write lock when the transaction starts, so a
+#   transaction that read first never fails with "database is locked" when it
+#   upgrades to a writer; it waits up to `timeout` seconds (the busy timeout)
+#   for the lock instead
+# - memory-mapped reads and a 64 MB page cache per connection, kept between
+#   requests by the persistent connections
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('DB_NAME', Path.joinpath(BASE_DIR, 'db.sqlite3')),
+        'OPTIONS': {
+            'init_command': ''.join(f'PRAGMA {name}={value};' for name, value in SQLITE_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Set DB_CONN_MAX_AGE=0 under ASGI (see core/asgi.py)
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# The dashboard snapshot, the list fragments and the version counters of the
+# billing rate table, the treatment index and the branches live in the cache,
+# and every worker must see the others' invalidations: the per-process
+# LocMemCache default would keep serving stale data. Redis when REDIS_URL is
+# set, otherwise a table in the database (create it once with
+# `python manage.py createcachetable`).
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'invoicing_cache',
+        }
+    }
+
+STATIC_ROOT = Path.joinpath(BASE_DIR, 'staticfiles')
+STATICFILES_DIRS = [
+    Path.joinpath(BASE_DIR, 'static'),
+]
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
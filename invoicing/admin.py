@@ -1,10 +1,14 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from django.db.models import Sum
+from django.db.models import Q, Sum
+from django.http import StreamingHttpResponse
 from .models import (
-    Branch, Treatment, ElectronicInvoice, 
-    PatientInvoice, PatientInvoiceItem
+    Branch, Treatment, BillingRate, ElectronicInvoice, 
+    PatientInvoice, PatientInvoiceItem, MonthlySummary
 )
+from .async_views import aiterate, is_asgi
+from .pdf_export import iter_pdfs_zip, render_pdfs_in_threads
+from .search import search_filter
 
 
 @admin.register(Branch)
@@ -37,6 +41,35 @@ class TreatmentAdmin(admin.ModelAdmin):
     formatted_price.admin_order_field = 'price'
 
 
+@admin.register(BillingRate)
+class BillingRateAdmin(admin.ModelAdmin):
+    list_display = [
+        '__str__', 'branch', 'treatment', 'effective_from',
+        'asembis_rate', 'dr_rate', 'iva_rate'
+    ]
+    list_filter = ['effective_from', 'branch']
+    search_fields = ['treatment__code', 'treatment__name', 'branch__name']
+    autocomplete_fields = ['treatment']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(MonthlySummary)
+class MonthlySummaryAdmin(admin.ModelAdmin):
+    """Read-only: rows are maintained by invoicing.signals and rebuild_monthly_summary"""
+    list_display = [
+        'year', 'month', 'branch', 'treatment', 'item_count', 'quantity',
+        'monto_asembis', 'monto_dr', 'iva', 'total'
+    ]
+    list_filter = ['year', 'month', 'branch']
+    search_fields = ['treatment__code', 'treatment__name']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 class PatientInvoiceInline(admin.TabularInline):
     model = PatientInvoice
     extra = 0
@@ -46,16 +79,34 @@ class PatientInvoiceInline(admin.TabularInline):
 
 @admin.register(ElectronicInvoice)
 class ElectronicInvoiceAdmin(admin.ModelAdmin):
-    list_display = ['invoice_number', 'date', 'patient_count', 'created_at']
+    list_display = ['invoice_number', 'date', 'patient_count', 'invoice_total', 'created_at']
     list_filter = ['date', 'created_at']
     search_fields = ['invoice_number']
     readonly_fields = ['created_at', 'updated_at']
     inlines = [PatientInvoiceInline]
+    actions = ['export_pdfs']
     
     def patient_count(self, obj):
         return obj.patient_invoices.count()
     patient_count.short_description = 'Cantidad de Pacientes'
 
+    def invoice_total(self, obj):
+        return f"₡{obj.total:,.2f}"
+    invoice_total.short_description = 'Total'
+    invoice_total.admin_order_field = 'total'
+
+    def export_pdfs(self, request, queryset):
+        # Rendered in the PDF thread pool and streamed; resumen.csv in the ZIP has the timings.
+        # Large batches belong in the export_pdfs command, which renders in a process pool
+        pks = list(queryset.order_by('date', 'invoice_number').values_list('pk', flat=True))
+        content = iter_pdfs_zip(render_pdfs_in_threads(pks))
+        response = StreamingHttpResponse(
+            aiterate(content) if is_asgi(request) else content, content_type='application/zip'
+        )
+        response['Content-Disposition'] = 'attachment; filename="facturas_electronicas.zip"'
+        return response
+    export_pdfs.short_description = 'Exportar PDFs seleccionados (ZIP)'
+
 
 class PatientInvoiceItemInline(admin.TabularInline):
     model = PatientInvoiceItem
@@ -80,19 +131,19 @@ class PatientInvoiceItemInline(admin.TabularInline):
         if obj.pk:
             return f"₡{obj.monto_asembis:,.2f}"
         return "₡0.00"
-    monto_asembis_display.short_description = 'Monto ASEMBIS (15%)'
+    monto_asembis_display.short_description = 'Monto ASEMBIS'
     
     def monto_dr_display(self, obj):
         if obj.pk:
             return f"₡{obj.monto_dr:,.2f}"
         return "₡0.00"
-    monto_dr_display.short_description = 'Monto DR (85%)'
+    monto_dr_display.short_description = 'Monto DR'
     
     def iva_display(self, obj):
         if obj.pk:
             return f"₡{obj.iva:,.2f}"
         return "₡0.00"
-    iva_display.short_description = 'I.V.A. (4%)'
+    iva_display.short_description = 'I.V.A.'
     
     def total_display(self, obj):
         if obj.pk:
@@ -114,27 +165,43 @@ class PatientInvoiceAdmin(admin.ModelAdmin):
     search_fields = [
         'invoice_number', 'patient_name', 'electronic_invoice__invoice_number'
     ]
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = [
+        'subtotal', 'monto_asembis', 'monto_dr', 'iva', 'total',
+        'created_at', 'updated_at'
+    ]
     inlines = [PatientInvoiceItemInline]
     
     fieldsets = (
         ('Información de Factura', {
             'fields': ('electronic_invoice', 'invoice_number', 'date', 'patient_name', 'branch')
         }),
+        ('Totales', {
+            'fields': ('subtotal', 'monto_asembis', 'monto_dr', 'iva', 'total'),
+            'classes': ('collapse',)
+        }),
         ('Información del Sistema', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
     )
     
+    def get_search_results(self, request, queryset, search_term):
+        # Full-text index for names and numbers instead of LIKE '%...%' scans
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(
+            search_filter(search_term, queryset.db) |
+            Q(electronic_invoice__invoice_number=search_term.strip())
+        ), False
+    
     def items_count(self, obj):
         return obj.items.count()
     items_count.short_description = 'Cantidad de Tratamientos'
     
     def invoice_total(self, obj):
-        total = sum(item.total for item in obj.items.all())
-        return f"₡{total:,.2f}"
+        return f"₡{obj.total:,.2f}"
     invoice_total.short_description = 'Total Factura'
+    invoice_total.admin_order_field = 'total'
 
 
 @admin.register(PatientInvoiceItem)
@@ -155,7 +222,7 @@ class PatientInvoiceItemAdmin(admin.ModelAdmin):
         'patient_invoice__patient_name',
         'treatment__name'
     ]
-    readonly_fields = ['created_at']
+    readonly_fields = ['created_at', 'updated_at']
     
     fieldsets = (
         ('Información del Tratamiento', {
@@ -169,7 +236,7 @@ class PatientInvoiceItemAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Información del Sistema', {
-            'fields': ('created_at',),
+            'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
     )
@@ -185,15 +252,15 @@ class PatientInvoiceItemAdmin(admin.ModelAdmin):
     
     def monto_asembis_display(self, obj):
         return f"₡{obj.monto_asembis:,.2f}"
-    monto_asembis_display.short_description = 'Monto ASEMBIS (15%)'
+    monto_asembis_display.short_description = 'Monto ASEMBIS'
     
     def monto_dr_display(self, obj):
         return f"₡{obj.monto_dr:,.2f}"
-    monto_dr_display.short_description = 'Monto DR (85%)'
+    monto_dr_display.short_description = 'Monto DR'
     
     def iva_display(self, obj):
         return f"₡{obj.iva:,.2f}"
-    iva_display.short_description = 'I.V.A. (4%)'
+    iva_display.short_description = 'I.V.A.'
     
     def total_display(self, obj):
         return format_html(
@@ -0,0 +1,76 @@
+"""
+Bases para las vistas asíncronas de solo lectura.
+
+Under ASGI an async view waits for the database without holding a worker, so
+the dashboard, the invoice lists, the treatment lookup and the PDF download
+are served by coroutines (under WSGI Django runs them in a per-request event
+loop and they behave as before). Querysets are built as usual and evaluated
+with the async ORM; the template is rendered afterwards, in the request's
+sync thread, from the already loaded rows.
+
+Streaming responses (CSV export, PDF download, ZIP export) must match the
+handler: Django reads a sync iterator to the end before sending it through
+ASGI, and an async one before sending it through WSGI. Under ASGI they are
+given an async iterator (``aiterate()`` adapts a sync one), under WSGI the
+plain sync iterator.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import AccessMixin
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIRequest
+from django.views.generic import ListView
+
+from .pagination import KeysetPaginationMixin
+
+
+def is_asgi(request):
+    """Whether the request is served through ASGI, which streams only async iterators"""
+    return isinstance(request, ASGIRequest)
+
+
+async def aiterate(iterator):
+    """Async iterator over a sync one, advanced in the request's sync thread"""
+    iterator = iter(iterator)
+    done = object()
+    try:
+        while (part := await sync_to_async(next)(iterator, done)) is not done:
+            yield part
+    finally:
+        # Client gone: let the generator release what it holds (cursors, renders)
+        if hasattr(iterator, 'close'):
+            await sync_to_async(iterator.close)()
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    """LoginRequiredMixin for async views: the user is loaded with request.auser()"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(
+                request.get_full_path(), self.get_login_url(), self.get_redirect_field_name()
+            )
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncKeysetListView(KeysetPaginationMixin, ListView):
+    """
+    Keyset-paginated ListView whose GET fetches the page with the async ORM.
+    Views add their own queries in ``aget_context_data()``.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        # Building the queryset may query (form validation, search index check)
+        self.object_list = await sync_to_async(self.get_queryset)()
+        self.page_result = await self.apaginate_queryset(
+            self.object_list, self.get_paginate_by(self.object_list)
+        )
+        context = await self.aget_context_data()
+        return self.render_to_response(context)
+
+    def paginate_queryset(self, queryset, page_size):
+        # Already fetched by get(); ListView.get_context_data() only reads it
+        return self.page_result
+
+    async def aget_context_data(self, **kwargs):
+        return self.get_context_data(**kwargs)
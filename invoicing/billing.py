@@ -0,0 +1,190 @@
+"""
+Motor de distribución de montos - ASEMBIS / DR / IVA billing split.
+
+Rates come from the versioned BillingRate table: the most specific row
+(branch + treatment, treatment, branch, global) whose ``effective_from`` is on
+or before the invoice date wins, falling back to DEFAULT_RATES. The table is
+loaded once per process and reloaded when its version (bumped by
+invoicing.signals on every change, shared through the Django cache) moves, or
+at the latest after RATE_TABLE_TTL seconds.
+
+All amounts are rounded to cents (ROUND_HALF_UP) per line. When the ASEMBIS and
+DR rates add up to 100 %, the doctor's share is ``subtotal - asembis`` so the
+two shares always add back up to the subtotal.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from typing import NamedTuple
+
+from django.core.cache import cache
+
+from .routers import read_from_primary
+
+
+CENT = Decimal('0.01')
+ONE = Decimal('1')
+
+SPLIT_FIELDS = ('subtotal', 'monto_asembis', 'monto_dr', 'iva', 'total')
+
+RATE_TABLE_VERSION_KEY = 'invoicing:billing-rate-table-version'
+RATE_TABLE_TTL = 60
+
+
+class Rates(NamedTuple):
+    asembis: Decimal
+    dr: Decimal
+    iva: Decimal
+
+
+DEFAULT_RATES = Rates(Decimal('0.15'), Decimal('0.85'), Decimal('0.04'))
+
+
+class RateTable:
+    """Immutable, indexed snapshot of the BillingRate rows"""
+
+    def __init__(self, rows=(), version=None):
+        self.version = version
+        grouped = defaultdict(list)
+        for branch_id, treatment_id, effective_from, rates in rows:
+            grouped[(branch_id, treatment_id)].append((effective_from, rates))
+        self._dates = {}
+        self._rates = {}
+        for key, versions in grouped.items():
+            versions.sort(key=lambda version: version[0])
+            self._dates[key] = [effective_from for effective_from, _ in versions]
+            self._rates[key] = [rates for _, rates in versions]
+
+    def __bool__(self):
+        return bool(self._rates)
+
+    def resolve(self, branch_id, treatment_id, on_date):
+        """Rates in force for a branch/treatment on a given date"""
+        for key in (
+            (branch_id, treatment_id), (None, treatment_id),
+            (branch_id, None), (None, None)
+        ):
+            dates = self._dates.get(key)
+            if not dates:
+                continue
+            position = bisect.bisect_right(dates, on_date)
+            if position:
+                return self._rates[key][position - 1]
+        return DEFAULT_RATES
+
+
+_lock = threading.Lock()
+_table = None
+_loaded_at = 0.0
+
+
+def load_rate_table(version=None):
+    from .models import BillingRate
+
+    rows = BillingRate.objects.values_list(
+        'branch_id', 'treatment_id', 'effective_from',
+        'asembis_rate', 'dr_rate', 'iva_rate'
+    )
+    return RateTable(
+        ((branch_id, treatment_id, effective_from, Rates(asembis, dr, iva))
+         for branch_id, treatment_id, effective_from, asembis, dr, iva in rows),
+        version=version
+    )
+
+
+def get_rate_table():
+    """Cached rate table for this process"""
+    global _table, _loaded_at
+    version = cache.get(RATE_TABLE_VERSION_KEY, 0)
+    table = _table
+    if table is None or table.version != version or time.monotonic() - _loaded_at > RATE_TABLE_TTL:
+        with _lock, read_from_primary():
+            table = load_rate_table(version)
+            _table, _loaded_at = table, time.monotonic()
+    return table
+
+
+def invalidate_rate_table():
+    """Force every process to reload the rate table on next use"""
+    global _table
+    try:
+        cache.incr(RATE_TABLE_VERSION_KEY)
+    except ValueError:
+        cache.set(RATE_TABLE_VERSION_KEY, 1, None)
+    _table = None
+
+
+def split(quantities, unit_prices, rates=DEFAULT_RATES):
+    """
+    Batch billing split.
+
+    Takes parallel columns of quantities and unit prices plus either one Rates
+    for every row or a column of Rates, and returns a dict with the
+    ``subtotal``, ``monto_asembis``, ``monto_dr``, ``iva`` and ``total``
+    columns as lists of Decimals rounded to cents.
+    """
+    count = len(quantities)
+    if len(unit_prices) != count:
+        raise ValueError('quantities and unit_prices must have the same length')
+    if isinstance(rates, Rates):
+        rates = (rates,) * count
+    elif len(rates) != count:
+        raise ValueError('rates must be a Rates or have one entry per row')
+
+    subtotals, asembis_column, dr_column, iva_column, totals = [], [], [], [], []
+    for quantity, unit_price, row_rates in zip(quantities, unit_prices, rates):
+        subtotal = (Decimal(quantity) * unit_price).quantize(CENT, ROUND_HALF_UP)
+        asembis = (subtotal * row_rates.asembis).quantize(CENT, ROUND_HALF_UP)
+        if row_rates.asembis + row_rates.dr == ONE:
+            dr = subtotal - asembis
+        else:
+            dr = (subtotal * row_rates.dr).quantize(CENT, ROUND_HALF_UP)
+        iva = (subtotal * row_rates.iva).quantize(CENT, ROUND_HALF_UP)
+
+        subtotals.append(subtotal)
+        asembis_column.append(asembis)
+        dr_column.append(dr)
+        iva_column.append(iva)
+        totals.append(asembis + dr + iva)
+
+    return {
+        'subtotal': subtotals,
+        'monto_asembis': asembis_column,
+        'monto_dr': dr_column,
+        'iva': iva_column,
+        'total': totals,
+    }
+
+
+def apply_splits(items, table=None):
+    """
+    Compute and set the split columns on PatientInvoiceItem instances in one
+    batch, using the rates in force for each item's invoice branch and date.
+    Returns the items so the call can be chained into bulk_create/bulk_update.
+    """
+    items = list(items)
+    if not items:
+        return items
+    table = table if table is not None else get_rate_table()
+    if table:
+        rates = [
+            table.resolve(
+                item.patient_invoice.branch_id, item.treatment_id,
+                item.patient_invoice.date
+            )
+            for item in items
+        ]
+    else:
+        rates = DEFAULT_RATES
+
+    columns = split(
+        [item.quantity for item in items],
+        [item.unit_price for item in items],
+        rates
+    )
+    for field in SPLIT_FIELDS:
+        for item, value in zip(items, columns[field]):
+            setattr(item, field, value)
+    return items
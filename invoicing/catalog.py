@@ -0,0 +1,165 @@
+"""
+Importación del catálogo de tratamientos.
+
+A catalog (CSV or JSON rows of code, name and price) is compared against the
+Treatment table with a single query, and the resulting diff (new codes,
+changed name/price or reactivated codes, and active codes missing from the
+catalog) is applied in one transaction with an upsert plus one UPDATE.
+"""
+import csv
+import io
+import json
+from decimal import Decimal
+from pathlib import Path
+from typing import NamedTuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from .dashboard import invalidate_dashboard
+from .importer import RecordError, parse_price
+from .models import Treatment
+from .treatment_index import invalidate_treatment_index
+
+
+CENT = Decimal('0.01')
+
+# Accepted column names (the export from the clinic system uses Spanish headers)
+COLUMN_ALIASES = {
+    'code': 'code', 'codigo': 'code', 'código': 'code',
+    'name': 'name', 'nombre': 'name', 'tratamiento': 'name',
+    'price': 'price', 'precio': 'price',
+}
+
+
+class CatalogError(ValueError):
+    pass
+
+
+class CatalogRow(NamedTuple):
+    code: str
+    name: str
+    price: Decimal
+
+
+class CatalogDiff(NamedTuple):
+    created: list      # CatalogRow
+    updated: list      # (Treatment, CatalogRow)
+    deactivated: list  # Treatment
+    unchanged: int
+
+    @property
+    def has_changes(self):
+        return bool(self.created or self.updated or self.deactivated)
+
+
+def _clean_row(raw, position):
+    row = {}
+    for key, value in raw.items():
+        field = COLUMN_ALIASES.get(str(key or '').strip().lower())
+        if field:
+            row[field] = value
+    missing = {'code', 'name', 'price'} - row.keys()
+    if missing:
+        raise CatalogError(f'Row {position}: missing {", ".join(sorted(missing))}.')
+
+    code = str(row['code']).strip()
+    name = str(row['name']).strip()
+    if not code or not name:
+        raise CatalogError(f'Row {position}: code and name are required.')
+    try:
+        price = parse_price(row['price'], Treatment._meta.get_field('price'))
+    except RecordError as error:
+        raise CatalogError(f'Row {position}: {error}')
+
+    code_length = Treatment._meta.get_field('code').max_length
+    name_length = Treatment._meta.get_field('name').max_length
+    if len(code) > code_length or len(name) > name_length:
+        raise CatalogError(f'Row {position}: code or name is too long.')
+    return CatalogRow(code, name, price)
+
+
+def parse_catalog(text, format):
+    """Parse CSV (comma or semicolon separated, with a header) or JSON catalog text"""
+    if format == 'json':
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as error:
+            raise CatalogError(f'Invalid JSON: {error}')
+        if isinstance(data, dict):
+            data = data.get('treatments', [])
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            raise CatalogError('JSON catalog must be a list of objects (or {"treatments": [...]}).')
+        raw_rows = enumerate(data, start=1)
+    elif format == 'csv':
+        try:
+            dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        raw_rows = enumerate(csv.DictReader(io.StringIO(text), dialect=dialect), start=2)
+    else:
+        raise CatalogError(f'Unknown catalog format: {format}')
+
+    rows = {}
+    for position, raw in raw_rows:
+        row = _clean_row(raw, position)
+        if row.code in rows:
+            raise CatalogError(f'Row {position}: duplicated code {row.code}.')
+        rows[row.code] = row
+    return list(rows.values())
+
+
+def read_catalog(path, format=None):
+    path = Path(path)
+    format = format or path.suffix.lstrip('.').lower()
+    # utf-8-sig drops the BOM Excel adds to CSV files
+    return parse_catalog(path.read_text(encoding='utf-8-sig'), format)
+
+
+def diff_catalog(rows, deactivate_missing=True):
+    """Compare catalog rows with the Treatment table (one query)"""
+    current = {treatment.code: treatment for treatment in Treatment.objects.all()}
+    created, updated = [], []
+    unchanged = 0
+    for row in rows:
+        treatment = current.pop(row.code, None)
+        if treatment is None:
+            created.append(row)
+        elif (treatment.name, treatment.price, treatment.is_active) != (row.name, row.price, True):
+            updated.append((treatment, row))
+        else:
+            unchanged += 1
+
+    deactivated = []
+    if deactivate_missing:
+        deactivated = sorted(
+            (treatment for treatment in current.values() if treatment.is_active),
+            key=lambda treatment: treatment.code
+        )
+    return CatalogDiff(created, updated, deactivated, unchanged)
+
+
+def apply_catalog(diff, batch_size=1000):
+    """Apply a catalog diff in one transaction"""
+    if not diff.has_changes:
+        return
+    upserts = [
+        Treatment(code=row.code, name=row.name, price=row.price, is_active=True)
+        for row in [*diff.created, *(row for _, row in diff.updated)]
+    ]
+    with transaction.atomic():
+        if upserts:
+            Treatment.objects.bulk_create(
+                upserts,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['code'],
+                update_fields=['name', 'price', 'is_active', 'updated_at'],
+            )
+        if diff.deactivated:
+            Treatment.objects.filter(
+                pk__in=[treatment.pk for treatment in diff.deactivated]
+            ).update(is_active=False, updated_at=timezone.now())
+        # Bulk writes skip the Treatment signals
+        transaction.on_commit(invalidate_treatment_index)
+        invalidate_dashboard()
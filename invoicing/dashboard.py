@@ -0,0 +1,89 @@
+"""
+Estadísticas del dashboard con caché.
+
+The snapshot (active treatments, invoices/revenue/items of the current month,
+unassigned invoices) is computed from the monthly summary and a couple of
+indexed COUNTs, then kept in the Django cache until invoicing.signals
+invalidates it after a committed change (or DASHBOARD_TTL expires). With
+several workers the cache must be shared for the invalidation to reach all
+of them (see CACHES in core/settings/production.py).
+"""
+from datetime import date
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+
+from .exports import period_range
+from .models import MonthlySummary, PatientInvoice, Treatment
+from .routers import read_from_primary
+from .totals import ZERO
+
+
+DASHBOARD_CACHE_KEY = 'invoicing:dashboard:{year}-{month:02d}'
+DASHBOARD_TTL = 15 * 60
+
+
+def compute_dashboard_stats(year, month):
+    start, end = period_range(year, month)
+    monthly = MonthlySummary.objects.filter(year=year, month=month).aggregate(
+        revenue=Sum('subtotal'),
+        items=Sum('item_count'),
+    )
+    return {
+        'total_treatments': Treatment.objects.filter(is_active=True).count(),
+        'monthly_invoices': PatientInvoice.objects.filter(date__gte=start, date__lt=end).count(),
+        # quantity x unit_price of every line
+        'monthly_revenue': monthly['revenue'] or ZERO,
+        'monthly_items': monthly['items'] or 0,
+        'unassigned_invoices': PatientInvoice.objects.filter(electronic_invoice__isnull=True).count(),
+    }
+
+
+async def acompute_dashboard_stats(year, month):
+    """compute_dashboard_stats() with the async ORM"""
+    start, end = period_range(year, month)
+    monthly = await MonthlySummary.objects.filter(year=year, month=month).aaggregate(
+        revenue=Sum('subtotal'),
+        items=Sum('item_count'),
+    )
+    return {
+        'total_treatments': await Treatment.objects.filter(is_active=True).acount(),
+        'monthly_invoices': await PatientInvoice.objects.filter(date__gte=start, date__lt=end).acount(),
+        'monthly_revenue': monthly['revenue'] or ZERO,
+        'monthly_items': monthly['items'] or 0,
+        'unassigned_invoices': await PatientInvoice.objects.filter(electronic_invoice__isnull=True).acount(),
+    }
+
+
+def dashboard_stats(today=None):
+    """Cached dashboard snapshot for the current month"""
+    today = today or date.today()
+    key = DASHBOARD_CACHE_KEY.format(year=today.year, month=today.month)
+    stats = cache.get(key)
+    if stats is None:
+        # Cached for DASHBOARD_TTL: never snapshot a lagging replica
+        with read_from_primary():
+            stats = compute_dashboard_stats(today.year, today.month)
+        cache.set(key, stats, DASHBOARD_TTL)
+    return stats
+
+
+async def adashboard_stats(today=None):
+    """dashboard_stats() for async views"""
+    today = today or date.today()
+    key = DASHBOARD_CACHE_KEY.format(year=today.year, month=today.month)
+    stats = await cache.aget(key)
+    if stats is None:
+        with read_from_primary():
+            stats = await acompute_dashboard_stats(today.year, today.month)
+        await cache.aset(key, stats, DASHBOARD_TTL)
+    return stats
+
+
+def invalidate_dashboard():
+    """Drop the cached snapshot once the current transaction commits"""
+    today = date.today()
+    transaction.on_commit(
+        lambda: cache.delete(DASHBOARD_CACHE_KEY.format(year=today.year, month=today.month))
+    )
@@ -4,6 +4,10 @@ from .models import (
     Branch, Treatment, ElectronicInvoice, 
     PatientInvoice, PatientInvoiceItem
 )
+from .exports import period_range
+from .grouping import GroupingRules
+from .importer import FORMATS, format_from_name
+from .search import search_patient_invoices
 
 class TreatmentForm(forms.ModelForm):
     """Formulario para tratamientos"""
@@ -234,6 +238,176 @@ class MonthlyReportForm(forms.Form):
         self.fields['month'].initial = today.month
         self.fields['year'].initial = today.year
 
+    def clean_year(self):
+        year = self.cleaned_data.get('year')
+        # The widget bounds are only a hint; the period must be a valid date range
+        try:
+            period_range(year)
+        except (OverflowError, ValueError):
+            raise ValidationError('Ingrese un año válido.')
+        return year
+
+
+class ItemExportForm(MonthlyReportForm):
+    """Formulario para exportar el detalle de facturas de un mes o de todo el año"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['month'].required = False
+        self.fields['month'].choices = [('', 'Todo el año')] + self.MONTH_CHOICES
+
+    def clean_month(self):
+        month = self.cleaned_data.get('month')
+        return int(month) if month else None
+
+
+class InvoiceGroupingForm(forms.Form):
+    """Reglas para agrupar facturas sin asignar en facturas electrónicas"""
+
+    PERIOD_CHOICES = [('', 'Sin agrupar por fecha'), ('day', 'Por día'), ('month', 'Por mes')]
+
+    branch = forms.ModelChoiceField(
+        queryset=Branch.objects.all(),
+        widget=forms.Select(attrs={'class': 'form-select'}),
+        label='Sucursal',
+        required=False,
+        empty_label='Todas las sucursales'
+    )
+    date_from = forms.DateField(
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
+        label='Desde',
+        required=False
+    )
+    date_to = forms.DateField(
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
+        label='Hasta',
+        required=False
+    )
+    by_branch = forms.BooleanField(
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+        label='Una factura electrónica por sucursal',
+        required=False,
+        initial=True
+    )
+    period = forms.ChoiceField(
+        choices=PERIOD_CHOICES,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+        label='Agrupar por fecha',
+        required=False
+    )
+    max_invoices = forms.IntegerField(
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'min': '1'}),
+        label='Máximo de facturas por factura electrónica',
+        min_value=1,
+        required=False
+    )
+    prefix = forms.CharField(
+        widget=forms.TextInput(attrs={'class': 'form-control'}),
+        label='Prefijo del número',
+        max_length=20,
+        initial='FE-'
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from, date_to = cleaned_data.get('date_from'), cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise ValidationError('La fecha inicial debe ser anterior a la final.')
+        return cleaned_data
+
+    def rules(self):
+        data = self.cleaned_data
+        return GroupingRules(
+            by_branch=data['by_branch'],
+            period=data['period'] or None,
+            max_invoices=data['max_invoices'],
+            branch=data['branch'].pk if data['branch'] else None,
+            date_from=data['date_from'],
+            date_to=data['date_to'],
+            prefix=data['prefix'],
+        )
+
+
+class UnassignedInvoiceFilterForm(forms.Form):
+    """Filtros del selector de facturas sin asignar"""
+
+    branch = forms.ModelChoiceField(
+        queryset=Branch.objects.all(),
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'}),
+        label='Sucursal',
+        required=False,
+        empty_label='Todas las sucursales'
+    )
+    date_from = forms.DateField(
+        widget=forms.DateInput(attrs={'class': 'form-control form-control-sm', 'type': 'date'}),
+        label='Desde',
+        required=False
+    )
+    date_to = forms.DateField(
+        widget=forms.DateInput(attrs={'class': 'form-control form-control-sm', 'type': 'date'}),
+        label='Hasta',
+        required=False
+    )
+    search = forms.CharField(
+        widget=forms.TextInput(attrs={
+            'class': 'form-control form-control-sm',
+            'placeholder': 'Número de factura o paciente...'
+        }),
+        label='Buscar',
+        required=False
+    )
+
+    def filter(self, queryset):
+        """Apply the valid filters (invalid values are ignored)"""
+        self.is_valid()
+        data = self.cleaned_data
+        if data.get('branch'):
+            queryset = queryset.filter(branch=data['branch'])
+        if data.get('date_from'):
+            queryset = queryset.filter(date__gte=data['date_from'])
+        if data.get('date_to'):
+            queryset = queryset.filter(date__lte=data['date_to'])
+        if data.get('search'):
+            queryset = search_patient_invoices(queryset, data['search'])
+        return queryset
+
+
+class AssignMatchingInvoicesForm(UnassignedInvoiceFilterForm):
+    """Asignar todas las facturas que cumplen el filtro, tal como las mostró el selector"""
+
+    matching_count = forms.IntegerField(min_value=0, widget=forms.HiddenInput)
+    matching_max_id = forms.IntegerField(min_value=0, widget=forms.HiddenInput)
+
+    def matching(self, queryset):
+        """The filtered invoices that already existed when the picker was shown"""
+        return self.filter(queryset).filter(id__lte=self.cleaned_data['matching_max_id'])
+
+
+class InvoiceImportForm(forms.Form):
+    """Formulario para importar facturas de pacientes desde CSV o JSONL"""
+
+    FORMAT_CHOICES = [('', 'Según la extensión'), ('csv', 'CSV'), ('jsonl', 'JSONL')]
+
+    file = forms.FileField(
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.jsonl,.ndjson'}),
+        label='Archivo'
+    )
+    format = forms.ChoiceField(
+        choices=FORMAT_CHOICES,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+        label='Formato',
+        required=False
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        upload = cleaned_data.get('file')
+        if upload and not cleaned_data.get('format'):
+            cleaned_data['format'] = format_from_name(upload.name)
+            if cleaned_data['format'] not in FORMATS:
+                raise ValidationError('Indique el formato del archivo (CSV o JSONL).')
+        return cleaned_data
+
 
 # New form for creating standalone patient invoices (new workflow)
 class StandalonePatientInvoiceForm(forms.ModelForm):
@@ -0,0 +1,49 @@
+"""
+Caché de fragmentos de las listas de facturas.
+
+Each row of the patient and electronic invoice lists is rendered once and
+kept with ``{% cache %}``, keyed by everything the row shows: the invoice's
+pk and ``updated_at``, its stored total (refreshed with UPDATEs that leave
+``updated_at`` alone), the latest change of its items or the number of
+assigned patient invoices, and the branch version. A change gives the row a
+new key, so stale fragments are never served and simply expire
+(after 24 hours, set in the templates).
+
+The branch filter dropdown is cached under the branch version, a counter in
+the Django cache bumped by invoicing.signals whenever a branch is saved or
+deleted; branch names printed in the rows depend on it too.
+"""
+import time
+
+from django.core.cache import cache
+from django.db.models import Max, OuterRef, Subquery
+
+from .models import PatientInvoiceItem
+
+
+BRANCH_VERSION_KEY = 'invoicing:branch-version'
+
+
+def annotate_items_changed(queryset):
+    """Annotate patient invoices with the latest change of their items"""
+    return queryset.annotate(items_changed=Subquery(
+        PatientInvoiceItem.objects.filter(patient_invoice=OuterRef('pk'))
+        .order_by().values('patient_invoice').annotate(latest=Max('updated_at')).values('latest')
+    ))
+
+
+async def abranch_version():
+    version = await cache.aget(BRANCH_VERSION_KEY)
+    if version is None:
+        # Never restart from a number an evicted counter may already have used
+        await cache.aadd(BRANCH_VERSION_KEY, int(time.time()), None)
+        version = await cache.aget(BRANCH_VERSION_KEY)
+    return version
+
+
+def bump_branch_version():
+    """Give every fragment that shows branches a new key"""
+    try:
+        cache.incr(BRANCH_VERSION_KEY)
+    except ValueError:
+        cache.add(BRANCH_VERSION_KEY, int(time.time()), None)
@@ -0,0 +1,172 @@
+"""
+Agrupación automática de facturas de pacientes en facturas electrónicas.
+
+The unassigned patient invoices matching the filters are locked and split
+into groups (per branch, per day or month, and at most ``max_invoices`` per
+group). One electronic invoice is created per group, numbered after the
+highest existing ``<prefix><digits>`` number, and the invoices are assigned
+with set-based UPDATEs that only touch rows that are still unassigned, so a
+user assigning invoices at the same time never has them taken over. The
+counts reported are the rows actually updated.
+"""
+import re
+from itertools import groupby
+from typing import NamedTuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import BigIntegerField, Sum
+from django.db.models.functions import Cast, Substr
+from django.utils import timezone
+
+from .dashboard import invalidate_dashboard
+from .models import TOTAL_FIELDS, ElectronicInvoice, PatientInvoice
+from .totals import ZERO
+
+
+PERIODS = ('day', 'month')
+
+NUMBER_DIGITS = 8
+
+# Keeps every UPDATE ... WHERE id IN (...) under the SQLite variable limit
+UPDATE_BATCH_SIZE = 900
+
+
+class GroupingRules(NamedTuple):
+    by_branch: bool = True
+    period: str = None         # None, 'day' or 'month'
+    max_invoices: int = None   # None for no limit
+    branch: int = None         # only this branch id
+    date_from: object = None
+    date_to: object = None
+    prefix: str = 'FE-'
+
+
+class Group(NamedTuple):
+    key: tuple
+    date: object           # issue date: the date of the newest invoice in the group
+    invoice_ids: list
+
+
+class GroupingResult(NamedTuple):
+    electronic_invoices: list
+    assigned: int
+    skipped: int           # candidates assigned by someone else in the meantime
+
+
+def candidates(rules):
+    queryset = PatientInvoice.objects.filter(electronic_invoice__isnull=True)
+    if rules.branch:
+        queryset = queryset.filter(branch_id=rules.branch)
+    if rules.date_from:
+        queryset = queryset.filter(date__gte=rules.date_from)
+    if rules.date_to:
+        queryset = queryset.filter(date__lte=rules.date_to)
+    return queryset
+
+
+def _group_key(rules, branch_id, on_date):
+    key = (branch_id,) if rules.by_branch else ()
+    if rules.period == 'day':
+        key += (on_date,)
+    elif rules.period == 'month':
+        key += (on_date.year, on_date.month)
+    return key
+
+
+def plan_groups(rules, rows=None):
+    """Split ``(id, branch_id, date)`` rows (default: the current candidates) into groups"""
+    if rows is None:
+        rows = candidates(rules).values_list('id', 'branch_id', 'date')
+    rows = sorted(rows, key=lambda row: (_group_key(rules, row[1], row[2]), row[2], row[0]))
+    groups = []
+    for key, members in groupby(rows, key=lambda row: _group_key(rules, row[1], row[2])):
+        members = list(members)
+        size = rules.max_invoices or len(members)
+        for start in range(0, len(members), size):
+            chunk = members[start:start + size]
+            groups.append(Group(key, max(row[2] for row in chunk), [row[0] for row in chunk]))
+    return groups
+
+
+def next_numbers(prefix, count):
+    """The next ``count`` free ``<prefix><digits>`` electronic invoice numbers"""
+    pattern = rf'^{re.escape(prefix)}[0-9]+$'
+    # Numeric order: as strings, FE-99999999 would sort after FE-100000000
+    last = (
+        ElectronicInvoice.objects.filter(invoice_number__regex=pattern)
+        .annotate(number=Cast(Substr('invoice_number', len(prefix) + 1), BigIntegerField()))
+        .order_by('-number').values_list('number', flat=True).first()
+    )
+    start = last + 1 if last is not None else 1
+    width = max(NUMBER_DIGITS, len(str(start + count - 1)))
+    return [f'{prefix}{number:0{width}d}' for number in range(start, start + count)]
+
+
+def _create_electronic_invoices(groups, prefix, attempts=3):
+    for attempt in range(attempts):
+        numbers = next_numbers(prefix, len(groups))
+        try:
+            # A concurrent run may take the same numbers: retry from the new maximum
+            with transaction.atomic():
+                return ElectronicInvoice.objects.bulk_create([
+                    ElectronicInvoice(invoice_number=number, date=group.date)
+                    for number, group in zip(numbers, groups)
+                ])
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+
+
+def _refresh_totals(electronic_invoices):
+    """Stored totals of the new electronic invoices, with one grouped aggregate"""
+    sums = {
+        row['electronic_invoice']: row
+        for row in PatientInvoice.objects.filter(electronic_invoice__in=electronic_invoices)
+        .values('electronic_invoice').annotate(**{field: Sum(field) for field in TOTAL_FIELDS}).order_by()
+    }
+    for electronic_invoice in electronic_invoices:
+        row = sums.get(electronic_invoice.pk, {})
+        for field in TOTAL_FIELDS:
+            setattr(electronic_invoice, field, row.get(field) or ZERO)
+    ElectronicInvoice.objects.bulk_update(electronic_invoices, TOTAL_FIELDS, batch_size=UPDATE_BATCH_SIZE)
+
+
+def group_invoices(rules):
+    """Create the electronic invoices for the current candidates and assign them"""
+    with transaction.atomic():
+        # Lock the candidates. SQLite ignores FOR UPDATE: there the run is only
+        # serialized from its start under the IMMEDIATE transaction mode of the
+        # production settings; otherwise invoices assigned concurrently
+        # before the UPDATEs are left alone and reported as skipped
+        rows = list(
+            candidates(rules).select_for_update()
+            .values_list('id', 'branch_id', 'date')
+        )
+        groups = plan_groups(rules, rows)
+        if not groups:
+            return GroupingResult([], 0, 0)
+
+        electronic_invoices = _create_electronic_invoices(groups, rules.prefix)
+        now = timezone.now()
+        assigned = {}
+        for electronic_invoice, group in zip(electronic_invoices, groups):
+            assigned[electronic_invoice.pk] = sum(
+                PatientInvoice.objects.filter(
+                    id__in=group.invoice_ids[start:start + UPDATE_BATCH_SIZE],
+                    electronic_invoice__isnull=True,
+                ).update(electronic_invoice=electronic_invoice, updated_at=now)
+                for start in range(0, len(group.invoice_ids), UPDATE_BATCH_SIZE)
+            )
+
+        # Groups whose invoices were all assigned concurrently are dropped
+        empty = [pk for pk, count in assigned.items() if not count]
+        if empty:
+            ElectronicInvoice.objects.filter(pk__in=empty).delete()
+        electronic_invoices = [
+            electronic_invoice for electronic_invoice in electronic_invoices if assigned[electronic_invoice.pk]
+        ]
+        _refresh_totals(electronic_invoices)
+        invalidate_dashboard()
+
+    total = sum(assigned.values())
+    return GroupingResult(electronic_invoices, total, len(rows) - total)
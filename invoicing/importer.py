@@ -0,0 +1,419 @@
+"""
+Importación de facturas de pacientes.
+
+Invoices with their treatment lines are read from CSV (one row per item,
+consecutive rows with the same branch and invoice number form one invoice)
+or JSONL (one invoice object with an ``items`` list per line) without loading
+the whole file. Records are validated in chunks against in-memory maps of the
+branches and active treatments plus one duplicate lookup per chunk, and each
+chunk is written in its own transaction by ``create_invoices`` with bulk
+inserts. Rejected records are reported with their line number; the line of
+the last committed record is passed to ``on_commit`` so an interrupted
+import can resume after it.
+"""
+import csv
+import itertools
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import NamedTuple
+
+from django.db import transaction
+
+from .billing import apply_splits, get_rate_table
+from .dashboard import invalidate_dashboard
+from .models import TOTAL_FIELDS, Branch, ElectronicInvoice, PatientInvoice, PatientInvoiceItem, Treatment
+from .pdf import invalidate_electronic_invoice_pdf
+from .summary import period_cells, refresh_cells
+from .treatment_index import fold
+
+
+FORMATS = ('csv', 'jsonl')
+
+CENT = Decimal('0.01')
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+# Largest PositiveIntegerField value on every database Django supports
+MAX_QUANTITY = 2147483647
+
+INVOICE_FIELDS = ('invoice_number', 'patient_name', 'branch', 'date')
+
+# Accepted column/key names (the export from the clinic system uses Spanish headers)
+COLUMN_ALIASES = {
+    'invoice_number': 'invoice_number', 'factura': 'invoice_number',
+    'numero': 'invoice_number', 'número': 'invoice_number',
+    'patient_name': 'patient_name', 'patient': 'patient_name', 'paciente': 'patient_name',
+    'branch': 'branch', 'sucursal': 'branch',
+    'date': 'date', 'fecha': 'date',
+    'treatment_code': 'treatment_code', 'code': 'treatment_code',
+    'codigo': 'treatment_code', 'código': 'treatment_code',
+    'quantity': 'quantity', 'cantidad': 'quantity',
+    'unit_price': 'unit_price', 'price': 'unit_price', 'precio': 'unit_price',
+    'items': 'items', 'tratamientos': 'items',
+}
+
+
+class InvoiceImportError(ValueError):
+    """The file itself cannot be imported (unknown format, missing columns)"""
+
+
+class RecordError(ValueError):
+    """One invoice record is invalid; the rest of the import goes on"""
+
+
+class InvoiceRecord(NamedTuple):
+    line: int
+    data: dict
+    error: str = ''
+
+
+class RowError(NamedTuple):
+    line: int
+    invoice_number: str
+    message: str
+
+
+class ImportResult:
+    """Counters of an import run, with the first ``keep_errors`` rejected records"""
+
+    def __init__(self, keep_errors=200):
+        self.invoices = 0
+        self.items = 0
+        self.rejected = 0
+        self.last_line = 0
+        self.errors = []
+        self._keep_errors = keep_errors
+
+    def add_error(self, error):
+        self.rejected += 1
+        if len(self.errors) < self._keep_errors:
+            self.errors.append(error)
+
+
+def _normalize(raw):
+    return {
+        COLUMN_ALIASES[key]: value
+        for key, value in ((str(key or '').strip().lower(), value) for key, value in raw.items())
+        if key in COLUMN_ALIASES
+    }
+
+
+def iter_csv_records(lines):
+    """Group consecutive CSV rows of the same branch and invoice number into records"""
+    lines = iter(lines)
+    header = next(lines, '')
+    try:
+        dialect = csv.Sniffer().sniff(header, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(itertools.chain([header], lines), dialect=dialect)
+    columns = {COLUMN_ALIASES.get(str(name).strip().lower()) for name in reader.fieldnames or ()}
+    missing = {*INVOICE_FIELDS, 'treatment_code'} - columns
+    if missing:
+        raise InvoiceImportError(f'Missing columns: {", ".join(sorted(missing))}.')
+
+    record = None
+    for row in reader:
+        row = _normalize(row)
+        key = (str(row.get('branch') or '').strip(), str(row.get('invoice_number') or '').strip())
+        item = {field: row.get(field) for field in ('treatment_code', 'quantity', 'unit_price')}
+        if record is not None and record[2] == key:
+            record[1]['items'].append(item)
+            if any(str(row.get(field) or '').strip() != str(record[1][field] or '').strip()
+                   for field in INVOICE_FIELDS):
+                record[3] = f'Line {reader.line_num}: invoice fields differ from the first row of the invoice.'
+            continue
+        if record is not None:
+            yield InvoiceRecord(record[0], record[1], record[3])
+        data = {field: row.get(field) for field in INVOICE_FIELDS}
+        data['items'] = [item]
+        record = [reader.line_num, data, key, '']
+    if record is not None:
+        yield InvoiceRecord(record[0], record[1], record[3])
+
+
+def object_record(position, data):
+    """Record from one decoded invoice object (a JSONL line or an API payload entry)"""
+    if not isinstance(data, dict):
+        return InvoiceRecord(position, {}, 'Each invoice must be a JSON object.')
+    data = _normalize(data)
+    items = data.get('items')
+    if isinstance(items, list):
+        data['items'] = [_normalize(item) if isinstance(item, dict) else item for item in items]
+    return InvoiceRecord(position, data)
+
+
+def iter_jsonl_records(lines):
+    for line, text in enumerate(lines, start=1):
+        if not text.strip():
+            continue
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as error:
+            yield InvoiceRecord(line, {}, f'Invalid JSON: {error}')
+            continue
+        yield object_record(line, data)
+
+
+def iter_records(lines, format):
+    if format == 'csv':
+        return iter_csv_records(lines)
+    if format == 'jsonl':
+        return iter_jsonl_records(lines)
+    raise InvoiceImportError(f'Unknown import format: {format}')
+
+
+def format_from_name(name):
+    suffix = str(name).rsplit('.', 1)[-1].lower()
+    return 'jsonl' if suffix in ('jsonl', 'ndjson') else suffix
+
+
+def _text(value, field, max_length, required=True):
+    text = str(value if value is not None else '').strip()
+    if required and not text:
+        raise RecordError(f'{field} is required.')
+    if len(text) > max_length:
+        raise RecordError(f'{field} is longer than {max_length} characters.')
+    return text
+
+
+def _date(value):
+    if hasattr(value, 'year'):
+        return value
+    text = str(value or '').strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            pass
+    raise RecordError(f'Invalid date {text!r} (use YYYY-MM-DD or DD/MM/YYYY).')
+
+
+def fits_field(value, field):
+    """Whether a Decimal fits the integer digits of a DecimalField"""
+    return abs(value) < 10 ** (field.max_digits - field.decimal_places)
+
+
+def parse_price(value, field):
+    """Parse a non-negative price that fits ``field``; RecordError otherwise"""
+    try:
+        price = Decimal(str(value).strip().replace(',', ''))
+        # NaN and Infinity parse, but cannot be compared or stored
+        if not price.is_finite():
+            raise InvalidOperation
+        price = price.quantize(CENT)
+    except InvalidOperation:
+        raise RecordError(f'Invalid price {value!r}.')
+    if price < 0:
+        raise RecordError('Price cannot be negative.')
+    if not fits_field(price, field):
+        raise RecordError(f'Price {value!r} is too large.')
+    return price
+
+
+def _quantity(value, unit_price):
+    if value in (None, ''):
+        return 1
+    try:
+        quantity = int(str(value).strip())
+    except ValueError:
+        raise RecordError(f'Invalid quantity {value!r}.')
+    if quantity <= 0:
+        raise RecordError('Quantity must be greater than zero.')
+    if quantity > MAX_QUANTITY:
+        raise RecordError(f'Quantity {value!r} is too large.')
+    if not fits_field(quantity * unit_price, PatientInvoiceItem._meta.get_field('subtotal')):
+        raise RecordError(f'Quantity {value!r} times the unit price is too large.')
+    return quantity
+
+
+def _price(value, default):
+    if value in (None, ''):
+        return default
+    return parse_price(value, PatientInvoiceItem._meta.get_field('unit_price'))
+
+
+def create_invoices(entries, table=None, batch_size=1000):
+    """
+    Insert ``(PatientInvoice, [PatientInvoiceItem])`` pairs with bulk inserts.
+    Splits and stored totals are computed here since bulk_create skips save()
+    and the signals; the summary cells, electronic invoice totals and cached
+    dashboard are refreshed the same way the signals would. Returns the invoices.
+    """
+    entries = list(entries)
+    if not entries:
+        return []
+    apply_splits([item for _, items in entries for item in items], table)
+    for invoice, items in entries:
+        for field in TOTAL_FIELDS:
+            setattr(invoice, field, sum((getattr(item, field) for item in items), Decimal('0')))
+
+    with transaction.atomic():
+        invoices = PatientInvoice.objects.bulk_create(
+            [invoice for invoice, _ in entries], batch_size=batch_size
+        )
+        items = []
+        cells = set()
+        for invoice, invoice_items in entries:
+            for item in invoice_items:
+                item.patient_invoice = invoice
+                items.append(item)
+            cells |= period_cells(invoice.date, invoice.branch_id, {item.treatment_id for item in invoice_items})
+        PatientInvoiceItem.objects.bulk_create(items, batch_size=batch_size)
+        refresh_cells(cells)
+
+        for electronic_invoice_id in {invoice.electronic_invoice_id for invoice in invoices} - {None}:
+            ElectronicInvoice(pk=electronic_invoice_id).refresh_totals()
+            invalidate_electronic_invoice_pdf(electronic_invoice_id)
+        invalidate_dashboard()
+    return invoices
+
+
+def add_items(patient_invoice, items, table=None):
+    """
+    Insert new items into an existing invoice with one bulk insert, then
+    refresh its stored totals (and electronic invoice), summary cells and
+    dashboard as the item signals would. Returns the items.
+    """
+    items = list(items)
+    if not items:
+        return []
+    for item in items:
+        item.patient_invoice = patient_invoice
+    apply_splits(items, table)
+    with transaction.atomic():
+        PatientInvoiceItem.objects.bulk_create(items)
+        invalidate_electronic_invoice_pdf(patient_invoice.refresh_totals())
+        refresh_cells(period_cells(
+            patient_invoice.date, patient_invoice.branch_id, {item.treatment_id for item in items}
+        ))
+        invalidate_dashboard()
+    return items
+
+
+class InvoiceImporter:
+    """Validate invoice records in chunks and write the valid ones with create_invoices"""
+
+    def __init__(self, chunk_size=500, dry_run=False):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.branches = {}
+        for pk, name in Branch.objects.values_list('pk', 'name'):
+            self.branches[fold(name.strip())] = pk
+            self.branches[str(pk)] = pk
+        self.treatments = {
+            code: (pk, price)
+            for pk, code, price in Treatment.objects.filter(is_active=True).values_list('pk', 'code', 'price')
+        }
+        self.table = get_rate_table()
+        self.seen = set()
+        self.max_lengths = {
+            field: PatientInvoice._meta.get_field(field).max_length
+            for field in ('invoice_number', 'patient_name')
+        }
+
+    def build(self, record):
+        """Validate one record and build its unsaved invoice and items"""
+        if record.error:
+            raise RecordError(record.error)
+        data = record.data
+        branch_id = self.branches.get(fold(str(data.get('branch') or '').strip()))
+        if branch_id is None:
+            raise RecordError(f'Unknown branch {data.get("branch")!r}.')
+        invoice = PatientInvoice(
+            invoice_number=_text(data.get('invoice_number'), 'invoice_number', self.max_lengths['invoice_number']),
+            patient_name=_text(data.get('patient_name'), 'patient_name', self.max_lengths['patient_name']),
+            branch_id=branch_id,
+            date=_date(data.get('date')),
+        )
+
+        items = []
+        treatment_ids = set()
+        if not isinstance(data.get('items'), list) or not data['items']:
+            raise RecordError('The invoice has no items.')
+        for item in data['items']:
+            if not isinstance(item, dict):
+                raise RecordError('Each item must be an object.')
+            code = str(item.get('treatment_code') or '').strip()
+            if code not in self.treatments:
+                raise RecordError(f'Unknown or inactive treatment code {code!r}.')
+            treatment_id, price = self.treatments[code]
+            if treatment_id in treatment_ids:
+                raise RecordError(f'Treatment {code} appears twice in the invoice.')
+            treatment_ids.add(treatment_id)
+            unit_price = _price(item.get('unit_price'), price)
+            items.append(PatientInvoiceItem(
+                patient_invoice=invoice,
+                treatment_id=treatment_id,
+                quantity=_quantity(item.get('quantity'), unit_price),
+                unit_price=unit_price,
+            ))
+        return invoice, items
+
+    def validate(self, records, on_error):
+        """Build the valid records of a chunk; duplicates are checked with one query"""
+        built = []
+        for record in records:
+            try:
+                built.append((record, *self.build(record)))
+            except RecordError as error:
+                on_error(RowError(record.line, str(record.data.get('invoice_number') or ''), str(error)))
+
+        existing = set(
+            PatientInvoice.objects.filter(
+                invoice_number__in={invoice.invoice_number for _, invoice, _ in built}
+            ).values_list('branch_id', 'invoice_number')
+        )
+        entries = []
+        for record, invoice, items in built:
+            key = (invoice.branch_id, invoice.invoice_number)
+            if key in existing or key in self.seen:
+                on_error(RowError(record.line, invoice.invoice_number, 'The invoice already exists in this branch.'))
+                continue
+            self.seen.add(key)
+            entries.append((invoice, items))
+        return entries
+
+    def run(self, records, resume_after=0, on_error=None, on_commit=None, result=None):
+        """
+        Import the records; ``on_error`` receives each RowError and ``on_commit``
+        the line of the last record of every committed chunk.
+        """
+        result = result or ImportResult()
+
+        def report(error):
+            result.add_error(error)
+            if on_error:
+                on_error(error)
+
+        records = (record for record in records if record.line > resume_after)
+        while True:
+            chunk = list(itertools.islice(records, self.chunk_size))
+            if not chunk:
+                break
+            entries = self.validate(chunk, report)
+            if not self.dry_run:
+                create_invoices(entries, self.table)
+            result.invoices += len(entries)
+            result.items += sum(len(items) for _, items in entries)
+            result.last_line = chunk[-1].line
+            if on_commit and not self.dry_run:
+                on_commit(result.last_line)
+        return result
+
+
+def create_invoices_from_objects(objects):
+    """
+    Validate decoded invoice objects together and create all of them in one
+    transaction, or none if any is invalid. Returns ``(invoices, errors)``
+    where each RowError's line is the object's index.
+    """
+    importer = InvoiceImporter(chunk_size=len(objects))
+    errors = []
+    entries = importer.validate(
+        [object_record(index, data) for index, data in enumerate(objects)], errors.append
+    )
+    if errors:
+        return [], errors
+    return create_invoices(entries, importer.table), []
@@ -0,0 +1,195 @@
+import json
+import platform
+import statistics
+import time
+from datetime import datetime
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+
+from invoicing import urls as invoicing_urls
+from invoicing.models import Branch, Treatment, ElectronicInvoice, PatientInvoice, PatientInvoiceItem
+from invoicing.pdf import get_pdf_cache
+
+
+# Extra query strings timed for some routes, on top of the bare URL
+ROUTE_VARIANTS = {
+    'patient_invoice_list': [
+        {'assigned': 'no'}, {'branch': '{branch}'}, {'search': 'jose mora'}, {'count': '1'},
+    ],
+    'electronic_invoice_list': [{'year': '{year}'}, {'year': '{year}', 'month': '{month}'}],
+    'treatment_list': [{'search': 'endo'}],
+    'monthly_report': [{'year': '{year}', 'month': '{month}'}],
+    'export_items': [{'year': '{year}', 'month': '{month}'}],
+    'get_treatments_ajax': [{'search': 'endo'}, {'search': 'apicectomia'}],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Time every invoicing route against the current database and write a JSON '
+        'report; pass --compare to flag regressions against a previous report'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Timed requests per route')
+        parser.add_argument('--warmup', type=int, default=1, help='Untimed requests per route')
+        parser.add_argument('--user', help='Staff username to run as (default: first superuser)')
+        parser.add_argument('--only', nargs='+', help='Only these URL names')
+        parser.add_argument('--cold-pdf', action='store_true', help='Empty the PDF cache before each PDF request')
+        parser.add_argument('--output', help='Write the JSON report here (default: stdout)')
+        parser.add_argument('--compare', help='Previous JSON report to compare medians against')
+        parser.add_argument(
+            '--threshold', type=float, default=20.0,
+            help='Regression threshold in percent for --compare (default: 20)'
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] <= 0:
+            raise CommandError('--repeat must be greater than zero.')
+
+        user = self.get_user(options['user'])
+        samples = self.sample_objects()
+        client = Client()
+        client.force_login(user)
+
+        results = []
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for name, url in self.routes(samples, options['only']):
+                results.append(self.time_route(client, name, url, options))
+                self.stderr.write(
+                    f"{results[-1]['timings_ms']['median']:9.1f} ms  {results[-1]['queries']:4d} q  {url}"
+                )
+
+        report = {
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'data': {
+                model.__name__: model.objects.count()
+                for model in (Branch, Treatment, ElectronicInvoice, PatientInvoice, PatientInvoiceItem)
+            },
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as report_file:
+                report_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            self.compare(options['compare'], report, options['threshold'])
+
+    def get_user(self, username):
+        User = get_user_model()
+        users = User.objects.filter(is_active=True, is_staff=True)
+        user = users.filter(username=username).first() if username else users.filter(is_superuser=True).first()
+        if user is None:
+            raise CommandError('No active staff user found; create one or pass --user.')
+        return user
+
+    def sample_objects(self):
+        """Representative (largest) objects to fill the URL parameters"""
+        patient_invoice = (
+            PatientInvoice.objects.annotate(item_total=Count('items'))
+            .order_by('-item_total').first()
+        )
+        electronic_invoice = (
+            ElectronicInvoice.objects.annotate(invoice_total=Count('patient_invoices'))
+            .order_by('-invoice_total').first()
+        )
+        if patient_invoice is None or electronic_invoice is None:
+            raise CommandError('No invoices to benchmark; run generate_data first.')
+        latest = PatientInvoice.objects.order_by('-date').values_list('date', flat=True).first()
+        return {
+            'patient_invoice': patient_invoice.pk,
+            'electronic_invoice': electronic_invoice.pk,
+            'treatment': Treatment.objects.values_list('pk', flat=True).first(),
+            'branch': Branch.objects.values_list('pk', flat=True).first(),
+            'year': latest.year,
+            'month': latest.month,
+        }
+
+    def routes(self, samples, only):
+        for pattern in invoicing_urls.urlpatterns:
+            if not isinstance(pattern, URLPattern) or (only and pattern.name not in only):
+                continue
+            kwargs = {}
+            for argument in pattern.pattern.converters:
+                kwargs[argument] = self.url_argument(pattern.name, argument, samples)
+            url = reverse(f'{invoicing_urls.app_name}:{pattern.name}', kwargs=kwargs)
+            yield pattern.name, url
+            for variant in ROUTE_VARIANTS.get(pattern.name, []):
+                query = '&'.join(f'{key}={value.format(**samples)}' for key, value in variant.items())
+                yield pattern.name, f'{url}?{query}'
+
+    def url_argument(self, name, argument, samples):
+        if argument == 'electronic_invoice_id' or name.startswith('electronic_invoice'):
+            return samples['electronic_invoice']
+        for prefix in ('patient_invoice', 'treatment', 'branch'):
+            if name.startswith(prefix):
+                return samples[prefix]
+        raise CommandError(f'Do not know how to fill <{argument}> of {name}.')
+
+    def time_route(self, client, name, url, options):
+        timings = []
+        for run in range(options['warmup'] + options['repeat']):
+            if options['cold_pdf'] and name == 'electronic_invoice_pdf':
+                get_pdf_cache().invalidate(url.strip('/').split('/')[-2])
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(url)
+                size = len(b''.join(response.streaming_content)) if response.streaming else len(response.content)
+                elapsed = time.perf_counter() - started
+            if run >= options['warmup']:
+                timings.append(elapsed * 1000)
+
+        timings.sort()
+        return {
+            'route': name,
+            'url': url,
+            'status': response.status_code,
+            'queries': len(queries),
+            'bytes': size,
+            'timings_ms': {
+                'min': round(timings[0], 2),
+                'median': round(statistics.median(timings), 2),
+                'p95': round(timings[max(0, round(len(timings) * 0.95) - 1)], 2),
+                'max': round(timings[-1], 2),
+                'mean': round(statistics.mean(timings), 2),
+            },
+        }
+
+    def compare(self, path, report, threshold):
+        with open(path, encoding='utf-8') as baseline_file:
+            baseline = {result['url']: result for result in json.load(baseline_file)['results']}
+
+        regressions = 0
+        self.stderr.write(f'\nComparison with {path} (median, threshold {threshold:.0f}%):')
+        for result in report['results']:
+            previous = baseline.get(result['url'])
+            if previous is None:
+                continue
+            before, after = previous['timings_ms']['median'], result['timings_ms']['median']
+            change = (after - before) / before * 100 if before else 0.0
+            flag = ''
+            if change > threshold or result['queries'] > previous['queries']:
+                flag = '  REGRESSION'
+                regressions += 1
+            self.stderr.write(
+                f"{before:9.1f} -> {after:9.1f} ms ({change:+6.1f}%)  "
+                f"{previous['queries']:4d} -> {result['queries']:4d} q  {result['url']}{flag}"
+            )
+        if regressions:
+            raise CommandError(f'{regressions} route(s) regressed.')
@@ -0,0 +1,201 @@
+import json
+import multiprocessing
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+from invoicing.models import Branch, Treatment
+
+
+# Django's own SQLite defaults (rollback journal, deferred transactions, 5 s
+# busy timeout) versus the OPTIONS of the active settings
+PROFILES = ('baseline', 'configured')
+
+
+def _write_invoices(path, options, worker, run, invoices, items, pause, branches, codes, queue):
+    """Worker process: create invoices one transaction at a time and report the lock waits"""
+    try:
+        queue.put(_timed_writes(path, options, worker, run, invoices, items, pause, branches, codes))
+    except BaseException as error:
+        queue.put({'error': repr(error)})
+        raise
+
+
+def _timed_writes(path, options, worker, run, invoices, items, pause, branches, codes):
+    if not apps.ready:
+        # Spawned (not forked) workers start without Django
+        django.setup()
+    from invoicing.importer import InvoiceImporter, create_invoices, object_record
+
+    connection = connections[DEFAULT_DB_ALIAS]
+    connection.close()
+    connection.settings_dict.update(NAME=str(path), OPTIONS=options)
+    rng = random.Random(worker)
+    importer = InvoiceImporter()
+    latencies = []
+    locked = 0
+    lost = 0.0
+
+    started = time.time()
+    for number in range(invoices):
+        data = {
+            'invoice_number': f'BENCH-{run}-{worker}-{number}',
+            'patient_name': f'Paciente {worker}-{number}',
+            'branch': rng.choice(branches),
+            'date': (date.today() - timedelta(days=rng.randrange(60))).isoformat(),
+            'items': [
+                {'treatment_code': code, 'quantity': rng.randint(1, 3)}
+                for code in rng.sample(codes, min(items, len(codes)))
+            ],
+        }
+        first = time.perf_counter()
+        while True:
+            attempt = time.perf_counter()
+            try:
+                # Read (duplicate check) then write in one transaction, like the form views
+                with transaction.atomic():
+                    entries = importer.validate([object_record(number, data)], lambda error: None)
+                    create_invoices(entries, importer.table)
+                break
+            except OperationalError as error:
+                if 'locked' not in str(error):
+                    raise
+                locked += 1
+                lost += time.perf_counter() - attempt
+                time.sleep(rng.uniform(0.001, 0.01))
+        latencies.append(time.perf_counter() - first)
+        if pause:
+            time.sleep(rng.uniform(0, 2 * pause))
+    connection.close()
+    return {
+        'started': started, 'finished': time.time(),
+        'latencies': latencies, 'locked': locked, 'lost': lost,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Create invoices with their items from several processes at once against a copy of '
+        'the SQLite database and report throughput and lock waits, with Django\'s default SQLite '
+        'options (baseline) and with the ones of the active settings (configured)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Writer processes')
+        parser.add_argument('--invoices', type=int, default=200, help='Invoices per writer')
+        parser.add_argument('--items', type=int, default=3, help='Items per invoice')
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Mean milliseconds each writer waits between invoices (default 0: saturate the write lock)'
+        )
+        parser.add_argument('--profile', nargs='+', choices=PROFILES, default=list(PROFILES))
+        parser.add_argument('--output', help='Write the JSON report here')
+
+    def handle(self, *args, **options):
+        if options['workers'] <= 0 or options['invoices'] <= 0 or options['items'] <= 0:
+            raise CommandError('--workers, --invoices and --items must be greater than zero.')
+        if options['pause'] < 0:
+            raise CommandError('--pause cannot be negative.')
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('benchmark_writes measures SQLite locking only.')
+        branches = list(Branch.objects.values_list('name', flat=True))
+        codes = list(Treatment.objects.filter(is_active=True).values_list('code', flat=True))
+        if not branches or not codes:
+            raise CommandError('The database needs branches and active treatments (see generate_data).')
+
+        configured = settings.DATABASES[DEFAULT_DB_ALIAS].get('OPTIONS', {})
+        if 'configured' in options['profile'] and not configured:
+            self.stderr.write(self.style.WARNING(
+                'The active settings have no SQLite OPTIONS; try --settings=core.settings.production.'
+            ))
+
+        results = []
+        with tempfile.TemporaryDirectory() as directory:
+            source = Path(directory, 'source.sqlite3')
+            primary.ensure_connection()
+            with sqlite3.connect(source) as target:
+                primary.connection.backup(target)
+                # Start every profile from a rollback journal, as a fresh database would
+                target.execute('PRAGMA journal_mode=DELETE')
+            target.close()
+            primary.close()
+
+            for profile in options['profile']:
+                path = Path(directory, f'{profile}.sqlite3')
+                shutil.copyfile(source, path)
+                results.append(self.run(profile, path, {} if profile == 'baseline' else configured,
+                                        branches, codes, options))
+
+        self.stdout.write(f"{'profile':<12}{'inv/s':>9}{'items/s':>9}{'locked':>8}{'lost s':>8}"
+                          f"{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+        for result in results:
+            self.stdout.write(
+                f"{result['profile']:<12}{result['invoices_per_second']:>9.1f}{result['items_per_second']:>9.1f}"
+                f"{result['locked_errors']:>8}{result['seconds_lost_to_locks']:>8.2f}"
+                f"{result['latency_ms']['p50']:>9.1f}{result['latency_ms']['p95']:>9.1f}"
+                f"{result['latency_ms']['max']:>9.1f}"
+            )
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}."))
+
+    def run(self, profile, path, db_options, branches, codes, options):
+        self.stderr.write(f"{profile}: {options['workers']} writers x {options['invoices']} invoices...")
+        # Switching to WAL needs the database to itself: do it once, as a
+        # long-running deployment would have, instead of inside the race
+        with sqlite3.connect(path) as target:
+            target.executescript(db_options.get('init_command', ''))
+        target.close()
+        # Workers must not inherit an open SQLite connection
+        connections.close_all()
+        context = multiprocessing.get_context()
+        queue = context.Queue()
+        run = int(time.time())
+        processes = [
+            context.Process(target=_write_invoices, args=(
+                path, db_options, worker, run, options['invoices'], options['items'], options['pause'] / 1000,
+                branches, codes, queue,
+            ))
+            for worker in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        reports = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        errors = [report['error'] for report in reports if 'error' in report]
+        if errors:
+            raise CommandError(f'A writer process failed in the {profile} run: {errors[0]}')
+
+        elapsed = max(report['finished'] for report in reports) - min(report['started'] for report in reports)
+        latencies = sorted(latency * 1000 for report in reports for latency in report['latencies'])
+        invoices = len(latencies)
+        return {
+            'profile': profile,
+            'options': db_options,
+            'workers': options['workers'],
+            'pause_ms': options['pause'],
+            'invoices': invoices,
+            'seconds': round(elapsed, 3),
+            'invoices_per_second': invoices / elapsed,
+            'items_per_second': invoices * min(options['items'], len(codes)) / elapsed,
+            'locked_errors': sum(report['locked'] for report in reports),
+            'seconds_lost_to_locks': sum(report['lost'] for report in reports),
+            'latency_ms': {
+                'p50': statistics.median(latencies),
+                'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                'max': latencies[-1],
+            },
+        }
@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoicing.exports import iter_csv, period_items
+from invoicing.models import Branch
+
+
+class Command(BaseCommand):
+    help = 'Export every invoice line of a month (or a whole year) as CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, required=True)
+        parser.add_argument('--month', type=int, help='1-12; omit to export the whole year')
+        parser.add_argument('--branch', help='Branch id or name')
+        parser.add_argument('--output', help='CSV file to write (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        month = options['month']
+        if month is not None and not 1 <= month <= 12:
+            raise CommandError('--month must be between 1 and 12.')
+
+        branch = None
+        if options['branch']:
+            lookup = {'pk': options['branch']} if options['branch'].isdigit() else {'name': options['branch']}
+            try:
+                branch = Branch.objects.get(**lookup)
+            except Branch.DoesNotExist:
+                raise CommandError(f"Branch not found: {options['branch']}")
+
+        items = period_items(options['year'], month, branch)
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        rows = -1  # header
+        try:
+            for line in iter_csv(items, chunk_size=options['chunk_size']):
+                output.write(line)
+                rows += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Exported {rows} lines to {options['output']}"))
@@ -0,0 +1,48 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoicing.models import ElectronicInvoice
+from invoicing.pdf_export import default_workers, export_pdfs_zip
+
+
+class Command(BaseCommand):
+    help = 'Export the PDFs of the electronic invoices in a date range into a ZIP file, rendered in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the ZIP file to write')
+        parser.add_argument('--from', dest='date_from', help='Start date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', help='End date, inclusive (YYYY-MM-DD)')
+        parser.add_argument('--search', help='Only invoices whose number contains this text')
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help=f'Render processes (default: available cores, {default_workers()} here)'
+        )
+
+    def handle(self, *args, **options):
+        invoices = ElectronicInvoice.objects.all()
+        try:
+            if options['date_from']:
+                invoices = invoices.filter(date__gte=date.fromisoformat(options['date_from']))
+            if options['date_to']:
+                invoices = invoices.filter(date__lte=date.fromisoformat(options['date_to']))
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        if options['search']:
+            invoices = invoices.filter(invoice_number__icontains=options['search'])
+        if options['workers'] is not None and options['workers'] <= 0:
+            raise CommandError('--workers must be greater than zero.')
+
+        pks = list(invoices.order_by('date', 'invoice_number').values_list('pk', flat=True))
+        if not pks:
+            raise CommandError('No electronic invoices match the given filters.')
+
+        def report(pk, filename, seconds, rendered):
+            status = 'rendered' if rendered else 'cached'
+            self.stdout.write(f'{filename}: {seconds:.2f}s ({status})')
+
+        with open(options['output'], 'wb') as output:
+            stats = export_pdfs_zip(pks, output, workers=options['workers'], on_result=report)
+
+        self.stdout.write(self.style.SUCCESS(stats.summary()))
+        self.stdout.write(f"Written to {options['output']}")
@@ -0,0 +1,189 @@
+import math
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from invoicing.billing import apply_splits, get_rate_table
+from invoicing.fragments import bump_branch_version
+from invoicing.management.commands.add_treatments import TREATMENTS
+from invoicing.models import (
+    TOTAL_FIELDS, Branch, Treatment, ElectronicInvoice, PatientInvoice, PatientInvoiceItem
+)
+from invoicing.summary import rebuild_monthly_summary
+from invoicing.treatment_index import invalidate_treatment_index
+
+
+FIRST_NAMES = [
+    'José', 'María', 'Juan', 'Ana', 'Luis', 'Carmen', 'Carlos', 'Lucía', 'Jorge', 'Sofía',
+    'Andrés', 'Valeria', 'Diego', 'Gabriela', 'Fernando', 'Daniela', 'Ricardo', 'Mariela',
+]
+LAST_NAMES = [
+    'Rodríguez', 'Vargas', 'Jiménez', 'Mora', 'Rojas', 'González', 'Hernández', 'Solís',
+    'Araya', 'Quesada', 'Chaves', 'Alfaro', 'Núñez', 'Castro', 'Salazar', 'Brenes',
+]
+BRANCH_NAMES = [
+    'San José', 'Heredia', 'Alajuela', 'Cartago', 'Puntarenas', 'Limón', 'Liberia',
+    'San Carlos', 'Pérez Zeledón', 'Desamparados',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate synthetic branches, treatments, patient invoices with items and '
+        'electronic invoices using bulk inserts (for benchmarks and local testing)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=10000, help='Patient invoices to create')
+        parser.add_argument('--branches', type=int, default=5)
+        parser.add_argument('--max-items', type=int, default=4, help='Maximum items per invoice')
+        parser.add_argument(
+            '--group-size', type=int, default=25,
+            help='Patient invoices grouped in each electronic invoice'
+        )
+        parser.add_argument(
+            '--assigned', type=float, default=0.9,
+            help='Share of patient invoices assigned to an electronic invoice (0-1)'
+        )
+        parser.add_argument('--months', type=int, default=24, help='Spread dates over this many months')
+        parser.add_argument('--end-date', type=date.fromisoformat, default=None)
+        parser.add_argument('--prefix', default='GEN', help='Prefix of the generated invoice numbers')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['invoices'] <= 0 or options['batch_size'] <= 0 or options['group_size'] <= 0:
+            raise CommandError('--invoices, --batch-size and --group-size must be greater than zero.')
+        if not 0 <= options['assigned'] <= 1:
+            raise CommandError('--assigned must be between 0 and 1.')
+
+        self.random = random.Random(options['seed'])
+        branches = self.create_branches(options['branches'])
+        treatments = self.create_treatments()
+        prefix = options['prefix']
+        if PatientInvoice.objects.filter(invoice_number__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Invoices with prefix {prefix} already exist; use another --prefix.')
+
+        end = options['end_date'] or date.today()
+        days = max(1, round(options['months'] * 30.4))
+        count = options['invoices']
+        dates = sorted(end - timedelta(days=self.random.randrange(days)) for _ in range(count))
+
+        # Oldest invoices are grouped into electronic invoices, the newest stay unassigned
+        assigned = int(count * options['assigned'])
+        electronic_invoices = self.create_electronic_invoices(
+            prefix, dates[:assigned], options['group_size']
+        )
+        electronic_totals = {
+            electronic_invoice.pk: dict.fromkeys(TOTAL_FIELDS, Decimal('0'))
+            for electronic_invoice in electronic_invoices
+        }
+
+        table = get_rate_table()
+        created_items = 0
+        for start in range(0, count, options['batch_size']):
+            with transaction.atomic():
+                created_items += self.create_batch(
+                    prefix, start, dates[start:start + options['batch_size']], assigned,
+                    options['group_size'], branches, treatments, electronic_invoices,
+                    electronic_totals, options['max_items'], table
+                )
+            self.stdout.write(f'{min(start + options["batch_size"], count)}/{count} invoices')
+
+        for electronic_invoice in electronic_invoices:
+            for field, value in electronic_totals[electronic_invoice.pk].items():
+                setattr(electronic_invoice, field, value)
+        ElectronicInvoice.objects.bulk_update(
+            electronic_invoices, TOTAL_FIELDS, batch_size=options['batch_size']
+        )
+        summary_rows = rebuild_monthly_summary()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {count} patient invoices, {created_items} items, '
+            f'{len(electronic_invoices)} electronic invoices and {summary_rows} summary rows.'
+        ))
+
+    def create_branches(self, count):
+        names = [
+            BRANCH_NAMES[number] if number < len(BRANCH_NAMES) else f'Sucursal {number + 1}'
+            for number in range(count)
+        ]
+        Branch.objects.bulk_create([Branch(name=name) for name in names], ignore_conflicts=True)
+        # bulk_create skips the signal that expires the cached branch fragments
+        bump_branch_version()
+        return list(Branch.objects.filter(name__in=names))
+
+    def create_treatments(self):
+        Treatment.objects.bulk_create(
+            [
+                Treatment(code=code, name=name, price=Decimal(str(price)).quantize(Decimal('0.01')))
+                for code, name, price in TREATMENTS
+            ],
+            ignore_conflicts=True
+        )
+        # bulk_create skips the signals that refresh the autocomplete index
+        invalidate_treatment_index()
+        return list(Treatment.objects.filter(is_active=True))
+
+    def create_electronic_invoices(self, prefix, dates, group_size):
+        electronic_invoices = [
+            ElectronicInvoice(
+                invoice_number=f'{prefix}-FE-{number + 1:07d}',
+                # Issued on the date of the last patient invoice it groups
+                date=dates[min(len(dates), (number + 1) * group_size) - 1],
+            )
+            for number in range(math.ceil(len(dates) / group_size))
+        ]
+        return ElectronicInvoice.objects.bulk_create(electronic_invoices, batch_size=1000)
+
+    def create_batch(self, prefix, start, dates, assigned, group_size, branches, treatments,
+                     electronic_invoices, electronic_totals, max_items, table):
+        invoices = []
+        items = []
+        for offset, invoice_date in enumerate(dates):
+            number = start + offset
+            electronic_invoice = electronic_invoices[number // group_size] if number < assigned else None
+            invoice = PatientInvoice(
+                patient_name=(
+                    f'{self.random.choice(FIRST_NAMES)} {self.random.choice(LAST_NAMES)} '
+                    f'{self.random.choice(LAST_NAMES)}'
+                ),
+                branch=self.random.choice(branches),
+                invoice_number=f'{prefix}-{number + 1:08d}',
+                date=invoice_date,
+                electronic_invoice=electronic_invoice,
+            )
+            invoice_items = [
+                PatientInvoiceItem(
+                    patient_invoice=invoice,
+                    treatment=treatment,
+                    quantity=1 if self.random.random() < 0.85 else self.random.randint(2, 3),
+                    unit_price=treatment.price,
+                )
+                for treatment in self.random.sample(
+                    treatments, min(len(treatments), self.random.randint(1, max_items))
+                )
+            ]
+            invoices.append(invoice)
+            items.append(invoice_items)
+
+        # Splits and stored totals are computed here since bulk_create skips save() and signals
+        apply_splits([item for invoice_items in items for item in invoice_items], table)
+        for invoice, invoice_items in zip(invoices, items):
+            for field in TOTAL_FIELDS:
+                setattr(invoice, field, sum((getattr(item, field) for item in invoice_items), Decimal('0')))
+            if invoice.electronic_invoice_id:
+                totals = electronic_totals[invoice.electronic_invoice_id]
+                for field in TOTAL_FIELDS:
+                    totals[field] += getattr(invoice, field)
+
+        PatientInvoice.objects.bulk_create(invoices)
+        for invoice, invoice_items in zip(invoices, items):
+            for item in invoice_items:
+                item.patient_invoice = invoice
+        flat_items = [item for invoice_items in items for item in invoice_items]
+        PatientInvoiceItem.objects.bulk_create(flat_items)
+        return len(flat_items)
@@ -0,0 +1,67 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoicing.grouping import PERIODS, GroupingRules, group_invoices, plan_groups
+from invoicing.models import Branch
+
+
+class Command(BaseCommand):
+    help = (
+        'Create electronic invoices for the unassigned patient invoices, grouped per '
+        'branch, day or month and up to a maximum size, and assign them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branch', type=int, help='Only invoices of this branch id')
+        parser.add_argument('--date-from', type=date.fromisoformat)
+        parser.add_argument('--date-to', type=date.fromisoformat)
+        parser.add_argument(
+            '--by-branch', action='store_true', default=True,
+            help='One electronic invoice per branch (default)'
+        )
+        parser.add_argument('--all-branches', dest='by_branch', action='store_false',
+                            help='Mix branches in the same electronic invoice')
+        parser.add_argument('--period', choices=PERIODS, help='Also group per day or month')
+        parser.add_argument('--max-invoices', type=int, help='Maximum patient invoices per electronic invoice')
+        parser.add_argument('--prefix', default='FE-', help='Prefix of the electronic invoice numbers')
+        parser.add_argument('--dry-run', action='store_true', help='Show the groups without creating them')
+
+    def handle(self, *args, **options):
+        if options['max_invoices'] is not None and options['max_invoices'] <= 0:
+            raise CommandError('--max-invoices must be greater than zero.')
+        if options['branch'] and not Branch.objects.filter(pk=options['branch']).exists():
+            raise CommandError(f'Branch {options["branch"]} does not exist.')
+
+        rules = GroupingRules(
+            by_branch=options['by_branch'],
+            period=options['period'],
+            max_invoices=options['max_invoices'],
+            branch=options['branch'],
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            prefix=options['prefix'],
+        )
+        if options['dry_run']:
+            groups = plan_groups(rules)
+            for group in groups:
+                key = ' '.join(str(part) for part in group.key) or '-'
+                self.stdout.write(f'{key:30} {group.date}  {len(group.invoice_ids):6d} invoices')
+            self.stdout.write(self.style.WARNING(
+                f'Dry run: {len(groups)} electronic invoices for '
+                f'{sum(len(group.invoice_ids) for group in groups)} patient invoices.'
+            ))
+            return
+
+        result = group_invoices(rules)
+        if options['verbosity'] > 1:
+            for electronic_invoice in result.electronic_invoices:
+                self.stdout.write(f'{electronic_invoice.invoice_number}  {electronic_invoice.date}  {electronic_invoice.total}')
+        if result.skipped:
+            self.stdout.write(self.style.WARNING(
+                f'{result.skipped} invoices were assigned concurrently and skipped.'
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(result.electronic_invoices)} electronic invoices and assigned '
+            f'{result.assigned} patient invoices.'
+        ))
@@ -0,0 +1,80 @@
+import csv
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoicing.importer import (
+    FORMATS, InvoiceImporter, InvoiceImportError, format_from_name, iter_records
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Import patient invoices with their treatment lines from a CSV (one row per item) '
+        'or JSONL (one invoice per line) file, in chunks that can be resumed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import (.csv or .jsonl)')
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Invoices validated and committed together')
+        parser.add_argument('--errors', help='Write rejected records to this CSV file (default: <path>.errors.csv)')
+        parser.add_argument(
+            '--checkpoint',
+            help='File recording the last committed line (default: <path>.checkpoint)'
+        )
+        parser.add_argument('--resume', action='store_true', help='Skip the lines committed by a previous run')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only, nothing is written')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size must be greater than zero.')
+        path = Path(options['path'])
+        format = options['format'] or format_from_name(path.name)
+        checkpoint = Path(options['checkpoint'] or f'{path}.checkpoint')
+        errors_path = Path(options['errors'] or f'{path}.errors.csv')
+
+        resume_after = 0
+        if options['resume'] and checkpoint.exists():
+            resume_after = json.loads(checkpoint.read_text())['line']
+            self.stdout.write(f'Resuming after line {resume_after}.')
+
+        def save_checkpoint(line):
+            checkpoint.write_text(json.dumps({'path': str(path), 'line': line}))
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Committed up to line {line}')
+
+        started = time.perf_counter()
+        importer = InvoiceImporter(chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        # A resumed run appends to the error report of the interrupted one
+        mode = 'a' if resume_after and errors_path.exists() else 'w'
+        try:
+            # utf-8-sig drops the BOM Excel adds to CSV files
+            with open(path, encoding='utf-8-sig', newline='') as source, \
+                    open(errors_path, mode, encoding='utf-8', newline='') as errors_file:
+                writer = csv.writer(errors_file)
+                if mode == 'w':
+                    writer.writerow(['line', 'invoice_number', 'error'])
+                result = importer.run(
+                    iter_records(source, format),
+                    resume_after=resume_after,
+                    on_error=writer.writerow,
+                    on_commit=save_checkpoint,
+                )
+        except (InvoiceImportError, OSError) as error:
+            raise CommandError(str(error))
+
+        elapsed = time.perf_counter() - started
+        summary = f'{result.invoices} invoices, {result.items} items, {result.rejected} rejected'
+        if result.rejected:
+            self.stdout.write(self.style.WARNING(f'Rejected records written to {errors_path}.'))
+        elif mode == 'w':
+            errors_path.unlink()
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Dry run, nothing imported: {summary}.'))
+            return
+        # The import finished; a later --resume starts over
+        checkpoint.unlink(missing_ok=True)
+        self.stdout.write(self.style.SUCCESS(f'Imported in {elapsed:.2f}s: {summary}.'))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoicing.catalog import CatalogError, apply_catalog, diff_catalog, read_catalog
+
+
+class Command(BaseCommand):
+    help = 'Import the treatment catalog from a CSV or JSON file (code, name, price)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Catalog file (.csv or .json)')
+        parser.add_argument('--format', choices=['csv', 'json'], help='Default: from the file extension')
+        parser.add_argument('--dry-run', action='store_true', help='Show the changes without applying them')
+        parser.add_argument(
+            '--keep-missing', action='store_true',
+            help='Do not deactivate treatments that are missing from the catalog'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            rows = read_catalog(options['path'], options['format'])
+        except (CatalogError, OSError) as error:
+            raise CommandError(str(error))
+
+        diff = diff_catalog(rows, deactivate_missing=not options['keep_missing'])
+        if options['dry_run'] or options['verbosity'] > 1:
+            for row in diff.created:
+                self.stdout.write(f'+ {row.code}  {row.name}  {row.price}')
+            for treatment, row in diff.updated:
+                changes = []
+                if treatment.name != row.name:
+                    changes.append(f'name {treatment.name!r} -> {row.name!r}')
+                if treatment.price != row.price:
+                    changes.append(f'price {treatment.price} -> {row.price}')
+                if not treatment.is_active:
+                    changes.append('reactivated')
+                self.stdout.write(f'~ {row.code}  {"; ".join(changes)}')
+            for treatment in diff.deactivated:
+                self.stdout.write(f'- {treatment.code}  {treatment.name}')
+
+        summary = (
+            f'{len(diff.created)} new, {len(diff.updated)} changed, '
+            f'{len(diff.deactivated)} deactivated, {diff.unchanged} unchanged'
+        )
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Dry run, nothing applied: {summary}.'))
+            return
+
+        apply_catalog(diff)
+        self.stdout.write(self.style.SUCCESS(
+            f'Catalog imported in {time.perf_counter() - started:.2f}s: {summary}.'
+        ))
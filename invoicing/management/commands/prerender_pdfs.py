@@ -0,0 +1,46 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoicing.models import ElectronicInvoice
+from invoicing.pdf import open_electronic_invoice_pdf
+
+
+class Command(BaseCommand):
+    help = 'Pre-render and cache the PDFs of the electronic invoices in a date range'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', required=True, help='Start date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', required=True, help='End date, inclusive (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        try:
+            date_from = date.fromisoformat(options['date_from'])
+            date_to = date.fromisoformat(options['date_to'])
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        invoices = ElectronicInvoice.objects.filter(
+            date__gte=date_from, date__lte=date_to
+        ).order_by('date', 'invoice_number')
+
+        rendered_count = 0
+        cached_count = 0
+        started = time.perf_counter()
+        for electronic_invoice in invoices.iterator():
+            pdf_file, rendered = open_electronic_invoice_pdf(electronic_invoice)
+            pdf_file.close()
+            if rendered:
+                rendered_count += 1
+                self.stdout.write(f'Rendered: {electronic_invoice.invoice_number}')
+            else:
+                cached_count += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Processed {rendered_count + cached_count} electronic invoices '
+                f'({rendered_count} rendered, {cached_count} already cached) '
+                f'in {time.perf_counter() - started:.1f}s'
+            )
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from invoicing.summary import rebuild_monthly_summary
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly summary (month x branch x treatment) from the invoice items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='Only rebuild this year (default: all)')
+
+    def handle(self, *args, **options):
+        rows = rebuild_monthly_summary(options['year'])
+        self.stdout.write(self.style.SUCCESS(f'{rows} monthly summary row(s) rebuilt.'))
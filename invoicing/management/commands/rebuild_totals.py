@@ -0,0 +1,159 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from invoicing.billing import SPLIT_FIELDS, apply_splits, get_rate_table
+from invoicing.models import (
+    TOTAL_FIELDS, ElectronicInvoice, PatientInvoice, PatientInvoiceItem
+)
+from invoicing.summary import rebuild_monthly_summary
+
+
+class Command(BaseCommand):
+    help = 'Rebuild (or verify) the stored totals of patient and electronic invoices in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Number of invoices processed per transaction (default: 500)'
+        )
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only report invoices whose stored totals are wrong, without fixing them'
+        )
+        parser.add_argument(
+            '--resplit', action='store_true',
+            help='First recompute every item split with the current rate table'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        verify = options['verify']
+        if chunk_size <= 0:
+            raise CommandError('--chunk-size must be greater than zero.')
+
+        if options['resplit']:
+            if verify:
+                raise CommandError('--resplit cannot be combined with --verify.')
+            resplit = self.resplit_items(chunk_size)
+            self.stdout.write(f'{resplit} item split(s) recomputed.')
+            if resplit:
+                # bulk_update skips the signals that keep the summary rows current
+                rebuild_monthly_summary()
+
+        patient_mismatches = self.process_patient_invoices(chunk_size, verify)
+        electronic_mismatches = self.process_electronic_invoices(chunk_size, verify)
+
+        summary = (
+            f'{patient_mismatches} patient invoice(s) and '
+            f'{electronic_mismatches} electronic invoice(s) '
+        )
+        if verify:
+            if patient_mismatches or electronic_mismatches:
+                raise CommandError(summary + 'have wrong stored totals.')
+            self.stdout.write(self.style.SUCCESS('All stored totals are correct.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary + 'updated.'))
+
+    def chunks(self, queryset, chunk_size):
+        """Yield lists of primary keys using keyset iteration"""
+        last_pk = 0
+        while True:
+            pks = list(
+                queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not pks:
+                return
+            yield pks
+            last_pk = pks[-1]
+
+    def resplit_items(self, chunk_size):
+        table = get_rate_table()
+        changed = 0
+        for pks in self.chunks(PatientInvoiceItem.objects.all(), chunk_size):
+            with transaction.atomic():
+                items = list(
+                    PatientInvoiceItem.objects.select_for_update().filter(pk__in=pks)
+                    .select_related('patient_invoice')
+                )
+                before = [tuple(getattr(item, field) for field in SPLIT_FIELDS) for item in items]
+                apply_splits(items, table)
+                stale = [
+                    item for item, old in zip(items, before)
+                    if tuple(getattr(item, field) for field in SPLIT_FIELDS) != old
+                ]
+                now = timezone.now()
+                for item in stale:
+                    item.updated_at = now
+                PatientInvoiceItem.objects.bulk_update(stale, [*SPLIT_FIELDS, 'updated_at'])
+                changed += len(stale)
+        return changed
+
+    def process_patient_invoices(self, chunk_size, verify):
+        mismatches = 0
+        for pks in self.chunks(PatientInvoice.objects.all(), chunk_size):
+            with transaction.atomic():
+                expected = {
+                    row['patient_invoice']: row
+                    for row in PatientInvoiceItem.objects.filter(
+                        patient_invoice_id__in=pks
+                    ).values('patient_invoice').annotate(
+                        **{field: Sum(field) for field in TOTAL_FIELDS}
+                    ).order_by()
+                }
+
+                stale = []
+                invoices = PatientInvoice.objects.select_for_update().filter(
+                    pk__in=pks
+                ).only(*TOTAL_FIELDS)
+                for invoice in invoices:
+                    row = expected.get(invoice.pk, {})
+                    values = {field: row.get(field) or Decimal('0') for field in TOTAL_FIELDS}
+                    if any(getattr(invoice, field) != values[field] for field in TOTAL_FIELDS):
+                        for field in TOTAL_FIELDS:
+                            setattr(invoice, field, values[field])
+                        stale.append(invoice)
+
+                mismatches += len(stale)
+                if verify:
+                    for invoice in stale:
+                        self.stdout.write(f'Patient invoice {invoice.pk}: stored totals are wrong')
+                else:
+                    PatientInvoice.objects.bulk_update(stale, TOTAL_FIELDS)
+        return mismatches
+
+    def process_electronic_invoices(self, chunk_size, verify):
+        mismatches = 0
+        for pks in self.chunks(ElectronicInvoice.objects.all(), chunk_size):
+            with transaction.atomic():
+                rollup = {
+                    row['electronic_invoice']: row
+                    for row in PatientInvoice.objects.filter(
+                        electronic_invoice_id__in=pks
+                    ).values('electronic_invoice').annotate(
+                        **{field: Sum(field) for field in TOTAL_FIELDS}
+                    ).order_by()
+                }
+
+                stale = []
+                invoices = ElectronicInvoice.objects.select_for_update().filter(
+                    pk__in=pks
+                ).only(*TOTAL_FIELDS)
+                for invoice in invoices:
+                    row = rollup.get(invoice.pk, {})
+                    values = {field: row.get(field) or Decimal('0') for field in TOTAL_FIELDS}
+                    if any(getattr(invoice, field) != values[field] for field in TOTAL_FIELDS):
+                        for field in TOTAL_FIELDS:
+                            setattr(invoice, field, values[field])
+                        stale.append(invoice)
+
+                mismatches += len(stale)
+                if verify:
+                    for invoice in stale:
+                        self.stdout.write(f'Electronic invoice {invoice.pk}: stored totals are wrong')
+                else:
+                    ElectronicInvoice.objects.bulk_update(stale, TOTAL_FIELDS)
+        return mismatches
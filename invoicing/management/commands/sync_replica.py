@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from invoicing.routers import read_replicas
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the default SQLite database into the SQLite read replicas '
+        '(for local testing of the replica routing; real replicas are kept by the database server)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*', help='Replica aliases (default: INVOICING_READ_REPLICAS)')
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or read_replicas()
+        if not aliases:
+            raise CommandError('No read replicas configured (INVOICING_READ_REPLICAS).')
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('sync_replica only copies SQLite databases.')
+
+        primary.ensure_connection()
+        for alias in aliases:
+            if alias not in connections.settings or alias == DEFAULT_DB_ALIAS:
+                raise CommandError(f'Unknown replica alias: {alias}')
+            replica = connections[alias]
+            if replica.vendor != 'sqlite':
+                raise CommandError(f'{alias} is not a SQLite database.')
+            started = time.perf_counter()
+            replica.ensure_connection()
+            primary.connection.backup(replica.connection)
+            replica.close()
+            self.stdout.write(self.style.SUCCESS(
+                f'Copied {DEFAULT_DB_ALIAS} to {alias} in {time.perf_counter() - started:.2f}s.'
+            ))
@@ -0,0 +1,129 @@
+"""
+Métricas por vista en formato de texto de Prometheus.
+
+When INVOICING_METRICS_ENABLED is set, MetricsMiddleware records for every URL
+name the request count, a latency histogram and the number and time of SQL
+queries (through ``connection.execute_wrapper``); ElectronicInvoicePDFView adds
+the PDF render/cache-read time. When it is off, the middleware removes itself
+at startup and nothing is recorded.
+
+Metrics live in process memory, so each worker exposes its own counters:
+scrape every worker or aggregate with ``sum by (view)``.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PDF_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def metrics_enabled():
+    return getattr(settings, 'INVOICING_METRICS_ENABLED', False)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        position = bisect.bisect_left(self.buckets, value)
+        if position < len(self.counts):
+            self.counts[position] += 1
+        self.count += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class ViewStats:
+    __slots__ = ('latency', 'queries', 'query_seconds')
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+class Registry:
+    """Thread-safe in-process metric store"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(ViewStats)
+        self._pdf = defaultdict(lambda: Histogram(PDF_BUCKETS))
+
+    def observe_request(self, view, seconds, queries, query_seconds):
+        with self._lock:
+            stats = self._views[view]
+            stats.latency.observe(seconds)
+            stats.queries += queries
+            stats.query_seconds += query_seconds
+
+    def observe_pdf(self, seconds, rendered):
+        with self._lock:
+            self._pdf['rendered' if rendered else 'cached'].observe(seconds)
+
+    def render(self):
+        """Prometheus text exposition format (0.0.4)"""
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = [
+                '# HELP invoicing_requests_total Requests handled, per URL name.',
+                '# TYPE invoicing_requests_total counter',
+                *(f'invoicing_requests_total{{view="{view}"}} {stats.latency.count}' for view, stats in views),
+                '# HELP invoicing_request_duration_seconds Request latency, per URL name.',
+                '# TYPE invoicing_request_duration_seconds histogram',
+            ]
+            for view, stats in views:
+                lines.extend(stats.latency.samples('invoicing_request_duration_seconds', f'view="{view}"'))
+            lines += [
+                '# HELP invoicing_sql_queries_total SQL queries executed, per URL name.',
+                '# TYPE invoicing_sql_queries_total counter',
+                *(f'invoicing_sql_queries_total{{view="{view}"}} {stats.queries}' for view, stats in views),
+                '# HELP invoicing_sql_duration_seconds_total Time spent in SQL queries, per URL name.',
+                '# TYPE invoicing_sql_duration_seconds_total counter',
+                *(f'invoicing_sql_duration_seconds_total{{view="{view}"}} {stats.query_seconds:.6f}'
+                  for view, stats in views),
+                '# HELP invoicing_pdf_seconds Electronic invoice PDF time, rendered or read from the cache.',
+                '# TYPE invoicing_pdf_seconds histogram',
+            ]
+            for result, histogram in sorted(self._pdf.items()):
+                lines.extend(histogram.samples('invoicing_pdf_seconds', f'result="{result}"'))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class QueryCounter:
+    """``execute_wrapper`` that counts queries and their time"""
+    __slots__ = ('queries', 'seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
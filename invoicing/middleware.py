@@ -0,0 +1,107 @@
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import QueryCounter, metrics_enabled, registry
+from .routers import PIN_COOKIE, read_replicas
+
+
+@contextmanager
+def count_queries(counter):
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
+
+
+class MetricsMiddleware:
+    """Record latency and SQL usage per URL name (see invoicing.metrics)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with count_queries(counter):
+            response = self.get_response(request)
+        return self.observe(request, response, counter, started)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        # Under ASGI the ORM runs in the request's sync thread, whose
+        # connections are not the event loop's: wrap them from that thread
+        stack = ExitStack()
+        await sync_to_async(stack.enter_context)(count_queries(counter))
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.observe(request, response, counter, started)
+
+    def observe(self, request, response, counter, started):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        if response.streaming and not response.is_async:
+            # CSV/ZIP exports run their queries while streaming
+            response.streaming_content = self.observe_stream(
+                response.streaming_content, view, counter, started
+            )
+        else:
+            registry.observe_request(view, time.perf_counter() - started, counter.queries, counter.seconds)
+        return response
+
+    def observe_stream(self, content, view, counter, started):
+        try:
+            with count_queries(counter):
+                yield from content
+        finally:
+            registry.observe_request(view, time.perf_counter() - started, counter.queries, counter.seconds)
+
+
+class ReplicaPinMiddleware:
+    """
+    Pin the browser to the primary database for INVOICING_REPLICA_PIN_SECONDS
+    after a write request, so the redirect that follows a POST (and anything
+    read right after) never sees a lagging replica (see invoicing.routers)
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not read_replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.seconds = getattr(settings, 'INVOICING_REPLICA_PIN_SECONDS', 10)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.pin(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.pin(request, await self.get_response(request))
+
+    def pin(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            response.set_cookie(
+                PIN_COOKIE, f'{time.time() + self.seconds:.3f}',
+                max_age=self.seconds, httponly=True, samesite='Lax'
+            )
+        return response
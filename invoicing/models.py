@@ -1,9 +1,49 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Sum
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+from decimal import Decimal
 import re
 
 
+# Stored amount columns shared by PatientInvoice and ElectronicInvoice
+TOTAL_FIELDS = ('subtotal', 'monto_asembis', 'monto_dr', 'iva', 'total')
+
+
+class StoredTotals(models.Model):
+    """Totales almacenados - Stored amount columns kept in sync by invoicing.signals"""
+    subtotal = models.DecimalField(
+        'Subtotal', max_digits=14, decimal_places=2, default=Decimal('0'), editable=False
+    )
+    monto_asembis = models.DecimalField(
+        'Monto ASEMBIS', max_digits=14, decimal_places=2, default=Decimal('0'), editable=False
+    )
+    monto_dr = models.DecimalField(
+        'Monto DR', max_digits=14, decimal_places=2, default=Decimal('0'), editable=False
+    )
+    iva = models.DecimalField(
+        'I.V.A.', max_digits=14, decimal_places=2, default=Decimal('0'), editable=False
+    )
+    total = models.DecimalField(
+        'Total', max_digits=14, decimal_places=2, default=Decimal('0'), editable=False
+    )
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # Regular updates must never overwrite the stored totals with stale in-memory values
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in TOTAL_FIELDS
+            ]
+        # post_save receivers roll totals up inside the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
 class Branch(models.Model):
     """Sucursal - Branch office"""
     name = models.CharField('Nombre de Sucursal', max_length=100, unique=True)
@@ -46,7 +86,62 @@ class Treatment(models.Model):
         return f"{self.code} - {self.name} - ₡{self.price:,.2f}"
 
 
-class ElectronicInvoice(models.Model):
+class BillingRate(models.Model):
+    """Tarifa de Distribución - ASEMBIS/DR/IVA split rates, versioned by effective date"""
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.CASCADE,
+        verbose_name='Sucursal',
+        null=True,
+        blank=True,
+        help_text='Dejar vacío para aplicar a todas las sucursales'
+    )
+    treatment = models.ForeignKey(
+        Treatment,
+        on_delete=models.CASCADE,
+        verbose_name='Tratamiento',
+        null=True,
+        blank=True,
+        help_text='Dejar vacío para aplicar a todos los tratamientos'
+    )
+    effective_from = models.DateField(
+        'Vigente Desde',
+        help_text='Se aplica a facturas con fecha igual o posterior'
+    )
+    asembis_rate = models.DecimalField(
+        'Porcentaje ASEMBIS', max_digits=5, decimal_places=4,
+        help_text='Fracción del subtotal, ej: 0.1500'
+    )
+    dr_rate = models.DecimalField(
+        'Porcentaje DR', max_digits=5, decimal_places=4,
+        help_text='Fracción del subtotal, ej: 0.8500'
+    )
+    iva_rate = models.DecimalField(
+        'Porcentaje I.V.A.', max_digits=5, decimal_places=4,
+        help_text='Fracción del subtotal, ej: 0.0400'
+    )
+    created_at = models.DateTimeField('Fecha de Creación', auto_now_add=True)
+    updated_at = models.DateTimeField('Fecha de Actualización', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Tarifa de Distribución'
+        verbose_name_plural = 'Tarifas de Distribución'
+        ordering = ['-effective_from', 'branch', 'treatment']
+        unique_together = ['branch', 'treatment', 'effective_from']
+
+    def __str__(self):
+        scope = ' / '.join(
+            str(part) for part in (self.branch, self.treatment and self.treatment.code) if part
+        ) or 'General'
+        return f"{scope} desde {self.effective_from}"
+
+    def clean(self):
+        if self.asembis_rate is not None and self.dr_rate is not None:
+            if self.asembis_rate + self.dr_rate != Decimal('1'):
+                raise ValidationError('Los porcentajes de ASEMBIS y DR deben sumar 100%.')
+
+
+class ElectronicInvoice(StoredTotals):
     """Factura Electrónica - Electronic Invoice header (created later to group patient invoices)"""
     invoice_number = models.CharField(
         'Número de Factura Electrónica',
@@ -55,6 +150,7 @@ class ElectronicInvoice(models.Model):
         help_text='Número único de la factura electrónica'
     )
     date = models.DateField('Fecha de Factura')
+
     created_at = models.DateTimeField('Fecha de Creación', auto_now_add=True)
     updated_at = models.DateTimeField('Fecha de Actualización', auto_now=True)
 
@@ -62,12 +158,25 @@ class ElectronicInvoice(models.Model):
         verbose_name = 'Factura Electrónica'
         verbose_name_plural = 'Facturas Electrónicas'
         ordering = ['-date', '-invoice_number']
+        indexes = [
+            models.Index(fields=['date', 'invoice_number'], name='invoicing_ei_date_number_idx'),
+        ]
 
     def __str__(self):
         return f"Factura {self.invoice_number} - {self.date}"
 
+    def refresh_totals(self):
+        """Recalculate stored totals from the assigned patient invoices"""
+        totals = self.patient_invoices.aggregate(
+            **{field: Sum(field) for field in TOTAL_FIELDS}
+        )
+        values = {field: totals[field] or Decimal('0') for field in TOTAL_FIELDS}
+        ElectronicInvoice.objects.filter(pk=self.pk).update(**values)
+        for field, value in values.items():
+            setattr(self, field, value)
 
-class PatientInvoice(models.Model):
+
+class PatientInvoice(StoredTotals):
     """Factura de Paciente - Individual patient invoice (now the main starting point)"""
     # Changed: patient_name is now a simple CharField instead of ForeignKey
     patient_name = models.CharField(
@@ -109,19 +218,74 @@ class PatientInvoice(models.Model):
         verbose_name_plural = 'Facturas de Pacientes'
         ordering = ['-date', '-invoice_number']
         # Removed unique_together constraint since electronic_invoice is now optional
+        indexes = [
+            models.Index(fields=['date', 'invoice_number'], name='invoicing_pi_date_number_idx'),
+            models.Index(fields=['electronic_invoice', 'date'], name='invoicing_pi_einvoice_date_idx'),
+            models.Index(fields=['branch', 'date'], name='invoicing_pi_branch_date_idx'),
+        ]
 
     def __str__(self):
         return f"Factura {self.invoice_number} - {self.patient_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded assignment, branch and date so invoicing.signals can
+        # roll totals up on reassignment and re-split items when the rates change
+        instance._loaded_values = {
+            field: instance.__dict__.get(field)
+            for field in ('electronic_invoice_id', 'branch_id', 'date')
+        }
+        return instance
+
     @property
     def total_amount(self):
-        """Calculate total amount for this invoice"""
-        return sum(item.total for item in self.items.all())
+        """Total amount for this invoice (stored)"""
+        return self.total
 
-    @property
-    def total_treatments(self):
-        """Get total number of treatments"""
-        return self.items.count()
+    def refresh_totals(self):
+        """
+        Recalculate stored totals from the items and apply the difference to the
+        electronic invoice, if any. Must run inside the transaction that changed the items.
+        Returns the id of the electronic invoice the invoice is assigned to.
+        """
+        with transaction.atomic():
+            locked = (
+                PatientInvoice.objects.select_for_update()
+                .only('electronic_invoice', *TOTAL_FIELDS)
+                .filter(pk=self.pk)
+                .first()
+            )
+            if locked is None:
+                return None
+
+            sums = self.items.aggregate(**{field: Sum(field) for field in TOTAL_FIELDS})
+            values = {field: sums[field] or Decimal('0') for field in TOTAL_FIELDS}
+            deltas = {
+                field: values[field] - getattr(locked, field)
+                for field in TOTAL_FIELDS
+            }
+            if any(deltas.values()):
+                PatientInvoice.objects.filter(pk=self.pk).update(**values)
+                if locked.electronic_invoice_id:
+                    ElectronicInvoice.objects.filter(pk=locked.electronic_invoice_id).update(
+                        **{field: F(field) + delta for field, delta in deltas.items()}
+                    )
+            for field, value in values.items():
+                setattr(self, field, value)
+            return locked.electronic_invoice_id
+
+    def resplit_items(self):
+        """Recompute the item splits with the rates in force for this invoice"""
+        from .billing import SPLIT_FIELDS, apply_splits
+
+        now = timezone.now()
+        items = list(self.items.all())
+        for item in items:
+            item.patient_invoice = self
+            item.updated_at = now
+        PatientInvoiceItem.objects.bulk_update(apply_splits(items), [*SPLIT_FIELDS, 'updated_at'])
+        self.refresh_totals()
 
 
 class PatientInvoiceItem(models.Model):
@@ -144,46 +308,91 @@ class PatientInvoiceItem(models.Model):
         decimal_places=2,
         help_text='Precio del tratamiento al momento de la factura'
     )
+
+    # Billing split, computed by invoicing.billing with the rates in force for the invoice
+    subtotal = models.DecimalField(
+        'Subtotal', max_digits=14, decimal_places=2, default=Decimal('0'), editable=False
+    )
+    monto_asembis = models.DecimalField(
+        'Monto ASEMBIS', max_digits=14, decimal_places=2, default=Decimal('0'), editable=False
+    )
+    monto_dr = models.DecimalField(
+        'Monto DR', max_digits=14, decimal_places=2, default=Decimal('0'), editable=False
+    )
+    iva = models.DecimalField(
+        'I.V.A.', max_digits=14, decimal_places=2, default=Decimal('0'), editable=False
+    )
+    total = models.DecimalField(
+        'Total', max_digits=14, decimal_places=2, default=Decimal('0'), editable=False
+    )
+
     created_at = models.DateTimeField('Fecha de Creación', auto_now_add=True)
+    updated_at = models.DateTimeField('Fecha de Actualización', auto_now=True)
 
     class Meta:
         verbose_name = 'Detalle de Factura'
         verbose_name_plural = 'Detalles de Facturas'
         ordering = ['patient_invoice', 'treatment']
+        indexes = [
+            models.Index(fields=['patient_invoice', 'treatment'], name='invoicing_pii_inv_treat_idx'),
+        ]
 
     def save(self, *args, **kwargs):
+        from .billing import SPLIT_FIELDS, apply_splits
+
         # Set unit_price from treatment if not provided
         if not self.unit_price:
             self.unit_price = self.treatment.price
-        super().save(*args, **kwargs)
+        apply_splits([self])
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], *SPLIT_FIELDS, 'updated_at'}
+        # Keep the row and the invoice totals (updated from post_save) in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded invoice and treatment so moving an item updates
+        # both invoices and both monthly summary rows
+        instance._loaded_patient_invoice_id = instance.__dict__.get('patient_invoice_id')
+        instance._loaded_treatment_id = instance.__dict__.get('treatment_id')
+        return instance
 
     def __str__(self):
         return f"{self.treatment.name} - {self.patient_invoice.invoice_number}"
 
-    @property
-    def subtotal(self):
-        """Subtotal (quantity * unit_price)"""
-        return self.quantity * self.unit_price
 
-    @property
-    def monto_asembis(self):
-        """15% of subtotal for ASEMBIS"""
-        from decimal import Decimal
-        return self.subtotal * Decimal('0.15')
-
-    @property
-    def monto_dr(self):
-        """85% of subtotal for Doctor"""
-        from decimal import Decimal
-        return self.subtotal * Decimal('0.85')
+class MonthlySummary(models.Model):
+    """Resumen Mensual - Items rolled up per month, branch and treatment (see invoicing.summary)"""
+    year = models.PositiveSmallIntegerField('Año')
+    month = models.PositiveSmallIntegerField('Mes')
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.CASCADE,
+        verbose_name='Sucursal',
+        related_name='monthly_summaries'
+    )
+    treatment = models.ForeignKey(
+        Treatment,
+        on_delete=models.CASCADE,
+        verbose_name='Tratamiento',
+        related_name='monthly_summaries'
+    )
+    item_count = models.PositiveIntegerField('Líneas', default=0)
+    quantity = models.PositiveIntegerField('Cantidad', default=0)
+    subtotal = models.DecimalField('Subtotal', max_digits=14, decimal_places=2, default=Decimal('0'))
+    monto_asembis = models.DecimalField('Monto ASEMBIS', max_digits=14, decimal_places=2, default=Decimal('0'))
+    monto_dr = models.DecimalField('Monto DR', max_digits=14, decimal_places=2, default=Decimal('0'))
+    iva = models.DecimalField('I.V.A.', max_digits=14, decimal_places=2, default=Decimal('0'))
+    total = models.DecimalField('Total', max_digits=14, decimal_places=2, default=Decimal('0'))
+    updated_at = models.DateTimeField('Fecha de Actualización', auto_now=True)
 
-    @property
-    def iva(self):
-        """4% IVA tax"""
-        from decimal import Decimal
-        return self.subtotal * Decimal('0.04')
+    class Meta:
+        verbose_name = 'Resumen Mensual'
+        verbose_name_plural = 'Resúmenes Mensuales'
+        ordering = ['-year', '-month', 'branch', 'treatment']
+        unique_together = ['year', 'month', 'branch', 'treatment']
 
-    @property
-    def total(self):
-        """Total amount (Monto ASEMBIS + Monto DR + IVA)"""
-        return self.monto_asembis + self.monto_dr + self.iva
\ No newline at end of file
+    def __str__(self):
+        return f"{self.month:02d}/{self.year} - {self.branch} - {self.treatment.code}"
@@ -0,0 +1,181 @@
+"""
+Paginación por cursor (keyset) para las listas de facturas.
+
+Pages are ordered by ``(-date, -invoice_number, -id)``, the Meta.ordering of
+both invoice models plus the primary key as a tie-breaker, and continue from
+an opaque cursor holding the last (or first) row of the current page instead
+of an OFFSET, so every page costs the same as the first one. No COUNT(*) runs
+unless ``?count=1`` is requested; otherwise unfiltered lists show the
+planner's row estimate when the database keeps one.
+"""
+import base64
+import json
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import Q
+
+
+class KeysetPage:
+    """One page of a keyset-paginated list, with links that keep the current filters"""
+
+    def __init__(self, object_list, params, next_cursor=None, previous_cursor=None, count=None,
+                 estimated_count=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.count = count
+        self.estimated_count = estimated_count
+        self._params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def _url(self, **cursor):
+        params = self._params.copy()
+        for key in ('after', 'before', 'page'):
+            params.pop(key, None)
+        params.update(cursor)
+        return '?' + params.urlencode()
+
+    @property
+    def first_url(self):
+        return self._url()
+
+    @property
+    def next_url(self):
+        return self._url(after=self.next_cursor)
+
+    @property
+    def previous_url(self):
+        return self._url(before=self.previous_cursor)
+
+    @property
+    def count_url(self):
+        return self._url(count='1')
+
+
+def encode_cursor(values):
+    data = json.dumps([value.isoformat() if isinstance(value, date) else value for value in values])
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Cursor -> (date, invoice_number, id), or None when it is malformed"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        on_date, invoice_number, pk = data
+        return date.fromisoformat(on_date), str(invoice_number), int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def estimate_count(model, using='default'):
+    """Row count estimate from the database statistics, or None when there is none"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            # Filled by ANALYZE (PRAGMA optimize); the first number is the row count
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+            )
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+class KeysetPaginationMixin:
+    """
+    ListView mixin replacing OFFSET pagination with a cursor on
+    ``(date, invoice_number, id)``, newest first. Views override
+    ``is_filtered()`` so narrowed lists don't show the whole-table estimate.
+    """
+    keyset_fields = ('date', 'invoice_number', 'id')
+
+    def is_filtered(self):
+        return False
+
+    def _keyset_filter(self, values, newer):
+        lookup = 'gt' if newer else 'lt'
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.keyset_fields, values):
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    def _page_query(self, queryset, page_size):
+        """The queryset of the requested page (one extra row tells if there is more) and its cursors"""
+        params = self.request.GET
+        after = decode_cursor(params['after']) if params.get('after') else None
+        before = decode_cursor(params['before']) if params.get('before') else None
+        if before:
+            return queryset.filter(self._keyset_filter(before, newer=True)).order_by(
+                *self.keyset_fields
+            )[:page_size + 1], after, before
+        if after:
+            queryset = queryset.filter(self._keyset_filter(after, newer=False))
+        descending = [f'-{field}' for field in self.keyset_fields]
+        return queryset.order_by(*descending)[:page_size + 1], after, before
+
+    def _page(self, rows, page_size, after, before, count, estimated):
+        if before:
+            has_previous = len(rows) > page_size
+            rows = rows[:page_size][::-1]
+            has_next = bool(rows)
+        else:
+            has_next = len(rows) > page_size
+            rows = rows[:page_size]
+            has_previous = after is not None
+
+        def cursor(row):
+            return encode_cursor([getattr(row, field) for field in self.keyset_fields])
+
+        page = KeysetPage(
+            rows,
+            self.request.GET,
+            next_cursor=cursor(rows[-1]) if rows and has_next else None,
+            previous_cursor=cursor(rows[0]) if rows and has_previous else None,
+            count=count,
+            estimated_count=estimated,
+        )
+        return None, page, rows, page.has_next or page.has_previous
+
+    def paginate_queryset(self, queryset, page_size):
+        page_query, after, before = self._page_query(queryset, page_size)
+        rows = list(page_query)
+        count = queryset.count() if self.request.GET.get('count') else None
+        estimated = None
+        if count is None and not self.is_filtered():
+            estimated = estimate_count(queryset.model, queryset.db)
+        return self._page(rows, page_size, after, before, count, estimated)
+
+    async def apaginate_queryset(self, queryset, page_size):
+        """paginate_queryset() with the async ORM, for async views"""
+        page_query, after, before = self._page_query(queryset, page_size)
+        rows = [row async for row in page_query]
+        count = await queryset.acount() if self.request.GET.get('count') else None
+        estimated = None
+        if count is None and not self.is_filtered():
+            estimated = await sync_to_async(estimate_count)(queryset.model, queryset.db)
+        return self._page(rows, page_size, after, before, count, estimated)
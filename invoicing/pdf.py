@@ -0,0 +1,230 @@
+"""
+PDF de facturas electrónicas con caché en disco.
+
+Rendered PDFs are stored as ``<pk>-<fingerprint>.pdf`` where the fingerprint
+hashes everything the PDF shows: the electronic invoice itself, its assigned
+patient invoices and their items (ids, counts and latest ``updated_at`` /
+``created_at``). Any change yields a new fingerprint, so a stale file is never
+served; invoicing.signals also deletes the outdated files eagerly. The
+directory is bounded by INVOICE_PDF_CACHE_MAX_BYTES with least-recently-used
+eviction (hits refresh the file mtime). Async views render through
+``aopen_electronic_invoice_pdf``, which runs WeasyPrint in a pool of
+INVOICE_PDF_RENDER_WORKERS threads so it never blocks the event loop and a
+burst of cache misses cannot start more renders than that at once.
+"""
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.template.loader import render_to_string
+
+from .models import PatientInvoice, PatientInvoiceItem
+from .totals import electronic_invoice_lines, electronic_invoice_totals
+
+
+PDF_TEMPLATE = 'invoicing/electronic_invoice_pdf.html'
+
+# Bump when the template or rendering changes so old files stop matching
+PDF_FORMAT_VERSION = 1
+
+
+def electronic_invoice_pdf_html(electronic_invoice):
+    context = {
+        'electronic_invoice': electronic_invoice,
+        'lines': electronic_invoice_lines(electronic_invoice),
+        'totals': electronic_invoice_totals(electronic_invoice),
+    }
+    return render_to_string(PDF_TEMPLATE, context)
+
+
+def html_to_pdf(html_string):
+    # WeasyPrint is slow to import and only needed on cache misses
+    import weasyprint
+
+    return weasyprint.HTML(string=html_string).write_pdf()
+
+
+def render_electronic_invoice_pdf(electronic_invoice):
+    """Render the PDF of an electronic invoice and return its bytes"""
+    return html_to_pdf(electronic_invoice_pdf_html(electronic_invoice))
+
+
+_executor_lock = threading.Lock()
+_render_executor = None
+
+
+def render_executor():
+    """Process-wide pool the async views and the admin ZIP export render PDFs in"""
+    global _render_executor
+    with _executor_lock:
+        if _render_executor is None:
+            _render_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'INVOICE_PDF_RENDER_WORKERS', 2),
+                thread_name_prefix='invoice-pdf',
+            )
+        return _render_executor
+
+
+def pdf_filename(electronic_invoice):
+    return f"factura_{electronic_invoice.invoice_number}.pdf"
+
+
+def fingerprint(electronic_invoice):
+    """Content fingerprint of everything rendered in the electronic invoice PDF"""
+    invoices = PatientInvoice.objects.filter(
+        electronic_invoice=electronic_invoice
+    ).aggregate(
+        count=Count('id'),
+        id_sum=Sum('id'),
+        last_updated=Max('updated_at'),
+        branch_updated=Max('branch__updated_at'),
+    )
+    items = PatientInvoiceItem.objects.filter(
+        patient_invoice__electronic_invoice=electronic_invoice
+    ).aggregate(
+        count=Count('id'),
+        id_sum=Sum('id'),
+        last_updated=Max('updated_at'),
+        last_created=Max('created_at'),
+        treatment_updated=Max('treatment__updated_at'),
+    )
+    parts = [
+        PDF_FORMAT_VERSION,
+        electronic_invoice.pk,
+        electronic_invoice.invoice_number,
+        electronic_invoice.date,
+        electronic_invoice.updated_at,
+        electronic_invoice.total,
+        *(invoices[key] for key in sorted(invoices)),
+        *(items[key] for key in sorted(items)),
+    ]
+    return hashlib.sha256('|'.join(map(str, parts)).encode()).hexdigest()[:32]
+
+
+class PDFCache:
+    """Size-bounded, content-addressed directory of rendered PDFs"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def path(self, pk, key):
+        return self.directory / f'{pk}-{key}.pdf'
+
+    def get(self, pk, key):
+        """Open a cached PDF for reading, or return None on a miss"""
+        path = self.path(pk, key)
+        try:
+            handle = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return handle
+
+    def put(self, pk, key, data):
+        """Store a rendered PDF, replacing older versions of the same invoice"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(pk, key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.invalidate(pk, keep=path)
+        self.evict()
+        return path
+
+    def invalidate(self, pk, keep=None):
+        """Delete the cached PDFs of an electronic invoice"""
+        for path in self.directory.glob(f'{pk}-*.pdf'):
+            if path != keep:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def evict(self):
+        """Delete least recently used PDFs until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for path in self.directory.glob('*.pdf'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+def get_pdf_cache():
+    return PDFCache(settings.INVOICE_PDF_CACHE_DIR, settings.INVOICE_PDF_CACHE_MAX_BYTES)
+
+
+def _store(cache, pk, key, data):
+    path = cache.put(pk, key, data)
+    try:
+        return open(path, 'rb'), True
+    except FileNotFoundError:
+        # Evicted right away by a concurrent writer: serve the rendered bytes
+        return io.BytesIO(data), True
+
+
+def open_electronic_invoice_pdf(electronic_invoice):
+    """
+    Open the PDF of an electronic invoice, rendering and caching it on a miss.
+    Returns ``(file, rendered)``.
+    """
+    cache = get_pdf_cache()
+    key = fingerprint(electronic_invoice)
+    handle = cache.get(electronic_invoice.pk, key)
+    if handle is not None:
+        return handle, False
+
+    data = render_electronic_invoice_pdf(electronic_invoice)
+    return _store(cache, electronic_invoice.pk, key, data)
+
+
+async def aopen_electronic_invoice_pdf(electronic_invoice):
+    """open_electronic_invoice_pdf() for async views"""
+    cache = get_pdf_cache()
+    key = await sync_to_async(fingerprint)(electronic_invoice)
+    handle = cache.get(electronic_invoice.pk, key)
+    if handle is not None:
+        return handle, False
+
+    html_string = await sync_to_async(electronic_invoice_pdf_html)(electronic_invoice)
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(render_executor(), html_to_pdf, html_string)
+    # Writing and evicting touch the disk: off the event loop too
+    return await loop.run_in_executor(None, _store, cache, electronic_invoice.pk, key, data)
+
+
+def invalidate_electronic_invoice_pdf(electronic_invoice_id):
+    """Drop the cached PDFs of an electronic invoice once the change is committed"""
+    if electronic_invoice_id:
+        transaction.on_commit(lambda: get_pdf_cache().invalidate(electronic_invoice_id))
@@ -0,0 +1,216 @@
+"""
+Exportación masiva de PDFs de facturas electrónicas.
+
+PDFs are rendered through the PDF cache (already rendered invoices are only
+read from disk) and written one by one into a ZIP stream, keeping at most
+``2 * workers`` PDFs in memory. The export_pdfs command renders in a process
+pool sized to the available cores; the admin action, which runs inside a
+server worker that must not fork, reads the database in the request thread
+and runs only WeasyPrint in the INVOICE_PDF_RENDER_WORKERS thread pool shared
+with the PDF view. Each archive ends with a ``resumen.csv`` listing the
+per-invoice render time.
+"""
+import csv
+import io
+import os
+import statistics
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections
+
+from .models import ElectronicInvoice
+from .pdf import (
+    electronic_invoice_pdf_html, fingerprint, get_pdf_cache, html_to_pdf,
+    open_electronic_invoice_pdf, pdf_filename, render_executor
+)
+
+
+def default_workers():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+
+    # Spawned workers start from scratch; forked ones already have Django loaded
+    if not apps.ready:
+        django.setup()
+
+
+def _render_one(pk):
+    """Render (or read from the cache) one PDF; runs in a worker process"""
+    started = time.perf_counter()
+    electronic_invoice = ElectronicInvoice.objects.get(pk=pk)
+    pdf_file, rendered = open_electronic_invoice_pdf(electronic_invoice)
+    with pdf_file:
+        data = pdf_file.read()
+    return pk, pdf_filename(electronic_invoice), data, time.perf_counter() - started, rendered
+
+
+def render_pdfs(pks, workers=None):
+    """
+    Yield ``(pk, filename, data, seconds, rendered)`` in completion order.
+    With one worker everything runs in the current process.
+    """
+    workers = workers or default_workers()
+    pks = iter(pks)
+    if workers == 1:
+        for pk in pks:
+            yield _render_one(pk)
+        return
+
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    try:
+        pending = {pool.submit(_render_one, pk) for pk in islice(pks, workers * 2)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                next_pk = next(pks, None)
+                if next_pk is not None:
+                    pending.add(pool.submit(_render_one, next_pk))
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _collect(cache, pk, filename, key, started, future):
+    data = future.result()
+    cache.put(pk, key, data)
+    return pk, filename, data, time.perf_counter() - started, True
+
+
+def render_pdfs_in_threads(pks):
+    """
+    render_pdfs() for use inside a request: the database is read in the
+    calling thread and only the HTML to PDF conversion runs in the shared
+    render thread pool. Cached PDFs are yielded right away, renders in order.
+    """
+    executor = render_executor()
+    window = 2 * getattr(settings, 'INVOICE_PDF_RENDER_WORKERS', 2)
+    cache = get_pdf_cache()
+    pending = deque()
+    try:
+        for pk in pks:
+            started = time.perf_counter()
+            electronic_invoice = ElectronicInvoice.objects.get(pk=pk)
+            key = fingerprint(electronic_invoice)
+            handle = cache.get(pk, key)
+            if handle is not None:
+                with handle:
+                    data = handle.read()
+                yield pk, pdf_filename(electronic_invoice), data, time.perf_counter() - started, False
+                continue
+            future = executor.submit(html_to_pdf, electronic_invoice_pdf_html(electronic_invoice))
+            pending.append((pk, pdf_filename(electronic_invoice), key, started, future))
+            if len(pending) >= window:
+                yield _collect(cache, *pending.popleft())
+        while pending:
+            yield _collect(cache, *pending.popleft())
+    finally:
+        # Download abandoned: do not leave queued renders behind
+        for *_, future in pending:
+            future.cancel()
+
+
+class ExportStats:
+    """Throughput and per-invoice render times of a bulk export"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.rows = []
+
+    def add(self, pk, filename, seconds, rendered):
+        self.rows.append((pk, filename, seconds, rendered))
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def throughput(self):
+        return len(self.rows) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        times = [seconds for _, _, seconds, _ in self.rows]
+        if not times:
+            return 'No se exportaron facturas.'
+        rendered = sum(1 for *_, was_rendered in self.rows if was_rendered)
+        p95 = sorted(times)[max(0, round(len(times) * 0.95) - 1)]
+        return (
+            f'{len(times)} PDFs ({rendered} rendered, {len(times) - rendered} cached) '
+            f'in {self.elapsed:.1f}s: {self.throughput:.2f} PDFs/s, '
+            f'render mean {statistics.mean(times):.2f}s, p95 {p95:.2f}s, max {max(times):.2f}s'
+        )
+
+    def to_csv(self):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['id', 'archivo', 'segundos', 'renderizado'])
+        for pk, filename, seconds, rendered in self.rows:
+            writer.writerow([pk, filename, f'{seconds:.3f}', 'si' if rendered else 'cache'])
+        writer.writerow([])
+        writer.writerow([self.summary()])
+        return output.getvalue()
+
+
+class _ZipStream:
+    """Write-only, unseekable file object that buffers ZIP output for streaming"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_pdfs_zip(results, stats=None, on_result=None):
+    """
+    Write rendered PDFs (the tuples of render_pdfs() or render_pdfs_in_threads())
+    into a ZIP archive yielded as a stream of byte chunks (usable in a
+    StreamingHttpResponse).
+    """
+    stats = stats if stats is not None else ExportStats()
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for pk, filename, data, seconds, rendered in results:
+            archive.writestr(filename.replace('/', '-'), data)
+            del data
+            stats.add(pk, filename, seconds, rendered)
+            if on_result:
+                on_result(pk, filename, seconds, rendered)
+            yield stream.drain()
+        stats.finish()
+        archive.writestr('resumen.csv', stats.to_csv())
+    yield stream.drain()
+
+
+def export_pdfs_zip(pks, fileobj, workers=None, on_result=None):
+    """Write the ZIP archive of the given electronic invoices to ``fileobj``"""
+    stats = ExportStats()
+    for chunk in iter_pdfs_zip(render_pdfs(pks, workers), stats=stats, on_result=on_result):
+        fileobj.write(chunk)
+    return stats
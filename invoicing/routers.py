@@ -0,0 +1,158 @@
+"""
+Lecturas en réplicas de la base de datos.
+
+Views that only read (lists, reports, exports, the PDF and the AJAX lookups)
+are marked with ``ReplicaReadMixin`` or ``@reads_from_replica``; while they
+run, and while their streaming response is sent, ``ReplicaRouter`` sends the
+reads of the invoicing models to one of ``INVOICING_READ_REPLICAS``.
+Everything else (sessions and users included), every write and every request
+made shortly after a POST from the same browser (see ``ReplicaPinMiddleware``
+in invoicing.middleware) stays on ``default``, so users always read their own
+writes and stay logged in however far the replica lags. Async views are
+served the same way: the context variable follows the coroutine and the
+``sync_to_async`` threads the async ORM runs in.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+PIN_COOKIE = 'invoicing_primary_until'
+
+_read_alias = ContextVar('invoicing_read_alias', default=None)
+
+
+def read_replicas():
+    return [alias for alias in getattr(settings, 'INVOICING_READ_REPLICAS', ()) if alias in settings.DATABASES]
+
+
+def is_pinned(request):
+    """Whether the browser wrote recently and must keep reading from the primary"""
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+@contextmanager
+def read_from(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+def read_from_primary():
+    """
+    Read from the primary even inside a replica view: used to fill caches
+    right after their invalidation, when a lagging replica would cache stale data
+    """
+    return read_from(None)
+
+
+def _replica_for(request):
+    replicas = read_replicas()
+    if not replicas or request.method not in ('GET', 'HEAD') or is_pinned(request):
+        return None
+    # One replica per request so all of its reads see the same snapshot
+    return random.choice(replicas)
+
+
+def _stream_from(alias, content):
+    with read_from(alias):
+        yield from content
+
+
+async def _astream_from(alias, content):
+    with read_from(alias):
+        async for part in content:
+            yield part
+
+
+def _bind_stream(alias, response):
+    if response.streaming:
+        # Exports run their queries while the response is being sent
+        stream = _astream_from if response.is_async else _stream_from
+        response.streaming_content = stream(alias, response.streaming_content)
+
+
+def _serve(alias, view, request, *args, **kwargs):
+    with read_from(alias):
+        response = view(request, *args, **kwargs)
+        # Querysets evaluated by the template are replica reads too
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+    _bind_stream(alias, response)
+    return response
+
+
+async def _aserve(alias, view, request, *args, **kwargs):
+    with read_from(alias):
+        response = await view(request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            # In the request's sync thread, as the handler would render it
+            await sync_to_async(response.render)()
+    _bind_stream(alias, response)
+    return response
+
+
+def reads_from_replica(view):
+    """Serve a read-only function view from a replica"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            alias = _replica_for(request)
+            if alias is None:
+                return await view(request, *args, **kwargs)
+            return await _aserve(alias, view, request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = _replica_for(request)
+        if alias is None:
+            return view(request, *args, **kwargs)
+        return _serve(alias, view, request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaReadMixin:
+    """Serve a read-only class-based view from a replica"""
+
+    def dispatch(self, request, *args, **kwargs):
+        alias = _replica_for(request)
+        if alias is None:
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return _aserve(alias, super().dispatch, request, *args, **kwargs)
+        return _serve(alias, super().dispatch, request, *args, **kwargs)
+
+
+class ReplicaRouter:
+    """Route invoicing reads inside replica views to the chosen replica; everything else to default"""
+
+    def db_for_read(self, model, **hints):
+        # Sessions and users are loaded during dispatch and may be newer than
+        # the replica (a fresh login): only the invoicing tables are replicated reads
+        if model._meta.app_label != 'invoicing':
+            return None
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in read_replicas():
+            return False
+        return None
@@ -0,0 +1,144 @@
+"""
+Búsqueda de texto completo de facturas de pacientes (nombre y número).
+
+SQLite: an external-content FTS5 table over invoicing_patientinvoice
+(``unicode61 remove_diacritics 2`` tokenizer, prefix indexes) kept in sync by
+triggers, so ORM saves, bulk_create and raw SQL are all covered.
+PostgreSQL: a GIN index on the unaccented ``simple`` tsvector of the same
+columns. Both are created by the post_migrate handler; other backends (or a
+database migrated before the index existed) fall back to ``icontains``.
+
+Every word of the search is matched as a case- and accent-insensitive
+prefix, in any order: "jose per" finds "José Pérez" and "fac 001" finds
+"FAC-001".
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .treatment_index import fold
+
+
+FTS_TABLE = 'invoicing_patientinvoice_fts'
+PG_SEARCH_INDEX = 'invoicing_patientinvoice_search_gin'
+PG_DOCUMENT = (
+    "to_tsvector('simple', invoicing_unaccent("
+    "coalesce(patient_name, '') || ' ' || coalesce(invoice_number, '')))"
+)
+
+SQLITE_SETUP = [
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        patient_name, invoice_number,
+        content='invoicing_patientinvoice', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON invoicing_patientinvoice BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, patient_name, invoice_number)
+        VALUES (new.id, new.patient_name, new.invoice_number);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON invoicing_patientinvoice BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, patient_name, invoice_number)
+        VALUES ('delete', old.id, old.patient_name, old.invoice_number);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF patient_name, invoice_number ON invoicing_patientinvoice BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, patient_name, invoice_number)
+        VALUES ('delete', old.id, old.patient_name, old.invoice_number);
+        INSERT INTO {FTS_TABLE}(rowid, patient_name, invoice_number)
+        VALUES (new.id, new.patient_name, new.invoice_number);
+    END
+    """,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+POSTGRESQL_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # unaccent() is only STABLE; index expressions need an IMMUTABLE wrapper
+    """
+    CREATE OR REPLACE FUNCTION invoicing_unaccent(text) RETURNS text AS
+    $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    """,
+    f"""
+    CREATE INDEX IF NOT EXISTS {PG_SEARCH_INDEX}
+    ON invoicing_patientinvoice USING gin ({PG_DOCUMENT})
+    """,
+]
+
+# Database alias -> whether the full-text index is installed
+_installed = {}
+
+
+def search_terms(text):
+    """Folded words of a search, e.g. 'FAC-001 José' -> ['fac', '001', 'jose']"""
+    return re.findall(r'\w+', fold(text))
+
+
+def install_search_index(using='default', **kwargs):
+    """post_migrate handler: create the full-text index if the backend supports it"""
+    connection = connections[using]
+    tables = connection.introspection.table_names()
+    if 'invoicing_patientinvoice' not in tables:
+        return
+
+    if connection.vendor == 'sqlite':
+        if FTS_TABLE in tables:
+            return
+        with connection.cursor() as cursor:
+            for statement in SQLITE_SETUP:
+                cursor.execute(statement)
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for statement in POSTGRESQL_SETUP:
+                cursor.execute(statement)
+    _installed.pop(using, None)
+
+
+def has_search_index(using='default'):
+    if using not in _installed:
+        connection = connections[using]
+        if connection.vendor == 'sqlite':
+            _installed[using] = FTS_TABLE in connection.introspection.table_names()
+        elif connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s', [PG_SEARCH_INDEX])
+                _installed[using] = cursor.fetchone() is not None
+        else:
+            _installed[using] = False
+    return _installed[using]
+
+
+def search_filter(text, using='default'):
+    """Q matching patient invoices whose name or number contain every word of ``text``"""
+    terms = search_terms(text)
+    if not terms:
+        return Q()
+
+    vendor = connections[using].vendor
+    if has_search_index(using):
+        if vendor == 'sqlite':
+            match = ' '.join(f'"{term}"*' for term in terms)
+            return Q(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]))
+        query = ' & '.join(f'{term}:*' for term in terms)
+        return Q(id__in=RawSQL(
+            f"SELECT id FROM invoicing_patientinvoice "
+            f"WHERE {PG_DOCUMENT} @@ to_tsquery('simple', %s)", [query]
+        ))
+
+    condition = Q()
+    for word in text.split():
+        condition &= Q(patient_name__icontains=word) | Q(invoice_number__icontains=word)
+    return condition
+
+
+def search_patient_invoices(queryset, text):
+    return queryset.filter(search_filter(text, queryset.db))
@@ -0,0 +1,107 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .billing import invalidate_rate_table
+from .dashboard import invalidate_dashboard
+from .fragments import bump_branch_version
+from .models import BillingRate, Branch, ElectronicInvoice, PatientInvoice, PatientInvoiceItem, Treatment
+from .pdf import invalidate_electronic_invoice_pdf
+from .summary import invoice_cells, period_cells, refresh_cells
+from .treatment_index import invalidate_treatment_index
+
+
+@receiver(post_save, sender=PatientInvoiceItem)
+@receiver(post_delete, sender=PatientInvoiceItem)
+def update_invoice_totals_for_item(sender, instance, **kwargs):
+    """Apply an item change to its invoice totals and monthly summary rows"""
+    previous_id = getattr(instance, '_loaded_patient_invoice_id', None)
+    previous_treatment_id = getattr(instance, '_loaded_treatment_id', None)
+    instance._loaded_patient_invoice_id = instance.patient_invoice_id
+    instance._loaded_treatment_id = instance.treatment_id
+
+    cells = invoice_cells(instance.patient_invoice_id, {instance.treatment_id})
+    moved = (previous_id, previous_treatment_id) != (instance.patient_invoice_id, instance.treatment_id)
+    if previous_id and moved:
+        cells |= invoice_cells(previous_id, {previous_treatment_id})
+    if previous_id and previous_id != instance.patient_invoice_id:
+        invalidate_electronic_invoice_pdf(PatientInvoice(pk=previous_id).refresh_totals())
+    invalidate_electronic_invoice_pdf(
+        PatientInvoice(pk=instance.patient_invoice_id).refresh_totals()
+    )
+    refresh_cells(cells)
+
+
+@receiver(post_save, sender=PatientInvoice)
+def update_totals_for_invoice_change(sender, instance, created, **kwargs):
+    """Re-split items when branch/date change and move totals on (re)assignment"""
+    loaded = getattr(instance, '_loaded_values', None)
+    instance._loaded_values = {
+        'electronic_invoice_id': instance.electronic_invoice_id,
+        'branch_id': instance.branch_id,
+        'date': instance.date,
+    }
+    if created or loaded is None:
+        return
+
+    if (loaded['branch_id'], loaded['date']) != (instance.branch_id, instance.date):
+        instance.resplit_items()
+        # Move the items between monthly summary rows
+        treatment_ids = set(instance.items.values_list('treatment_id', flat=True))
+        refresh_cells(
+            period_cells(loaded['date'], loaded['branch_id'], treatment_ids)
+            | period_cells(instance.date, instance.branch_id, treatment_ids)
+        )
+
+    previous_id = loaded['electronic_invoice_id']
+    if previous_id != instance.electronic_invoice_id:
+        for electronic_invoice_id in (previous_id, instance.electronic_invoice_id):
+            if electronic_invoice_id:
+                ElectronicInvoice(pk=electronic_invoice_id).refresh_totals()
+                invalidate_electronic_invoice_pdf(electronic_invoice_id)
+    else:
+        # Patient name, number, etc. are printed on the PDF
+        invalidate_electronic_invoice_pdf(instance.electronic_invoice_id)
+
+
+@receiver(post_delete, sender=PatientInvoice)
+def update_electronic_invoice_totals_for_deletion(sender, instance, **kwargs):
+    """Remove a deleted invoice from its electronic invoice totals"""
+    if instance.electronic_invoice_id:
+        ElectronicInvoice(pk=instance.electronic_invoice_id).refresh_totals()
+        invalidate_electronic_invoice_pdf(instance.electronic_invoice_id)
+
+
+@receiver(post_save, sender=ElectronicInvoice)
+@receiver(post_delete, sender=ElectronicInvoice)
+def invalidate_pdf_for_electronic_invoice(sender, instance, **kwargs):
+    invalidate_electronic_invoice_pdf(instance.pk)
+
+
+@receiver(post_save, sender=Treatment)
+@receiver(post_delete, sender=Treatment)
+@receiver(post_save, sender=PatientInvoice)
+@receiver(post_delete, sender=PatientInvoice)
+@receiver(post_save, sender=PatientInvoiceItem)
+@receiver(post_delete, sender=PatientInvoiceItem)
+def invalidate_dashboard_stats(sender, **kwargs):
+    invalidate_dashboard()
+
+
+@receiver(post_save, sender=Treatment)
+@receiver(post_delete, sender=Treatment)
+def invalidate_treatment_search(sender, **kwargs):
+    transaction.on_commit(invalidate_treatment_index)
+
+
+@receiver(post_save, sender=Branch)
+@receiver(post_delete, sender=Branch)
+def invalidate_branch_fragments(sender, **kwargs):
+    transaction.on_commit(bump_branch_version)
+
+
+@receiver(post_save, sender=BillingRate)
+@receiver(post_delete, sender=BillingRate)
+def invalidate_billing_rates(sender, **kwargs):
+    """New rates apply to items saved from now on (see rebuild_totals --resplit)"""
+    invalidate_rate_table()
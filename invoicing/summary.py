@@ -0,0 +1,165 @@
+"""
+Resumen mensual por sucursal y tratamiento.
+
+MonthlySummary holds one row per (year, month, branch, treatment) with the
+item count, quantity and the summed split columns. invoicing.signals
+recomputes only the cells touched by an item or invoice change, inside the
+same transaction and with the cells' rows locked; ``rebuild_monthly_summary``
+recreates the table from the items. Reports then read a few summary rows
+instead of the item history.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from .billing import SPLIT_FIELDS
+from .dashboard import invalidate_dashboard
+from .exports import period_range
+from .models import MonthlySummary, PatientInvoice, PatientInvoiceItem
+
+
+ZERO = Decimal('0.00')
+
+SUMMARY_FIELDS = ('item_count', 'quantity', *SPLIT_FIELDS)
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def _summary_annotations():
+    return {
+        'item_count': Count('id'),
+        'quantity': Sum('quantity'),
+        **{field: Sum(field) for field in SPLIT_FIELDS},
+    }
+
+
+def _values(row):
+    return {
+        field: row.get(field) or (ZERO if field in SPLIT_FIELDS else 0)
+        for field in SUMMARY_FIELDS
+    }
+
+
+def invoice_cells(patient_invoice_id, treatment_ids):
+    """Summary cells ``(year, month, branch_id, treatment_id)`` of an invoice's items"""
+    invoice = PatientInvoice.objects.filter(pk=patient_invoice_id).values('date', 'branch_id').first()
+    if invoice is None:
+        return set()
+    return period_cells(invoice['date'], invoice['branch_id'], treatment_ids)
+
+
+def period_cells(on_date, branch_id, treatment_ids):
+    return {(on_date.year, on_date.month, branch_id, treatment_id) for treatment_id in treatment_ids}
+
+
+def _lock_cells(year, month, branch_id, treatment_ids):
+    """
+    Lock the summary rows of the cells (inserting the missing ones first) until
+    the end of the transaction. A concurrent refresh of the same cells waits
+    here, and only aggregates once this transaction committed its items:
+    without the lock, each would count its own items only and the last
+    upsert would win. SQLite's write lock already serializes the writers.
+    """
+    treatment_ids = sorted(treatment_ids)
+    MonthlySummary.objects.bulk_create(
+        [
+            MonthlySummary(year=year, month=month, branch_id=branch_id, treatment_id=treatment_id)
+            for treatment_id in treatment_ids
+        ],
+        ignore_conflicts=True,
+    )
+    list(
+        MonthlySummary.objects.select_for_update().filter(
+            year=year, month=month, branch_id=branch_id, treatment_id__in=treatment_ids
+        ).order_by('treatment_id').values_list('pk', flat=True)
+    )
+
+
+def refresh_cells(cells):
+    """Recompute the given summary cells from the items, one query per month and branch"""
+    grouped = defaultdict(set)
+    for year, month, branch_id, treatment_id in cells:
+        grouped[(year, month, branch_id)].add(treatment_id)
+
+    with transaction.atomic():
+        # Sorted, so concurrent refreshes take the row locks in the same order
+        for (year, month, branch_id), treatment_ids in sorted(grouped.items()):
+            _lock_cells(year, month, branch_id, treatment_ids)
+            start, end = period_range(year, month)
+            rows = PatientInvoiceItem.objects.filter(
+                patient_invoice__date__gte=start,
+                patient_invoice__date__lt=end,
+                patient_invoice__branch_id=branch_id,
+                treatment_id__in=treatment_ids,
+            ).values('treatment_id').annotate(**_summary_annotations()).order_by()
+
+            summaries = [
+                MonthlySummary(
+                    year=year, month=month, branch_id=branch_id,
+                    treatment_id=row['treatment_id'], **_values(row)
+                )
+                for row in rows
+            ]
+            if summaries:
+                MonthlySummary.objects.bulk_create(
+                    summaries,
+                    update_conflicts=True,
+                    unique_fields=['year', 'month', 'branch', 'treatment'],
+                    update_fields=[*SUMMARY_FIELDS, 'updated_at'],
+                )
+            emptied = treatment_ids - {summary.treatment_id for summary in summaries}
+            if emptied:
+                MonthlySummary.objects.filter(
+                    year=year, month=month, branch_id=branch_id, treatment_id__in=emptied
+                ).delete()
+
+
+def rebuild_monthly_summary(year=None):
+    """Recreate the summary rows (of one year, or all) from the items. Returns the row count."""
+    items = PatientInvoiceItem.objects.all()
+    summaries = MonthlySummary.objects.all()
+    if year is not None:
+        start, end = period_range(year)
+        items = items.filter(patient_invoice__date__gte=start, patient_invoice__date__lt=end)
+        summaries = summaries.filter(year=year)
+
+    rows = items.values(
+        'patient_invoice__branch_id', 'treatment_id',
+        year=ExtractYear('patient_invoice__date'),
+        month=ExtractMonth('patient_invoice__date'),
+    ).annotate(**_summary_annotations()).order_by()
+
+    with transaction.atomic():
+        summaries.delete()
+        created = MonthlySummary.objects.bulk_create(
+            (
+                MonthlySummary(
+                    year=row['year'], month=row['month'],
+                    branch_id=row['patient_invoice__branch_id'],
+                    treatment_id=row['treatment_id'], **_values(row)
+                )
+                for row in rows.iterator()
+            ),
+            batch_size=REBUILD_BATCH_SIZE,
+        )
+    invalidate_dashboard()
+    return len(created)
+
+
+def monthly_report(year, month, branch=None):
+    """Summary rows and totals of a month, optionally for one branch"""
+    rows = MonthlySummary.objects.filter(year=year, month=month)
+    if branch:
+        rows = rows.filter(branch=branch)
+
+    totals = rows.aggregate(**{field: Sum(field) for field in SUMMARY_FIELDS})
+    return {
+        'rows': rows.select_related('branch', 'treatment').order_by('branch__name', 'treatment__code'),
+        'branch_totals': rows.values('branch__name').annotate(
+            **{field: Sum(field) for field in SUMMARY_FIELDS}
+        ).order_by('branch__name'),
+        'totals': _values(totals),
+    }
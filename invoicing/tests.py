@@ -1,3 +1,683 @@
-from django.test import TestCase
+import itertools
+import re
+import warnings
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from django.template.defaultfilters import floatformat
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .billing import DEFAULT_RATES, Rates, get_rate_table, split
+from .catalog import CatalogError, parse_catalog
+from .grouping import GroupingRules, group_invoices, next_numbers, plan_groups
+from .importer import InvoiceImporter, add_items, create_invoices, iter_csv_records
+from .models import (
+    BillingRate, Branch, Treatment, ElectronicInvoice, MonthlySummary, PatientInvoice, PatientInvoiceItem
+)
+from .routers import ReplicaRouter, read_from, read_from_primary
+from .summary import SUMMARY_FIELDS, rebuild_monthly_summary
+from .views import API_MAX_INVOICES
+
+
+# Tables that grow with the invoice history and must never be scanned in full
+HOT_TABLES = {
+    'invoicing_electronicinvoice',
+    'invoicing_patientinvoice',
+    'invoicing_patientinvoiceitem',
+    'invoicing_monthlysummary',
+}
+
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax')
+# The plans are checked on the default connection: keep every read there
+@override_settings(INVOICING_READ_REPLICAS=[])
+class QueryPlanTests(TestCase):
+    """Every main query of the views must be served from an index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('plan', password='plan')
+        cls.branch = Branch.objects.create(name='Central')
+        other_branch = Branch.objects.create(name='Norte')
+        treatments = [
+            Treatment.objects.create(code=f'T{number}', name=f'Tratamiento {number}', price=Decimal('1000'))
+            for number in range(3)
+        ]
+        cls.electronic_invoice = ElectronicInvoice.objects.create(
+            invoice_number='FE-001', date=date(2025, 1, 31)
+        )
+        for number in range(30):
+            invoice = PatientInvoice.objects.create(
+                patient_name=f'José Pérez {number}',
+                branch=cls.branch if number % 2 else other_branch,
+                invoice_number=f'FAC-{number:03d}',
+                date=date(2025, 1, 1) + timedelta(days=number),
+                electronic_invoice=cls.electronic_invoice if number < 10 else None,
+            )
+            for treatment in treatments[:number % 3 + 1]:
+                PatientInvoiceItem.objects.create(patient_invoice=invoice, treatment=treatment, quantity=2)
+        cls.patient_invoice = invoice
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def assertNoFullScans(self, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or not any(table in sql for table in HOT_TABLES):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                match = FULL_SCAN.match(step)
+                if match and match.group(1) in HOT_TABLES:
+                    self.fail(f'Full scan of {match.group(1)} for {url} {data or ""}:\n{sql}\n' + '\n'.join(plan))
+
+    def test_dashboard(self):
+        self.assertNoFullScans(reverse('invoicing:dashboard'))
+
+    def test_patient_invoice_list(self):
+        url = reverse('invoicing:patient_invoice_list')
+        self.assertNoFullScans(url)
+        self.assertNoFullScans(url, {'branch': self.branch.pk})
+        self.assertNoFullScans(url, {'assigned': 'no'})
+        self.assertNoFullScans(url, {'assigned': 'yes'})
+        self.assertNoFullScans(url, {'search': 'jose 01'})
+
+        next_url = self.client.get(url).context['page_obj'].next_url
+        self.assertNoFullScans(url + next_url)
+
+    def test_patient_invoice_detail(self):
+        self.assertNoFullScans(reverse('invoicing:patient_invoice_detail', args=[self.patient_invoice.pk]))
+
+    def test_electronic_invoice_list(self):
+        url = reverse('invoicing:electronic_invoice_list')
+        self.assertNoFullScans(url)
+        self.assertNoFullScans(url, {'year': 2025})
+        self.assertNoFullScans(url, {'year': 2025, 'month': 1})
+
+    def test_electronic_invoice_detail(self):
+        self.assertNoFullScans(reverse('invoicing:electronic_invoice_detail', args=[self.electronic_invoice.pk]))
+
+    def test_unassigned_picker(self):
+        url = reverse('invoicing:electronic_invoice_unassigned', args=[self.electronic_invoice.pk])
+        self.assertNoFullScans(url)
+        self.assertNoFullScans(url, {'branch': self.branch.pk})
+        self.assertNoFullScans(url, {'date_from': '2025-01-15', 'date_to': '2025-01-31'})
+
+    def test_reports(self):
+        self.assertNoFullScans(reverse('invoicing:monthly_report'), {'year': 2025, 'month': 1})
+        self.assertNoFullScans(reverse('invoicing:export_items'), {'year': 2025, 'month': 1})
+
+
+@override_settings(INVOICING_READ_REPLICAS=[])
+class AsyncViewTests(TestCase):
+    """The async views work through the ASGI handler, with the async ORM"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('async', password='async')
+        branch = Branch.objects.create(name='Central')
+        treatment = Treatment.objects.create(code='ENDO', name='Endodoncia', price=Decimal('1000'))
+        cls.electronic_invoice = ElectronicInvoice.objects.create(invoice_number='FE-001', date=date(2025, 1, 31))
+        invoice = PatientInvoice.objects.create(
+            patient_name='José Pérez', branch=branch, invoice_number='FAC-001', date=date(2025, 1, 1)
+        )
+        PatientInvoiceItem.objects.create(patient_invoice=invoice, treatment=treatment, quantity=1)
+
+    async def test_async_views(self):
+        dashboard = reverse('invoicing:dashboard')
+        response = await self.async_client.get(dashboard)
+        self.assertEqual(response.status_code, 302)
+
+        await self.async_client.aforce_login(self.user)
+        picker = reverse('invoicing:electronic_invoice_unassigned', args=[self.electronic_invoice.pk])
+        for url, data in [
+            (dashboard, None),
+            (reverse('invoicing:patient_invoice_list'), {'search': 'jose', 'count': '1'}),
+            (reverse('invoicing:electronic_invoice_list'), {'year': 2025}),
+            (picker, None),
+        ]:
+            response = await self.async_client.get(url, data)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['matching_count'], 1)
+
+        response = await self.async_client.get(reverse('invoicing:get_treatments_ajax'), {'search': 'endodoncia'})
+        self.assertEqual(response.json()['treatments'][0]['code'], 'ENDO')
+
+    async def test_async_streaming(self):
+        await self.async_client.aforce_login(self.user)
+        with warnings.catch_warnings():
+            # Django warns when it has to read a sync iterator to the end under ASGI
+            warnings.simplefilter('error')
+            response = await self.async_client.get(reverse('invoicing:export_items'), {'year': 2025})
+            self.assertTrue(response.is_async)
+            content = b''.join([part async for part in response]).decode()
+        self.assertEqual(len(content.splitlines()), 2)
+        self.assertIn('FAC-001', content)
+
+
+@override_settings(INVOICING_READ_REPLICAS=[])
+class ListFragmentCacheTests(TestCase):
+    """Cached list rows change as soon as anything they show changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('rows', password='rows'))
+        self.branch = Branch.objects.create(name='Central')
+        self.invoice = PatientInvoice.objects.create(
+            patient_name='José Pérez', branch=self.branch, invoice_number='FAC-001', date=date(2025, 1, 1)
+        )
+        treatment = Treatment.objects.create(code='ENDO', name='Endodoncia', price=Decimal('1000'))
+        self.item = PatientInvoiceItem.objects.create(patient_invoice=self.invoice, treatment=treatment, quantity=1)
+
+    def test_patient_invoice_rows(self):
+        url = reverse('invoicing:patient_invoice_list')
+        self.assertContains(self.client.get(url), 'Central')
+
+        self.branch.name = 'Norte'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.branch.save()
+        self.assertContains(self.client.get(url), 'Norte', count=2)  # dropdown and row
+
+        self.item.quantity = 3
+        self.item.save()
+        self.invoice.refresh_from_db()
+        self.assertContains(self.client.get(url), floatformat(self.invoice.total, 2))
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    """Reads follow the replica chosen by the view; writes always go to the primary"""
+
+    def test_routing(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(PatientInvoice))
+        with read_from('replica'):
+            self.assertEqual(router.db_for_read(PatientInvoice), 'replica')
+            self.assertEqual(router.db_for_write(PatientInvoice), 'default')
+            with read_from_primary():
+                self.assertIsNone(router.db_for_read(PatientInvoice))
+            self.assertEqual(router.db_for_read(PatientInvoice), 'replica')
+        self.assertIsNone(router.db_for_read(PatientInvoice))
+
+
+@override_settings(INVOICING_READ_REPLICAS=[])
+class ReplicaSessionTests(TestCase):
+    """A session newer than the replica keeps working inside replica views"""
+
+    def test_session_only_on_primary(self):
+        user = User.objects.create_user('fresh', password='fresh')
+        self.client.force_login(user)
+        session_key = self.client.session.session_key
+        routed = []
+        real_db_for_read = ReplicaRouter.db_for_read
+
+        def db_for_read(router, model, **hints):
+            alias = real_db_for_read(router, model, **hints)
+            routed.append((model._meta.label, alias))
+            # The test database has no replica: the primary plays both roles
+            return None
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', db_for_read):
+            with read_from('replica'):
+                # The row exists only on the primary, as right after a login
+                self.assertEqual(SessionStore(session_key).load()['_auth_user_id'], str(user.pk))
+                self.assertEqual(User.objects.get(pk=user.pk), user)
+            with mock.patch('invoicing.routers._replica_for', return_value='replica'):
+                response = self.client.get(reverse('invoicing:export_items'), {'year': 2025})
+                b''.join(response.streaming_content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(('invoicing.PatientInvoiceItem', 'replica'), routed)
+        self.assertEqual(
+            {alias for label, alias in routed if not label.startswith('invoicing.')}, {None}
+        )
+
+
+class InvoiceImporterTests(TestCase):
+    """Imports commit chunk by chunk, resume after the last committed line and reject bad prices"""
+
+    HEADER = 'invoice_number,patient_name,branch,date,treatment_code,quantity,unit_price'
+
+    @classmethod
+    def setUpTestData(cls):
+        Branch.objects.create(name='Central')
+        Treatment.objects.create(code='ENDO', name='Endodoncia', price=Decimal('1000'))
+        Treatment.objects.create(code='LIMP', name='Limpieza', price=Decimal('500'))
+
+    def lines(self, invoices):
+        # Two rows (items) per invoice: line numbers 2, 4, 6...
+        yield self.HEADER
+        for number in range(invoices):
+            yield f'FAC-{number},Paciente {number},Central,2025-01-15,ENDO,1,'
+            yield f'FAC-{number},Paciente {number},Central,2025-01-15,LIMP,2,'
+
+    def test_chunk_boundaries(self):
+        committed = []
+        with self.captureOnCommitCallbacks(execute=True):
+            result = InvoiceImporter(chunk_size=2).run(iter_csv_records(self.lines(5)), on_commit=committed.append)
+        # An invoice is never split between chunks, even when its rows are
+        self.assertEqual(committed, [4, 8, 10])
+        self.assertEqual((result.invoices, result.items, result.rejected), (5, 10, 0))
+        for invoice in PatientInvoice.objects.all():
+            self.assertEqual(invoice.items.count(), 2)
+            self.assertEqual(invoice.subtotal, Decimal('2000.00'))
+
+    def test_resume(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            InvoiceImporter(chunk_size=2).run(itertools.islice(iter_csv_records(self.lines(5)), 2))
+            result = InvoiceImporter(chunk_size=2).run(iter_csv_records(self.lines(5)), resume_after=4)
+        self.assertEqual((result.invoices, result.rejected), (3, 0))
+        self.assertEqual(PatientInvoice.objects.count(), 5)
+
+    def test_rejected_prices(self):
+        lines = [self.HEADER] + [
+            f'FAC-{number},Paciente,Central,2025-01-15,ENDO,1,{price}'
+            for number, price in enumerate(['NaN', 'Infinity', '-1', '123456789', '99999999.99'])
+        ]
+        result = InvoiceImporter().run(iter_csv_records(lines))
+        self.assertEqual(result.rejected, 4)
+        self.assertEqual(PatientInvoice.objects.get().subtotal, Decimal('99999999.99'))
+
+    def test_rejected_quantities(self):
+        lines = [self.HEADER] + [
+            f'FAC-{number},Paciente,Central,2025-01-15,ENDO,{quantity},{price}'
+            for number, (quantity, price) in enumerate([
+                (10 ** 30, ''), (10 ** 19, ''), (2 ** 31, '0.01'), (10 ** 9, ''), (10 ** 8, '99999999.99'),
+                (10 ** 8, '1000'),
+            ])
+        ]
+        result = InvoiceImporter().run(iter_csv_records(lines))
+        self.assertEqual(result.rejected, 5)
+        self.assertIn('times the unit price', result.errors[-1].message)
+        self.assertEqual(PatientInvoice.objects.get().subtotal, Decimal('100000000000.00'))
+
+    def test_api_rejects_huge_quantity(self):
+        self.client.force_login(User.objects.create_user('api', password='api'))
+        for quantity in (10 ** 30, 10 ** 19, 10 ** 12):
+            response = self.client.post(reverse('invoicing:api_create_invoices'), {
+                'invoice_number': 'FAC-1', 'patient_name': 'Paciente', 'branch': 'Central', 'date': '2025-01-15',
+                'items': [{'treatment_code': 'ENDO', 'quantity': quantity}],
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('too large', response.json()['errors'][0]['error'])
+        self.assertFalse(PatientInvoice.objects.exists())
+
+    def test_api_rejects_nan_price(self):
+        self.client.force_login(User.objects.create_user('api', password='api'))
+        response = self.client.post(reverse('invoicing:api_create_invoices'), {
+            'invoice_number': 'FAC-1', 'patient_name': 'Paciente', 'branch': 'Central', 'date': '2025-01-15',
+            'items': [{'treatment_code': 'ENDO', 'quantity': 1, 'unit_price': 'NaN'}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid price', response.json()['errors'][0]['error'])
+
+
+@override_settings(INVOICING_READ_REPLICAS=[])
+class ReportFormTests(TestCase):
+    """Out-of-range years are form errors, not server errors"""
+
+    def test_invalid_years(self):
+        self.client.force_login(User.objects.create_user('report', password='report'))
+        for year in (0, 9999, 10 ** 20):
+            response = self.client.get(reverse('invoicing:monthly_report'), {'year': year, 'month': 1})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['form'].errors['year'])
+            response = self.client.get(reverse('invoicing:export_items'), {'year': year})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['form'].errors['year'])
+            # The electronic invoice list ignores the filter
+            response = self.client.get(reverse('invoicing:electronic_invoice_list'), {'year': year})
+            self.assertEqual(response.status_code, 200)
+
+
+@override_settings(INVOICING_READ_REPLICAS=[])
+class AssignMatchingInvoicesTests(TestCase):
+    """"Assign all matching" assigns exactly the invoices the picker showed, or nothing"""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('assign', password='assign'))
+        self.branch = Branch.objects.create(name='Central')
+        self.electronic_invoice = ElectronicInvoice.objects.create(invoice_number='FE-001', date=date(2025, 1, 31))
+        for number in range(3):
+            self.create(number)
+        self.url = reverse('invoicing:assign_to_electronic_invoice', args=[self.electronic_invoice.pk])
+
+    def create(self, number):
+        return PatientInvoice.objects.create(
+            patient_name=f'Paciente {number}', branch=self.branch,
+            invoice_number=f'FAC-{number:03d}', date=date(2025, 1, 1 + number),
+        )
+
+    def shown(self, **filters):
+        response = self.client.get(
+            reverse('invoicing:electronic_invoice_unassigned', args=[self.electronic_invoice.pk]), filters
+        )
+        return {
+            'select_all': '1', **filters,
+            'matching_count': response.context['matching_count'],
+            'matching_max_id': response.context['matching_max_id'],
+        }
+
+    def assigned(self):
+        return self.electronic_invoice.patient_invoices.count()
+
+    def test_assigns_what_was_shown(self):
+        data = self.shown(date_from='2025-01-02')
+        # Created after the picker was loaded: not part of the selection
+        self.create(10)
+        self.client.post(self.url, data)
+        self.assertEqual(self.assigned(), 2)
+        self.assertEqual(PatientInvoice.objects.filter(electronic_invoice__isnull=True).count(), 2)
+
+    def test_rejects_invalid_filters(self):
+        data = self.shown()
+        self.client.post(self.url, {**data, 'date_from': 'not a date'})
+        self.client.post(self.url, {'select_all': '1'})
+        self.assertEqual(self.assigned(), 0)
+
+    def test_rejects_changed_selection(self):
+        data = self.shown(date_from='2025-01-02')
+        # Now matches the filter, but was not among the invoices shown
+        PatientInvoice.objects.filter(invoice_number='FAC-000').update(date=date(2025, 1, 5))
+        response = self.client.post(self.url, data, follow=True)
+        self.assertEqual(self.assigned(), 0)
+        self.assertContains(response, 'cambiaron')
+
+
+class InvoiceAPITests(TestCase):
+    """The JSON API authenticates with the session and a CSRF header, and creates all invoices or none"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('api', password='api')
+        Branch.objects.create(name='Central')
+        Treatment.objects.create(code='ENDO', name='Endodoncia', price=Decimal('1000'))
+
+    def setUp(self):
+        self.client = Client(enforce_csrf_checks=True)
+        self.url = reverse('invoicing:api_create_invoices')
+
+    def invoice(self, number, code='ENDO'):
+        return {
+            'invoice_number': f'FAC-{number}', 'patient_name': 'Paciente', 'branch': 'Central',
+            'date': '2025-01-15', 'items': [{'treatment_code': code, 'quantity': 2}],
+        }
+
+    def post(self, payload, csrf=True):
+        headers = {'X-CSRFToken': self.client.cookies['csrftoken'].value} if csrf else {}
+        return self.client.post(self.url, payload, content_type='application/json', headers=headers)
+
+    def login(self):
+        # The documented route: the login page sets the CSRF cookie
+        self.client.get(reverse('login'))
+        self.client.post(reverse('login'), {
+            'username': 'api', 'password': 'api', 'csrfmiddlewaretoken': self.client.cookies['csrftoken'].value,
+        })
+
+    def test_authentication(self):
+        response = self.post(self.invoice(1), csrf=False)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'error': 'Authentication required.'})
+
+        self.login()
+        response = self.post(self.invoice(1), csrf=False)
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('CSRF', response.json()['error'])
+
+        response = self.post(self.invoice(1))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['invoices'][0]['subtotal'], '2000.00')
+
+    def test_partial_failure(self):
+        self.login()
+        response = self.post({'invoices': [self.invoice(1), self.invoice(2, code='NOPE'), self.invoice(1)]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2])
+        self.assertFalse(PatientInvoice.objects.exists())
+
+    def test_row_limit(self):
+        self.login()
+        response = self.post([self.invoice(number) for number in range(API_MAX_INVOICES + 1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(API_MAX_INVOICES), response.json()['error'])
+        self.assertFalse(PatientInvoice.objects.exists())
+
+
+class MonthlySummaryTests(TestCase):
+    """The incremental rollup always equals a rebuild from the items"""
+
+    def summary(self):
+        return list(MonthlySummary.objects.order_by('year', 'month', 'branch', 'treatment').values_list(
+            'year', 'month', 'branch', 'treatment', *SUMMARY_FIELDS
+        ))
+
+    def test_rollup_matches_rebuild(self):
+        central = Branch.objects.create(name='Central')
+        norte = Branch.objects.create(name='Norte')
+        endo, limp, rx = [
+            Treatment.objects.create(code=code, name=code, price=Decimal(price))
+            for code, price in [('ENDO', '1000'), ('LIMP', '333.33'), ('RX', '0.05')]
+        ]
+
+        # Saved one by one (signals)
+        invoice = PatientInvoice.objects.create(
+            patient_name='Paciente', branch=central, invoice_number='FAC-1', date=date(2025, 1, 31)
+        )
+        item = PatientInvoiceItem.objects.create(patient_invoice=invoice, treatment=endo, quantity=2)
+        PatientInvoiceItem.objects.create(patient_invoice=invoice, treatment=limp, quantity=1)
+        # Bulk paths (explicit refresh)
+        bulk = PatientInvoice(patient_name='Paciente', branch=norte, invoice_number='FAC-2', date=date(2025, 1, 15))
+        create_invoices([(bulk, [
+            PatientInvoiceItem(treatment=endo, quantity=1, unit_price=endo.price),
+            PatientInvoiceItem(treatment=rx, quantity=3, unit_price=rx.price),
+        ])])
+        add_items(invoice, [PatientInvoiceItem(treatment=rx, quantity=7, unit_price=rx.price)])
+        # Changes that move items between cells or empty them
+        item.quantity = 5
+        item.save()
+        invoice.date = date(2025, 2, 1)
+        invoice.save()
+        PatientInvoiceItem.objects.get(patient_invoice=bulk, treatment=endo).delete()
+        other = PatientInvoice.objects.create(
+            patient_name='Paciente', branch=norte, invoice_number='FAC-3', date=date(2025, 3, 3)
+        )
+        PatientInvoiceItem.objects.create(patient_invoice=other, treatment=limp, quantity=1)
+        other.delete()
+
+        incremental = self.summary()
+        self.assertEqual(len(incremental), 4)
+        rebuild_monthly_summary()
+        self.assertEqual(incremental, self.summary())
+
+
+class GroupingTests(TestCase):
+    """Grouping numbers after the highest number and only takes invoices that are still unassigned"""
+
+    def setUp(self):
+        self.branch = Branch.objects.create(name='Central')
+        treatment = Treatment.objects.create(code='ENDO', name='Endodoncia', price=Decimal('1000'))
+        for number in range(6):
+            invoice = PatientInvoice.objects.create(
+                patient_name='Paciente', branch=self.branch,
+                invoice_number=f'FAC-{number}', date=date(2025, 1, 1 + number),
+            )
+            PatientInvoiceItem.objects.create(patient_invoice=invoice, treatment=treatment, quantity=1)
+
+    def test_next_numbers(self):
+        self.assertEqual(next_numbers('FE-', 2), ['FE-00000001', 'FE-00000002'])
+        for number in ('FE-99999999', 'FE-100000000', 'FE-7', 'FEX-200000000'):
+            ElectronicInvoice.objects.create(invoice_number=number, date=date(2025, 1, 31))
+        self.assertEqual(next_numbers('FE-', 2), ['FE-100000001', 'FE-100000002'])
+
+    def test_concurrent_assignment(self):
+        rules = GroupingRules(max_invoices=2)
+        other = ElectronicInvoice.objects.create(invoice_number='MANUAL-1', date=date(2025, 1, 31))
+
+        def plan_then_assign(rules, rows):
+            groups = plan_groups(rules, rows)
+            # Another user assigns the first group and one invoice of the second meanwhile
+            taken = groups[0].invoice_ids + groups[1].invoice_ids[:1]
+            PatientInvoice.objects.filter(id__in=taken).update(electronic_invoice=other)
+            return groups
+
+        with mock.patch('invoicing.grouping.plan_groups', plan_then_assign):
+            result = group_invoices(rules)
+        self.assertEqual((result.assigned, result.skipped), (3, 3))
+        # The emptied group's electronic invoice is not kept
+        self.assertEqual(len(result.electronic_invoices), 2)
+        self.assertEqual(ElectronicInvoice.objects.exclude(pk=other.pk).count(), 2)
+        for electronic_invoice in result.electronic_invoices:
+            electronic_invoice.refresh_from_db()
+            invoices = electronic_invoice.patient_invoices.count()
+            self.assertEqual(electronic_invoice.subtotal, invoices * Decimal('1000'))
+        self.assertFalse(PatientInvoice.objects.filter(electronic_invoice__isnull=True).exists())
+
+
+class BillingSplitTests(TestCase):
+    """Split rounding and the versioned rate table"""
+
+    def test_split_rounding(self):
+        columns = split(
+            [3, 1, 1],
+            [Decimal('333.33'), Decimal('0.10'), Decimal('0.10')],
+            [DEFAULT_RATES, Rates(Decimal('0.25'), Decimal('0.75'), Decimal('0.05')),
+             Rates(Decimal('0.25'), Decimal('0.70'), Decimal('0'))],
+        )
+        self.assertEqual(columns['subtotal'], [Decimal('999.99'), Decimal('0.10'), Decimal('0.10')])
+        # Half up, not to even: 149.9985 -> 150.00 and 0.025 -> 0.03
+        self.assertEqual(columns['monto_asembis'], [Decimal('150.00'), Decimal('0.03'), Decimal('0.03')])
+        # The doctor gets the rest when the rates add up to 100 %, else its own rounded share
+        self.assertEqual(columns['monto_dr'], [Decimal('849.99'), Decimal('0.07'), Decimal('0.07')])
+        self.assertEqual(columns['iva'], [Decimal('40.00'), Decimal('0.01'), Decimal('0.00')])
+        self.assertEqual(columns['total'], [Decimal('1039.99'), Decimal('0.11'), Decimal('0.10')])
+        with self.assertRaises(ValueError):
+            split([1], [Decimal('1'), Decimal('2')])
+
+    def test_rate_versions(self):
+        central = Branch.objects.create(name='Central')
+        norte = Branch.objects.create(name='Norte')
+        endo = Treatment.objects.create(code='ENDO', name='Endodoncia', price=Decimal('1000'))
+
+        def rate(asembis, effective_from, **scope):
+            asembis = Decimal(asembis)
+            return BillingRate.objects.create(
+                effective_from=effective_from, asembis_rate=asembis, dr_rate=1 - asembis,
+                iva_rate=Decimal('0.04'), **scope
+            )
+
+        rate('0.20', date(2025, 1, 1))
+        rate('0.30', date(2025, 6, 1), treatment=endo)
+        rate('0.40', date(2025, 3, 1), branch=central, treatment=endo)
+        table = get_rate_table()
+        for branch, on_date, asembis in [
+            (central, date(2024, 12, 31), DEFAULT_RATES.asembis),
+            (central, date(2025, 2, 28), Decimal('0.20')),
+            (central, date(2025, 3, 1), Decimal('0.40')),
+            (central, date(2025, 7, 1), Decimal('0.40')),
+            (norte, date(2025, 3, 1), Decimal('0.20')),
+            (norte, date(2025, 6, 1), Decimal('0.30')),
+        ]:
+            self.assertEqual(table.resolve(branch.pk, endo.pk, on_date).asembis, asembis)
+
+        # A new version is picked up at once by the invoices saved afterwards
+        invoice = PatientInvoice.objects.create(
+            patient_name='Paciente', branch=norte, invoice_number='FAC-1', date=date(2025, 8, 1)
+        )
+        item = PatientInvoiceItem.objects.create(patient_invoice=invoice, treatment=endo, quantity=1)
+        self.assertEqual(item.monto_asembis, Decimal('300.00'))
+        rate('0.10', date(2025, 8, 1), branch=norte, treatment=endo)
+        self.assertIsNot(get_rate_table(), table)
+        other = PatientInvoiceItem.objects.create(
+            patient_invoice=PatientInvoice.objects.create(
+                patient_name='Paciente', branch=norte, invoice_number='FAC-2', date=date(2025, 8, 1)
+            ),
+            treatment=endo, quantity=1,
+        )
+        self.assertEqual(other.monto_asembis, Decimal('100.00'))
+        # Stored items keep the rates they were split with
+        item.refresh_from_db()
+        self.assertEqual(item.monto_asembis, Decimal('300.00'))
+
+
+@override_settings(INVOICING_READ_REPLICAS=[])
+class AddTreatmentsTests(TestCase):
+    """Several treatments are added in one request, skipping the ones already on the invoice"""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('items', password='items'))
+        branch = Branch.objects.create(name='Central')
+        self.endo, self.limp, self.rx = [
+            Treatment.objects.create(code=code, name=name, price=Decimal(price))
+            for code, name, price in [
+                ('ENDO', 'Endodoncia', '1000'), ('LIMP', 'Limpieza', '500'), ('RX', 'Rayos X', '250')
+            ]
+        ]
+        inactive = Treatment.objects.create(code='OLD', name='Antiguo', price=Decimal('1'), is_active=False)
+        self.inactive_id = inactive.pk
+        self.invoice = PatientInvoice.objects.create(
+            patient_name='Paciente', branch=branch, invoice_number='FAC-1', date=date(2025, 1, 15)
+        )
+        PatientInvoiceItem.objects.create(patient_invoice=self.invoice, treatment=self.endo, quantity=1)
+        self.url = reverse('invoicing:patient_invoice_detail', args=[self.invoice.pk])
+
+    def test_add_several(self):
+        response = self.client.post(self.url, {
+            'action': 'add_treatment',
+            'treatment_id': [self.limp.pk, self.endo.pk, self.rx.pk, self.inactive_id],
+            'quantity': [2, 5],
+        }, headers={'X-Requested-With': 'XMLHttpRequest'})
+        data = response.json()
+        self.assertEqual(data['level'], 'warning')
+        self.assertEqual(len(data['rows']), 2)
+        self.assertEqual([treatment['code'] for treatment in data['skipped']], ['ENDO'])
+        self.assertEqual(data['not_found'], [self.inactive_id])
+
+        quantities = dict(self.invoice.items.values_list('treatment__code', 'quantity'))
+        # Missing quantities default to 1; the existing item is untouched
+        self.assertEqual(quantities, {'ENDO': 1, 'LIMP': 2, 'RX': 1})
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.subtotal, Decimal('2250.00'))
+        self.assertEqual(data['totals']['subtotal'], '2250.00')
+        summary = MonthlySummary.objects.filter(year=2025, month=1)
+        self.assertEqual(summary.aggregate(total=Sum('subtotal'))['total'], Decimal('2250.00'))
+
+    def test_add_items(self):
+        items = add_items(self.invoice, [
+            PatientInvoiceItem(treatment=self.limp, quantity=2, unit_price=self.limp.price),
+            PatientInvoiceItem(treatment=self.rx, quantity=3, unit_price=Decimal('0.05')),
+        ])
+        self.assertTrue(all(item.pk for item in items))
+        self.assertEqual([item.total for item in items], [Decimal('1040.00'), Decimal('0.16')])
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.total, Decimal('2080.16'))
+        self.assertEqual(add_items(self.invoice, []), [])
+
+
+class CatalogTests(SimpleTestCase):
+    """Catalog prices must be finite and fit Treatment.price"""
+
+    def test_rejected_prices(self):
+        for price in ('nan', 'Infinity', '-1', 'abc', '123456789012345', '100000000'):
+            with self.subTest(price=price), self.assertRaises(CatalogError):
+                parse_catalog(f'code,name,price\nENDO,Endodoncia,{price}\n', 'csv')
+        rows = parse_catalog('[{"code": "ENDO", "name": "Endodoncia", "price": "99999999.99"}]', 'json')
+        self.assertEqual(rows[0].price, Decimal('99999999.99'))
@@ -0,0 +1,60 @@
+"""
+Totales de facturación calculados en la base de datos.
+
+Line amounts are split once by invoicing.billing and stored on each
+PatientInvoiceItem, so an electronic invoice breakdown costs one ``aggregate()``
+over PatientInvoiceItem no matter how many patient invoices it groups.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, Sum
+
+from .billing import SPLIT_FIELDS as AMOUNT_FIELDS
+from .models import PatientInvoiceItem
+
+
+ZERO = Decimal('0.00')
+
+
+def aggregate_item_totals(items):
+    """Sum the amounts of an item queryset in a single query"""
+    result = items.aggregate(
+        item_count=Count('id'),
+        **{field: Sum(field) for field in AMOUNT_FIELDS}
+    )
+    totals = {field: result[field] or ZERO for field in AMOUNT_FIELDS}
+    totals['item_count'] = result['item_count']
+    return totals
+
+
+def electronic_invoice_totals(electronic_invoice):
+    """ASEMBIS/DR/IVA/total breakdown of an electronic invoice"""
+    return aggregate_item_totals(
+        PatientInvoiceItem.objects.filter(patient_invoice__electronic_invoice=electronic_invoice)
+    )
+
+
+def annotate_invoice_totals(patient_invoices):
+    """
+    Annotate each patient invoice with ``items_count`` and ``items_<amount>``
+    totals computed from its items.
+    """
+    return patient_invoices.annotate(
+        items_count=Count('items'),
+        **{
+            f'items_{field}': Sum(f'items__{field}', default=ZERO)
+            for field in AMOUNT_FIELDS
+        }
+    )
+
+
+def electronic_invoice_lines(electronic_invoice):
+    """Line items of an electronic invoice, ordered to be regrouped by patient invoice"""
+    return PatientInvoiceItem.objects.filter(
+        patient_invoice__electronic_invoice=electronic_invoice
+    ).select_related(
+        'patient_invoice__branch', 'treatment'
+    ).order_by(
+        '-patient_invoice__date', '-patient_invoice__invoice_number',
+        'patient_invoice_id', 'treatment__code'
+    )
@@ -0,0 +1,164 @@
+"""
+Índice en memoria de tratamientos activos para el autocompletado.
+
+Each process keeps the active treatments with their code and name folded
+(lower case, accents removed), so "apicectomia" matches "APICECTOMÍA", plus an
+LRU of recent query results. Like the billing rate table, the index is
+reloaded when its version (bumped by invoicing.signals on every Treatment
+change, shared through the Django cache) moves, or after TREATMENT_INDEX_TTL.
+
+Results are ranked: exact code, code prefix, name prefix, prefix of a word in
+the name, then any substring; ties are broken by code.
+"""
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from .routers import read_from_primary
+
+
+TREATMENT_INDEX_VERSION_KEY = 'invoicing:treatment-index-version'
+TREATMENT_INDEX_TTL = 300
+QUERY_CACHE_SIZE = 512
+DEFAULT_LIMIT = 10
+
+
+def fold(text):
+    """Lower-case text without accents, for accent-insensitive matching"""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+class TreatmentIndex:
+    """Immutable snapshot of the active treatments with a query-result LRU"""
+
+    def __init__(self, treatments=(), version=None):
+        self.version = version
+        self._entries = []
+        for treatment_id, code, name, price in treatments:
+            folded_code, folded_name = fold(code), fold(name)
+            self._entries.append((
+                folded_code,
+                folded_name,
+                tuple(folded_name.split()),
+                {'id': treatment_id, 'code': code, 'name': name, 'price': str(price)},
+            ))
+        self._entries.sort(key=lambda entry: entry[0])
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _rank(query, folded_code, folded_name, words):
+        if folded_code == query:
+            return 0
+        if folded_code.startswith(query):
+            return 1
+        if folded_name.startswith(query):
+            return 2
+        if any(word.startswith(query) for word in words):
+            return 3
+        if query in folded_code or query in folded_name:
+            return 4
+        return None
+
+    def _search(self, query, limit):
+        tokens = query.split()
+        if not tokens:
+            return [data for *_, data in self._entries[:limit]]
+
+        ranked = []
+        for position, (folded_code, folded_name, words, data) in enumerate(self._entries):
+            rank = self._rank(query, folded_code, folded_name, words)
+            if rank is None and len(tokens) > 1:
+                # "endo molar" matches "Endodoncia Molar" once every word matches
+                ranks = [self._rank(token, folded_code, folded_name, words) for token in tokens]
+                if None not in ranks:
+                    rank = 5 + min(ranks)
+            if rank is not None:
+                ranked.append((rank, position, data))
+        ranked.sort(key=lambda result: result[:2])
+        return [data for _, _, data in ranked[:limit]]
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Ranked treatment dicts (id, code, name, price) matching the query"""
+        key = (' '.join(fold(query).split()), limit)
+        with self._lock:
+            results = self._results.get(key)
+            if results is not None:
+                self._results.move_to_end(key)
+                return results
+
+        results = self._search(key[0], limit)
+        with self._lock:
+            self._results[key] = results
+            if len(self._results) > QUERY_CACHE_SIZE:
+                self._results.popitem(last=False)
+        return results
+
+
+_lock = threading.Lock()
+_index = None
+_loaded_at = 0.0
+
+
+def _active_treatments():
+    from .models import Treatment
+
+    return Treatment.objects.filter(is_active=True).values_list('id', 'code', 'name', 'price')
+
+
+def load_treatment_index(version=None):
+    return TreatmentIndex(_active_treatments(), version=version)
+
+
+def _is_stale(index, version):
+    return index is None or index.version != version or time.monotonic() - _loaded_at > TREATMENT_INDEX_TTL
+
+
+def get_treatment_index():
+    """Cached treatment index for this process"""
+    global _index, _loaded_at
+    version = cache.get(TREATMENT_INDEX_VERSION_KEY, 0)
+    index = _index
+    if _is_stale(index, version):
+        with _lock, read_from_primary():
+            index = load_treatment_index(version)
+            _index, _loaded_at = index, time.monotonic()
+    return index
+
+
+async def aget_treatment_index():
+    """get_treatment_index() for async views, loading with the async ORM"""
+    global _index, _loaded_at
+    version = await cache.aget(TREATMENT_INDEX_VERSION_KEY, 0)
+    index = _index
+    if _is_stale(index, version):
+        # No lock: it would block the event loop, and a concurrent reload is harmless
+        with read_from_primary():
+            index = TreatmentIndex([row async for row in _active_treatments()], version=version)
+        _index, _loaded_at = index, time.monotonic()
+    return index
+
+
+def invalidate_treatment_index():
+    """Force every process to reload the treatment index on next use"""
+    global _index
+    try:
+        cache.incr(TREATMENT_INDEX_VERSION_KEY)
+    except ValueError:
+        cache.set(TREATMENT_INDEX_VERSION_KEY, 1, None)
+    _index = None
+
+
+def search_treatments(query, limit=DEFAULT_LIMIT):
+    return get_treatment_index().search(query, limit)
+
+
+async def asearch_treatments(query, limit=DEFAULT_LIMIT):
+    return (await aget_treatment_index()).search(query, limit)
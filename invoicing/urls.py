@@ -11,6 +11,7 @@ urlpatterns = [
     # NEW MAIN WORKFLOW: Patient Invoices (now the starting point)
     path('invoices/', views.PatientInvoiceListView.as_view(), name='patient_invoice_list'),
     path('invoices/create/', views.PatientInvoiceCreateView.as_view(), name='patient_invoice_create'),
+    path('invoices/import/', views.import_invoices, name='patient_invoice_import'),
     path('invoices/<int:pk>/', views.PatientInvoiceDetailView.as_view(), name='patient_invoice_detail'),
     path('invoices/<int:pk>/update/', views.PatientInvoiceUpdateView.as_view(), name='patient_invoice_update'),
     
@@ -26,12 +27,24 @@ urlpatterns = [
     # Electronic Invoice URLs (now for grouping existing invoices)
     path('electronic-invoices/', views.ElectronicInvoiceListView.as_view(), name='electronic_invoice_list'),
     path('electronic-invoices/create/', views.ElectronicInvoiceCreateView.as_view(), name='electronic_invoice_create'),
+    path('electronic-invoices/group/', views.group_invoices_view, name='electronic_invoice_group'),
     path('electronic-invoices/<int:pk>/', views.ElectronicInvoiceDetailView.as_view(), name='electronic_invoice_detail'),
     path('electronic-invoices/<int:pk>/pdf/', views.ElectronicInvoicePDFView.as_view(), name='electronic_invoice_pdf'),
+    path('electronic-invoices/<int:pk>/unassigned/', views.UnassignedInvoicePickerView.as_view(), name='electronic_invoice_unassigned'),
     
     # NEW: Assign patient invoices to electronic invoice
     path('electronic-invoices/<int:electronic_invoice_id>/assign/', views.assign_to_electronic_invoice, name='assign_to_electronic_invoice'),
     
+    # Reports
+    path('reports/monthly/', views.MonthlyReportView.as_view(), name='monthly_report'),
+    path('reports/export/', views.export_items_csv, name='export_items'),
+    
+    # Monitoring
+    path('metrics/', views.metrics_view, name='metrics'),
+    
+    # JSON API
+    path('api/invoices/', views.create_invoices_api, name='api_create_invoices'),
+    
     # AJAX endpoints
     path('ajax/treatments/', views.get_treatments_ajax, name='get_treatments_ajax'),
 ]
\ No newline at end of file
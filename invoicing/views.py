@@ -1,70 +1,70 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.views.generic import (
-    ListView, DetailView, CreateView, UpdateView, DeleteView
+    ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
 )
 from django.urls import reverse_lazy, reverse
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Sum, Count
-from django.http import JsonResponse, HttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from django.db.models import Q, Sum, Count, Max
+from django.http import JsonResponse, HttpResponse, FileResponse, StreamingHttpResponse, Http404
 from django.forms import inlineformset_factory
 from django.template.loader import render_to_string
+from django.utils import timezone
+from django.views.decorators.http import require_POST
 from datetime import datetime, date
 from decimal import Decimal
-import weasyprint
+import io
+import json
+import time
 
 from .models import (
-    Branch, Treatment, ElectronicInvoice, 
+    TOTAL_FIELDS, Branch, Treatment, ElectronicInvoice, 
     PatientInvoice, PatientInvoiceItem
 )
+from .api_auth import api_view
+from .async_views import AsyncKeysetListView, AsyncLoginRequiredMixin, aiterate, is_asgi
+from .dashboard import adashboard_stats, invalidate_dashboard
+from .exports import aiter_csv, export_filename, iter_csv, period_items, period_range
 from .forms import (
     ElectronicInvoiceForm, PatientInvoiceForm, StandalonePatientInvoiceForm,
-    PatientInvoiceItemForm, TreatmentForm
+    PatientInvoiceItemForm, TreatmentForm, MonthlyReportForm, ItemExportForm,
+    InvoiceImportForm, InvoiceGroupingForm, UnassignedInvoiceFilterForm, AssignMatchingInvoicesForm
 )
+from .fragments import abranch_version, annotate_items_changed
+from .grouping import group_invoices, plan_groups
+from .importer import (
+    InvoiceImporter, InvoiceImportError, add_items, create_invoices_from_objects, iter_records
+)
+from .pdf import (
+    aopen_electronic_invoice_pdf, invalidate_electronic_invoice_pdf, pdf_filename
+)
+from .metrics import metrics_enabled, registry
+from .routers import ReplicaReadMixin, reads_from_replica
+from .search import search_patient_invoices
+from .summary import monthly_report
+from .totals import annotate_invoice_totals, electronic_invoice_totals
+from .treatment_index import asearch_treatments
 
 
-class DashboardView(LoginRequiredMixin, ListView):
+class DashboardView(AsyncLoginRequiredMixin, ReplicaReadMixin, TemplateView):
     """Dashboard principal con resumen de facturas - Updated for new workflow"""
     template_name = 'invoicing/dashboard.html'
-    context_object_name = 'recent_invoices'
-    paginate_by = 10
 
-    def get_queryset(self):
+    async def get(self, request, *args, **kwargs):
         # Show recent patient invoices instead of electronic invoices
-        return PatientInvoice.objects.order_by('-date')[:10]
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        
-        # Estadísticas del mes actual
-        current_month = date.today().month
-        current_year = date.today().year
-        
-        monthly_stats = PatientInvoiceItem.objects.filter(
-            patient_invoice__date__month=current_month,
-            patient_invoice__date__year=current_year
-        ).aggregate(
-            total_items=Count('id'),
-            total_revenue=Sum('unit_price')
-        )
-        
-        context.update({
-            'total_treatments': Treatment.objects.filter(is_active=True).count(),
-            'monthly_invoices': PatientInvoice.objects.filter(
-                date__month=current_month,
-                date__year=current_year
-            ).count(),
-            'monthly_revenue': monthly_stats['total_revenue'] or Decimal('0.00'),
-            'monthly_items': monthly_stats['total_items'] or 0,
-            'unassigned_invoices': PatientInvoice.objects.filter(electronic_invoice__isnull=True).count(),
-        })
-        
-        return context
+        recent_invoices = [
+            invoice async for invoice in
+            PatientInvoice.objects.select_related('branch', 'electronic_invoice').order_by('-date')[:10]
+        ]
+        context = self.get_context_data(recent_invoices=recent_invoices, **await adashboard_stats())
+        return self.render_to_response(context)
 
 
 # NEW: Main Patient Invoice Views (new workflow starting point)
-class PatientInvoiceListView(LoginRequiredMixin, ListView):
+class PatientInvoiceListView(AsyncLoginRequiredMixin, ReplicaReadMixin, AsyncKeysetListView):
     """Lista de todas las facturas de pacientes"""
     model = PatientInvoice
     template_name = 'invoicing/invoice_list.html'  # ADD THIS LINE
@@ -72,7 +72,8 @@ class PatientInvoiceListView(LoginRequiredMixin, ListView):
     paginate_by = 20
 
     def get_queryset(self):
-        queryset = PatientInvoice.objects.select_related('branch', 'electronic_invoice').prefetch_related('items').order_by('-date')
+        # items_changed is part of the cached row's key (see invoicing.fragments)
+        queryset = annotate_items_changed(PatientInvoice.objects.select_related('branch', 'electronic_invoice'))
         
         # Filtros
         search = self.request.GET.get('search')
@@ -80,10 +81,7 @@ class PatientInvoiceListView(LoginRequiredMixin, ListView):
         branch = self.request.GET.get('branch')
         
         if search:
-            queryset = queryset.filter(
-                Q(invoice_number__icontains=search) |
-                Q(patient_name__icontains=search)
-            )
+            queryset = search_patient_invoices(queryset, search)
             
         if assigned == 'yes':
             queryset = queryset.filter(electronic_invoice__isnull=False)
@@ -95,9 +93,14 @@ class PatientInvoiceListView(LoginRequiredMixin, ListView):
             
         return queryset
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+    def is_filtered(self):
+        return any(self.request.GET.get(key) for key in ('search', 'assigned', 'branch'))
+
+    async def aget_context_data(self, **kwargs):
+        context = self.get_context_data(**kwargs)
+        # Only queried while rendering when the cached dropdown is stale
         context['branches'] = Branch.objects.all()
+        context['branch_version'] = await abranch_version()
         context['current_filters'] = {
             'search': self.request.GET.get('search', ''),
             'assigned': self.request.GET.get('assigned', ''),
@@ -130,22 +133,10 @@ class PatientInvoiceDetailView(LoginRequiredMixin, DetailView):
         context = super().get_context_data(**kwargs)
         items = self.object.items.select_related('treatment')
         
-        # Calcular totales
-        total_subtotal = sum(item.subtotal for item in items)
-        total_monto_asembis = sum(item.monto_asembis for item in items)
-        total_monto_dr = sum(item.monto_dr for item in items)
-        total_iva = sum(item.iva for item in items)
-        total_general = sum(item.total for item in items)
-        
         context.update({
             'items': items,
-            'totals': {
-                'subtotal': total_subtotal,
-                'monto_asembis': total_monto_asembis,
-                'monto_dr': total_monto_dr,
-                'iva': total_iva,
-                'total': total_general,
-            }
+            # Totales almacenados (split calculado por invoicing.billing)
+            'totals': {field: getattr(self.object, field) for field in TOTAL_FIELDS}
         })
         
         return context
@@ -162,41 +153,109 @@ class PatientInvoiceDetailView(LoginRequiredMixin, DetailView):
         elif action == 'delete_item':
             return self.delete_item(request)
         
-        messages.error(request, 'Acción no válida.')
-        return redirect('invoicing:patient_invoice_detail', pk=self.object.pk)
+        return self.respond(request, 'error', 'Acción no válida.')
+    
+    def respond(self, request, level, message, items=(), deleted_item_id=None, extra=None):
+        """
+        Redirect back to the detail page with a message, or, for AJAX requests
+        (X-Requested-With: XMLHttpRequest), return only the changed rows and the
+        new totals footer as JSON so the page is not rendered again.
+        """
+        if request.headers.get('x-requested-with') != 'XMLHttpRequest':
+            getattr(messages, level)(request, message)
+            return redirect('invoicing:patient_invoice_detail', pk=self.object.pk)
+
+        data = {'level': level, 'message': message, **(extra or {})}
+        if level == 'error':
+            return JsonResponse(data, status=400)
+        # The stored totals were refreshed by the item writes; read them back in one query
+        self.object.refresh_from_db(fields=TOTAL_FIELDS)
+        totals = {field: getattr(self.object, field) for field in TOTAL_FIELDS}
+        data.update({
+            'item_count': self.object.items.count(),
+            'totals': totals,
+            'footer_html': render_to_string('invoicing/invoice_totals_row.html', {'totals': totals}),
+            'rows': [
+                {
+                    'item_id': item.pk,
+                    'html': render_to_string('invoicing/invoice_item_row.html', {'item': item}),
+                }
+                for item in items
+            ],
+        })
+        if deleted_item_id is not None:
+            data['deleted_item_id'] = deleted_item_id
+        return JsonResponse(data)
     
     def add_treatment(self, request):
-        """Add a treatment to the patient invoice"""
-        treatment_id = request.POST.get('treatment_id')
+        """
+        Add one or several treatments (repeated ``treatment_id``, with optional
+        ``quantity`` values in the same order) to the patient invoice. Treatments
+        already on the invoice are skipped and reported.
+        """
+        try:
+            treatment_ids = [int(value) for value in request.POST.getlist('treatment_id')]
+            quantities = [int(value) for value in request.POST.getlist('quantity')]
+        except ValueError:
+            return self.respond(request, 'error', 'Tratamiento o cantidad no válidos.')
+        if not treatment_ids:
+            return self.respond(request, 'error', 'Seleccione al menos un tratamiento.')
+        if len(quantities) > len(treatment_ids) or any(quantity <= 0 for quantity in quantities):
+            return self.respond(request, 'error', 'La cantidad debe ser mayor a cero.')
+        # Quantities default to 1 (the previous single-treatment behaviour)
+        quantities += [1] * (len(treatment_ids) - len(quantities))
+        requested = dict(zip(treatment_ids, quantities))
         
         try:
-            treatment = Treatment.objects.get(id=treatment_id, is_active=True)
-            quantity = 1  # Always use quantity = 1
+            treatments = Treatment.objects.filter(id__in=requested, is_active=True).in_bulk()
+            if not treatments:
+                return self.respond(request, 'error', 'Tratamiento no encontrado.')
             
-            # Check if treatment already exists for this patient invoice
-            existing_item = PatientInvoiceItem.objects.filter(
-                patient_invoice=self.object,
-                treatment=treatment
-            ).first()
-            
-            if existing_item:
-                messages.warning(request, f'El tratamiento {treatment.name} ya está agregado a esta factura.')
-            else:
-                # Create new item
-                PatientInvoiceItem.objects.create(
+            # Treatments that already exist on this patient invoice
+            existing = set(
+                PatientInvoiceItem.objects.filter(
                     patient_invoice=self.object,
+                    treatment_id__in=treatments
+                ).values_list('treatment_id', flat=True)
+            )
+            
+            items = add_items(self.object, [
+                PatientInvoiceItem(
                     treatment=treatment,
-                    quantity=quantity,
+                    quantity=requested[treatment_id],
                     unit_price=treatment.price
                 )
-                messages.success(request, f'Se agregó {treatment.name} a la factura.')
-                
-        except Treatment.DoesNotExist:
-            messages.error(request, 'Tratamiento no encontrado.')
+                for treatment_id, treatment in treatments.items()
+                if treatment_id not in existing
+            ])
         except Exception as e:
-            messages.error(request, f'Error al agregar tratamiento: {str(e)}')
+            return self.respond(request, 'error', f'Error al agregar tratamiento: {str(e)}')
         
-        return redirect('invoicing:patient_invoice_detail', pk=self.object.pk)
+        skipped = [treatments[treatment_id] for treatment_id in requested if treatment_id in existing]
+        not_found = [treatment_id for treatment_id in requested if treatment_id not in treatments]
+        parts = []
+        if items:
+            parts.append(
+                f'Se agregó {items[0].treatment.name} a la factura.' if len(items) == 1
+                else f'Se agregaron {len(items)} tratamientos a la factura.'
+            )
+        if skipped:
+            parts.append(
+                'Ya estaban agregados: ' + ', '.join(treatment.name for treatment in skipped) + '.'
+            )
+        if not_found:
+            parts.append(f'Tratamientos no encontrados o inactivos: {len(not_found)}.')
+        return self.respond(
+            request, 'success' if items and not (skipped or not_found) else 'warning', ' '.join(parts),
+            items=items,
+            extra={
+                'skipped': [
+                    {'id': treatment.pk, 'code': treatment.code, 'name': treatment.name}
+                    for treatment in skipped
+                ],
+                'not_found': not_found,
+            }
+        )
     
     def update_quantity(self, request):
         """Update quantity of an existing treatment item"""
@@ -204,48 +263,50 @@ class PatientInvoiceDetailView(LoginRequiredMixin, DetailView):
         quantity = request.POST.get('quantity')
         
         try:
-            item = PatientInvoiceItem.objects.get(
+            item = PatientInvoiceItem.objects.select_related('treatment').get(
                 id=item_id,
                 patient_invoice=self.object
             )
+            item.patient_invoice = self.object
             quantity = int(quantity)
             
             if quantity <= 0:
-                messages.error(request, 'La cantidad debe ser mayor a cero.')
-                return redirect('invoicing:patient_invoice_detail', pk=self.object.pk)
+                return self.respond(request, 'error', 'La cantidad debe ser mayor a cero.')
             
             item.quantity = quantity
             item.save()
-            messages.success(request, f'Se actualizó la cantidad de {item.treatment.name} a {quantity}.')
+            return self.respond(
+                request, 'success', f'Se actualizó la cantidad de {item.treatment.name} a {quantity}.', items=[item]
+            )
             
         except PatientInvoiceItem.DoesNotExist:
-            messages.error(request, 'Item no encontrado.')
-        except ValueError:
-            messages.error(request, 'Cantidad no válida.')
+            return self.respond(request, 'error', 'Item no encontrado.')
+        except (TypeError, ValueError):
+            return self.respond(request, 'error', 'Cantidad no válida.')
         except Exception as e:
-            messages.error(request, f'Error al actualizar cantidad: {str(e)}')
-        
-        return redirect('invoicing:patient_invoice_detail', pk=self.object.pk)
+            return self.respond(request, 'error', f'Error al actualizar cantidad: {str(e)}')
     
     def delete_item(self, request):
         """Delete a treatment item from the patient invoice"""
         item_id = request.POST.get('item_id')
         
         try:
-            item = PatientInvoiceItem.objects.get(
+            item = PatientInvoiceItem.objects.select_related('treatment').get(
                 id=item_id,
                 patient_invoice=self.object
             )
+            item.patient_invoice = self.object
             treatment_name = item.treatment.name
+            deleted_item_id = item.pk
             item.delete()
-            messages.success(request, f'Se eliminó {treatment_name} de la factura.')
+            return self.respond(
+                request, 'success', f'Se eliminó {treatment_name} de la factura.', deleted_item_id=deleted_item_id
+            )
             
-        except PatientInvoiceItem.DoesNotExist:
-            messages.error(request, 'Item no encontrado.')
+        except (PatientInvoiceItem.DoesNotExist, ValueError):
+            return self.respond(request, 'error', 'Item no encontrado.')
         except Exception as e:
-            messages.error(request, f'Error al eliminar item: {str(e)}')
-        
-        return redirect('invoicing:patient_invoice_detail', pk=self.object.pk)
+            return self.respond(request, 'error', f'Error al eliminar item: {str(e)}')
 
 
 class PatientInvoiceUpdateView(LoginRequiredMixin, UpdateView):
@@ -263,7 +324,7 @@ class PatientInvoiceUpdateView(LoginRequiredMixin, UpdateView):
 
 
 # Electronic Invoice Views (now for grouping)
-class ElectronicInvoiceListView(LoginRequiredMixin, ListView):
+class ElectronicInvoiceListView(AsyncLoginRequiredMixin, ReplicaReadMixin, AsyncKeysetListView):
     """Lista de facturas electrónicas"""
     model = ElectronicInvoice
     template_name = 'invoicing/electronic_invoice_list.html'
@@ -271,7 +332,7 @@ class ElectronicInvoiceListView(LoginRequiredMixin, ListView):
     paginate_by = 20
 
     def get_queryset(self):
-        queryset = ElectronicInvoice.objects.all()
+        queryset = ElectronicInvoice.objects.annotate(patient_count=Count('patient_invoices'))
         
         # Filtros
         search = self.request.GET.get('search')
@@ -281,21 +342,28 @@ class ElectronicInvoiceListView(LoginRequiredMixin, ListView):
         if search:
             queryset = queryset.filter(invoice_number__icontains=search)
             
-        if month and year:
-            queryset = queryset.filter(date__month=month, date__year=year)
-        elif year:
-            queryset = queryset.filter(date__year=year)
+        if year:
+            # Date range instead of date__year/date__month so the date index is used
+            try:
+                start, end = period_range(int(year), int(month) if month else None)
+            except (OverflowError, ValueError):
+                pass
+            else:
+                queryset = queryset.filter(date__gte=start, date__lt=end)
             
-        return queryset.order_by('-date', '-invoice_number')
+        return queryset
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+    def is_filtered(self):
+        return any(self.request.GET.get(key) for key in ('search', 'month', 'year'))
+
+    async def aget_context_data(self, **kwargs):
+        context = self.get_context_data(**kwargs)
         context['current_filters'] = {
             'search': self.request.GET.get('search', ''),
             'month': self.request.GET.get('month', ''),
             'year': self.request.GET.get('year', ''),
         }
-        context['unassigned_count'] = PatientInvoice.objects.filter(electronic_invoice__isnull=True).count()
+        context['unassigned_count'] = await PatientInvoice.objects.filter(electronic_invoice__isnull=True).acount()
         return context
 
 
@@ -321,77 +389,69 @@ class ElectronicInvoiceDetailView(LoginRequiredMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        patient_invoices = self.object.patient_invoices.select_related('branch').prefetch_related('items__treatment')
-        
-        # Calcular totales
-        total_monto_asembis = Decimal('0.00')
-        total_monto_dr = Decimal('0.00')
-        total_iva = Decimal('0.00')
-        total_general = Decimal('0.00')
-        
-        for patient_invoice in patient_invoices:
-            for item in patient_invoice.items.all():
-                total_monto_asembis += item.monto_asembis
-                total_monto_dr += item.monto_dr
-                total_iva += item.iva
-                total_general += item.total
+        patient_invoices = annotate_invoice_totals(
+            self.object.patient_invoices.select_related('branch')
+        )
         
         context.update({
             'patient_invoices': patient_invoices,
-            'totals': {
-                'monto_asembis': total_monto_asembis,
-                'monto_dr': total_monto_dr,
-                'iva': total_iva,
-                'total': total_general,
-            },
-            'unassigned_invoices': PatientInvoice.objects.filter(electronic_invoice__isnull=True).order_by('-date')
+            'totals': electronic_invoice_totals(self.object),
+            # The unassigned invoices are loaded by the picker only when the modal opens
+            'picker_filters': UnassignedInvoiceFilterForm(),
         })
         
         return context
 
 
-class ElectronicInvoicePDFView(LoginRequiredMixin, DetailView):
+class UnassignedInvoicePickerView(AsyncLoginRequiredMixin, ReplicaReadMixin, AsyncKeysetListView):
+    """Página del selector de facturas sin asignar (fragmento HTML cargado por AJAX)"""
+    template_name = 'invoicing/unassigned_invoice_picker.html'
+    context_object_name = 'unassigned_invoices'
+    paginate_by = 25
+
+    def get_queryset(self):
+        self.filters = UnassignedInvoiceFilterForm(self.request.GET)
+        return self.filters.filter(
+            PatientInvoice.objects.filter(electronic_invoice__isnull=True)
+        ).select_related('branch')
+
+    def is_filtered(self):
+        return True
+
+    async def aget_context_data(self, **kwargs):
+        context = self.get_context_data(**kwargs)
+        # Size of "select all matching" and its amount, in one aggregate
+        matching = await self.object_list.aaggregate(count=Count('id'), total=Sum('total'), max_id=Max('id'))
+        context['page_obj'].count = matching['count']
+        context.update({
+            'electronic_invoice_id': self.kwargs['pk'],
+            'matching_count': matching['count'],
+            'matching_total': matching['total'] or Decimal('0'),
+            # Sent back on "assign all" so only this set is assigned
+            'matching_max_id': matching['max_id'] or 0,
+        })
+        return context
+
+
+class ElectronicInvoicePDFView(AsyncLoginRequiredMixin, ReplicaReadMixin, DetailView):
     """Export electronic invoice as PDF"""
     model = ElectronicInvoice
     
-    def get(self, request, *args, **kwargs):
-        self.object = self.get_object()
-        patient_invoices = self.object.patient_invoices.select_related('branch').prefetch_related('items__treatment')
-        
-        # Calculate totals
-        total_monto_asembis = Decimal('0.00')
-        total_monto_dr = Decimal('0.00')
-        total_iva = Decimal('0.00')
-        total_general = Decimal('0.00')
-        
-        for patient_invoice in patient_invoices:
-            for item in patient_invoice.items.all():
-                total_monto_asembis += item.monto_asembis
-                total_monto_dr += item.monto_dr
-                total_iva += item.iva
-                total_general += item.total
-        
-        context = {
-            'electronic_invoice': self.object,
-            'patient_invoices': patient_invoices,
-            'totals': {
-                'monto_asembis': total_monto_asembis,
-                'monto_dr': total_monto_dr,
-                'iva': total_iva,
-                'total': total_general,
-            }
-        }
-        
-        # Render HTML template for PDF
-        html_string = render_to_string('invoicing/electronic_invoice_pdf.html', context)
-        
-        # Generate PDF
-        html = weasyprint.HTML(string=html_string)
-        pdf = html.write_pdf()
+    async def get(self, request, *args, **kwargs):
+        self.object = await aget_object_or_404(ElectronicInvoice, pk=kwargs['pk'])
         
-        # Return PDF response
-        response = HttpResponse(pdf, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="factura_{self.object.invoice_number}.pdf"'
+        # Served from the on-disk cache unless the invoice changed since last render;
+        # a miss renders in the bounded PDF pool, not on the event loop
+        started = time.perf_counter()
+        pdf_file, rendered = await aopen_electronic_invoice_pdf(self.object)
+        if metrics_enabled():
+            registry.observe_pdf(time.perf_counter() - started, rendered)
+        response = FileResponse(
+            pdf_file, as_attachment=True, filename=pdf_filename(self.object), content_type='application/pdf'
+        )
+        if is_asgi(request):
+            # Headers stay those of the file; blocks are read off the event loop
+            response.streaming_content = aiterate(response.streaming_content)
         return response
 
 
@@ -403,19 +463,208 @@ def assign_to_electronic_invoice(request, electronic_invoice_id):
     
     if request.method == 'POST':
         invoice_ids = request.POST.getlist('invoice_ids')
-        if invoice_ids:
-            PatientInvoice.objects.filter(
-                id__in=invoice_ids,
-                electronic_invoice__isnull=True
-            ).update(electronic_invoice=electronic_invoice)
+        select_all = request.POST.get('select_all') == '1'
+        if select_all or invoice_ids:
+            unassigned = PatientInvoice.objects.filter(electronic_invoice__isnull=True)
+            if not select_all:
+                unassigned = unassigned.filter(id__in=invoice_ids)
+            else:
+                form = AssignMatchingInvoicesForm(request.POST)
+                if not form.is_valid():
+                    messages.warning(
+                        request, 'Los filtros de la selección no son válidos; no se asignó ninguna factura.'
+                    )
+                    return redirect('invoicing:electronic_invoice_detail', pk=electronic_invoice_id)
+                # Every invoice matching the picker filters, in one UPDATE
+                unassigned = form.matching(unassigned)
+            with transaction.atomic():
+                if select_all and unassigned.count() != form.cleaned_data['matching_count']:
+                    # Never assign a set the user did not see and confirm
+                    messages.warning(
+                        request,
+                        'Las facturas sin asignar cambiaron desde que se cargó el selector; '
+                        'revise la selección e inténtelo de nuevo.'
+                    )
+                    return redirect('invoicing:electronic_invoice_detail', pk=electronic_invoice_id)
+                # Only rows still unassigned are updated; report what was actually assigned
+                assigned = unassigned.update(electronic_invoice=electronic_invoice, updated_at=timezone.now())
+                # Bulk update bypasses signals: roll the stored totals up explicitly
+                electronic_invoice.refresh_totals()
+                invalidate_electronic_invoice_pdf(electronic_invoice.pk)
+                invalidate_dashboard()
             
-            messages.success(request, f'Se asignaron {len(invoice_ids)} facturas a la factura electrónica.')
+            messages.success(request, f'Se asignaron {assigned} facturas a la factura electrónica.')
+            if not select_all and assigned < len(invoice_ids):
+                messages.warning(
+                    request, f'{len(invoice_ids) - assigned} facturas ya estaban asignadas y se omitieron.'
+                )
         else:
             messages.warning(request, 'No se seleccionaron facturas para asignar.')
     
     return redirect('invoicing:electronic_invoice_detail', pk=electronic_invoice_id)
 
 
+@login_required
+def group_invoices_view(request):
+    """Agrupar facturas sin asignar en facturas electrónicas según reglas"""
+    form = InvoiceGroupingForm(request.POST or None)
+    groups = None
+    if request.method == 'POST' and form.is_valid():
+        rules = form.rules()
+        if 'apply' in request.POST:
+            result = group_invoices(rules)
+            if result.assigned:
+                messages.success(
+                    request,
+                    f'Se crearon {len(result.electronic_invoices)} facturas electrónicas '
+                    f'y se asignaron {result.assigned} facturas.'
+                )
+            else:
+                messages.warning(request, 'No hay facturas sin asignar que cumplan las reglas.')
+            if result.skipped:
+                messages.warning(
+                    request, f'{result.skipped} facturas fueron asignadas por otro usuario y se omitieron.'
+                )
+            return redirect('invoicing:electronic_invoice_list')
+
+        branches = dict(Branch.objects.values_list('pk', 'name'))
+        groups = [
+            {
+                'branch': branches.get(group.key[0]) if rules.by_branch else None,
+                'date': group.date,
+                'count': len(group.invoice_ids),
+            }
+            for group in plan_groups(rules)
+        ]
+    return render(request, 'invoicing/invoice_grouping.html', {
+        'form': form,
+        'groups': groups,
+        'invoice_count': sum(group['count'] for group in groups or ()),
+    })
+
+
+# Reports
+class MonthlyReportView(LoginRequiredMixin, ReplicaReadMixin, TemplateView):
+    """Reporte mensual por sucursal y tratamiento, leído del resumen mensual"""
+    template_name = 'invoicing/monthly_report.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = MonthlyReportForm(self.request.GET or None)
+        context['form'] = form
+
+        if form.is_bound:
+            if not form.is_valid():
+                return context
+            year = form.cleaned_data['year']
+            month = int(form.cleaned_data['month'])
+            branch = form.cleaned_data['branch']
+        else:
+            today = date.today()
+            year, month, branch = today.year, today.month, None
+
+        context.update(monthly_report(year, month, branch))
+        context.update({
+            'year': year,
+            'month': month,
+            'month_name': dict(MonthlyReportForm.MONTH_CHOICES)[month],
+            'branch': branch,
+        })
+        return context
+
+
+@login_required
+@reads_from_replica
+def export_items_csv(request):
+    """Export every invoice line of a period (and optionally a branch) as CSV"""
+    form = ItemExportForm(request.GET or None)
+    if not form.is_valid():
+        return render(request, 'invoicing/item_export.html', {'form': form})
+
+    year = form.cleaned_data['year']
+    month = form.cleaned_data['month']
+    branch = form.cleaned_data['branch']
+    items = period_items(year, month, branch)
+    response = StreamingHttpResponse(
+        aiter_csv(items) if is_asgi(request) else iter_csv(items),
+        content_type='text/csv; charset=utf-8'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(year, month, branch)}"'
+    return response
+
+
+@login_required
+def import_invoices(request):
+    """Import patient invoices with their items from an uploaded CSV or JSONL file"""
+    form = InvoiceImportForm(request.POST or None, request.FILES or None)
+    result = None
+    if request.method == 'POST' and form.is_valid():
+        # utf-8-sig drops the BOM Excel adds to CSV files
+        lines = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+        try:
+            result = InvoiceImporter().run(iter_records(lines, form.cleaned_data['format']))
+        except InvoiceImportError as error:
+            form.add_error('file', str(error))
+        except UnicodeDecodeError:
+            form.add_error('file', 'El archivo debe estar codificado en UTF-8.')
+        else:
+            if result.invoices:
+                messages.success(
+                    request, f'Se importaron {result.invoices} facturas con {result.items} tratamientos.'
+                )
+            if result.rejected:
+                messages.warning(request, f'{result.rejected} facturas fueron rechazadas.')
+    return render(request, 'invoicing/invoice_import.html', {'form': form, 'result': result})
+
+
+# Largest batch accepted by create_invoices_api; bigger loads go through import_invoices
+API_MAX_INVOICES = 500
+
+
+@api_view
+@require_POST
+def create_invoices_api(request):
+    """
+    Crear una o varias facturas con sus tratamientos en una sola transacción.
+
+    Accepts one invoice object, a list of them or ``{"invoices": [...]}``
+    (the JSONL importer fields, with ``items`` of ``treatment_code``,
+    ``quantity`` and optional ``unit_price``). Either every invoice is created
+    or none is, and the errors are reported per invoice index. Authenticated
+    with the session and an ``X-CSRFToken`` header (see invoicing.api_auth).
+    """
+    try:
+        payload = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({'error': 'Invalid JSON body.'}, status=400)
+    if isinstance(payload, dict):
+        payload = payload['invoices'] if 'invoices' in payload else [payload]
+    if not isinstance(payload, list) or not payload:
+        return JsonResponse({'error': 'Expected an invoice or a non-empty list of invoices.'}, status=400)
+    if len(payload) > API_MAX_INVOICES:
+        return JsonResponse({'error': f'At most {API_MAX_INVOICES} invoices per request.'}, status=400)
+
+    invoices, errors = create_invoices_from_objects(payload)
+    if errors:
+        return JsonResponse({
+            'errors': [
+                {'index': error.line, 'invoice_number': error.invoice_number, 'error': error.message}
+                for error in sorted(errors)
+            ]
+        }, status=400)
+    return JsonResponse({
+        'invoices': [
+            {
+                'id': invoice.pk,
+                'invoice_number': invoice.invoice_number,
+                'url': reverse('invoicing:patient_invoice_detail', args=[invoice.pk]),
+                **{field: getattr(invoice, field) for field in TOTAL_FIELDS},
+            }
+            for invoice in invoices
+        ]
+    }, status=201)
+
+
 # Branch Views
 class BranchListView(LoginRequiredMixin, ListView):
     """Lista de sucursales"""
@@ -504,25 +753,19 @@ class TreatmentUpdateView(LoginRequiredMixin, UpdateView):
         return super().form_valid(form)
 
 
+# Monitoring
+@staff_member_required
+def metrics_view(request):
+    """Per-view request and SQL metrics in Prometheus text format"""
+    if not metrics_enabled():
+        raise Http404('Metrics are disabled.')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # Ajax Views for dynamic functionality
-def get_treatments_ajax(request):
+@reads_from_replica
+async def get_treatments_ajax(request):
     """API endpoint para obtener tratamientos activos"""
-    search = request.GET.get('search', '')
-    treatments = Treatment.objects.filter(is_active=True)
-    
-    if search:
-        treatments = treatments.filter(
-            Q(code__icontains=search) |
-            Q(name__icontains=search)
-        )
-    
-    treatments = treatments[:10]  # Limit results
-    
-    data = [{
-        'id': t.id,
-        'code': t.code,
-        'name': t.name,
-        'price': str(t.price)
-    } for t in treatments]
+    data = await asearch_treatments(request.GET.get('search', ''))
     
     return JsonResponse({'treatments': data})
\ No newline at end of file
@@ -0,0 +1,99 @@
+// Electronic Invoice Detail JavaScript
+
+document.addEventListener('DOMContentLoaded', function() {
+    const modal = document.getElementById('assignInvoicesModal');
+    const picker = document.getElementById('unassigned-picker');
+    const filtersForm = document.getElementById('picker-filters');
+    const assignForm = document.getElementById('assign-form');
+    const selectAllInput = assignForm.querySelector('[name=select_all]');
+    let loaded = false;
+    
+    // The unassigned invoices are only fetched when the modal is opened
+    modal.addEventListener('show.bs.modal', function() {
+        if (!loaded) {
+            loaded = true;
+            loadPicker(filterQuery());
+        }
+    });
+    
+    function filterQuery() {
+        const params = new URLSearchParams(new FormData(filtersForm));
+        return '?' + params.toString();
+    }
+    
+    function loadPicker(query) {
+        selectAllInput.value = '';
+        picker.style.opacity = '0.5';
+        fetch(picker.dataset.url + query, {headers: {'X-Requested-With': 'XMLHttpRequest'}})
+            .then(response => response.text())
+            .then(html => {
+                picker.innerHTML = html;
+            })
+            .catch(error => {
+                console.error('Error loading unassigned invoices:', error);
+                picker.innerHTML = '<div class="text-center py-4 text-danger">Error cargando facturas.</div>';
+            })
+            .finally(() => {
+                picker.style.opacity = '';
+            });
+    }
+    
+    // Filters reload the first page
+    filtersForm.addEventListener('change', () => loadPicker(filterQuery()));
+    filtersForm.addEventListener('submit', function(event) {
+        event.preventDefault();
+        loadPicker(filterQuery());
+    });
+    initializeSearch(filtersForm.querySelector('[name=search]'), () => loadPicker(filterQuery()));
+    
+    // Pagination links keep the filters in their query string
+    picker.addEventListener('click', function(event) {
+        const link = event.target.closest('a.page-link');
+        if (link) {
+            event.preventDefault();
+            loadPicker(link.getAttribute('href'));
+        }
+    });
+    
+    picker.addEventListener('change', function(event) {
+        if (event.target.id === 'select-page') {
+            picker.querySelectorAll('.invoice-checkbox').forEach(checkbox => {
+                checkbox.checked = event.target.checked;
+            });
+        } else if (event.target.id === 'select-all-matching') {
+            // Assigned server-side with the filters; the page checkboxes only show it
+            selectAllInput.value = event.target.checked ? '1' : '';
+            // What the user saw: the server refuses to assign anything else
+            assignForm.querySelector('[name=matching_count]').value = event.target.dataset.count;
+            assignForm.querySelector('[name=matching_max_id]').value = event.target.dataset.maxId;
+            picker.querySelectorAll('.invoice-checkbox, #select-page').forEach(checkbox => {
+                checkbox.checked = event.target.checked;
+                checkbox.disabled = event.target.checked;
+            });
+        }
+    });
+    
+    assignForm.addEventListener('submit', function(event) {
+        // Previous filter copies are replaced by the current filters
+        assignForm.querySelectorAll('.filter-copy').forEach(input => input.remove());
+        
+        if (selectAllInput.value === '1') {
+            const count = picker.querySelector('#select-all-matching').dataset.count;
+            if (!confirmAction(`¿Asignar las ${count} facturas que cumplen el filtro?`)) {
+                event.preventDefault();
+                return;
+            }
+            new FormData(filtersForm).forEach((value, name) => {
+                const input = document.createElement('input');
+                input.type = 'hidden';
+                input.name = name;
+                input.value = value;
+                input.className = 'filter-copy';
+                assignForm.appendChild(input);
+            });
+        } else if (!picker.querySelector('.invoice-checkbox:checked')) {
+            event.preventDefault();
+            alert('Seleccione al menos una factura.');
+        }
+    });
+});
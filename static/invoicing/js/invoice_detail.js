@@ -24,7 +24,7 @@ document.addEventListener('DOMContentLoaded', function() {
         fetch('/ajax/treatments/')
             .then(response => response.json())
             .then(data => {
-                treatmentSelect.innerHTML = '<option value="">Seleccione un tratamiento...</option>';
+                treatmentSelect.innerHTML = '';
                 data.treatments.forEach(treatment => {
                     const option = document.createElement('option');
                     option.value = treatment.id;
@@ -41,15 +41,18 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
     
-    // Treatment selection preview
+    // Treatment selection preview (several treatments can be selected)
     treatmentSelect.addEventListener('change', function() {
-        const option = this.selectedOptions[0];
+        const options = Array.from(this.selectedOptions).filter(option => option.value);
         const preview = document.getElementById('treatment-preview');
         
-        if (this.value && option) {
-            document.getElementById('preview-code').textContent = option.dataset.code;
-            document.getElementById('preview-name').textContent = option.dataset.name;
-            document.getElementById('preview-price').textContent = formatCurrency(parseFloat(option.dataset.price));
+        if (options.length) {
+            const price = options.reduce((sum, option) => sum + parseFloat(option.dataset.price), 0);
+            document.getElementById('preview-code').textContent =
+                options.length === 1 ? options[0].dataset.code : `${options.length} tratamientos`;
+            document.getElementById('preview-name').textContent =
+                options.map(option => option.dataset.name).join(', ');
+            document.getElementById('preview-price').textContent = formatCurrency(price);
             preview.classList.remove('d-none');
             saveTreatmentBtn.disabled = false;
         } else {
@@ -58,73 +61,146 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
     
-    // Save treatment
-    saveTreatmentBtn.addEventListener('click', function() {
-        const treatmentId = treatmentSelect.value;
-        
-        if (!treatmentId) {
-            alert('Por favor seleccione un tratamiento.');
-            return;
-        }
-        
-        showLoading(this);
-        
-        // Get CSRF token
+    // Post an item action and apply the returned rows and totals in place
+    function postItemAction(fields) {
         const csrfToken = document.querySelector('[name=csrfmiddlewaretoken]')?.value;
         
         if (!csrfToken) {
             console.error('CSRF token not found');
-            hideLoading(this);
             alert('Error: Token de seguridad no encontrado. Recargue la página.');
-            return;
+            return Promise.reject(new Error('CSRF token not found'));
         }
         
-        // Create form and submit
-        const form = document.createElement('form');
-        form.method = 'POST';
-        form.action = window.location.href;
-        
-        form.innerHTML = `
-            <input type="hidden" name="csrfmiddlewaretoken" value="${csrfToken}">
-            <input type="hidden" name="action" value="add_treatment">
-            <input type="hidden" name="treatment_id" value="${treatmentId}">
-        `;
+        const body = new URLSearchParams(fields);
+        body.append('csrfmiddlewaretoken', csrfToken);
         
-        document.body.appendChild(form);
-        form.submit();
-    });
+        return fetch(window.location.pathname, {
+            method: 'POST',
+            headers: {'X-Requested-With': 'XMLHttpRequest'},
+            body: body
+        })
+            .then(response => response.json())
+            .then(data => {
+                showMessage(data.level, data.message);
+                if (data.level !== 'error') {
+                    applyItemChange(data);
+                }
+                return data;
+            })
+            .catch(error => {
+                console.error('Error updating invoice:', error);
+                showMessage('error', 'Error de conexión. Recargue la página.');
+                throw error;
+            });
+    }
     
-    // Delete item functionality
-    document.querySelectorAll('.delete-item-btn').forEach(btn => {
-        btn.addEventListener('click', function() {
-            if (confirmAction('¿Está seguro de que desea eliminar este tratamiento?')) {
-                const itemId = this.closest('tr').dataset.itemId;
-                deleteItem(itemId);
+    function applyItemChange(data) {
+        const table = document.getElementById('items-table');
+        
+        // The first item added or the last one deleted switches between the table and the empty state
+        if (!table || data.item_count === 0) {
+            window.location.reload();
+            return;
+        }
+        
+        if (data.deleted_item_id) {
+            table.querySelector(`tr[data-item-id="${data.deleted_item_id}"]`)?.remove();
+        }
+        (data.rows || []).forEach(row => {
+            const template = document.createElement('template');
+            template.innerHTML = row.html.trim();
+            const existing = table.querySelector(`tr[data-item-id="${row.item_id}"]`);
+            if (existing) {
+                existing.replaceWith(template.content.firstElementChild);
+            } else {
+                table.tBodies[0].appendChild(template.content.firstElementChild);
             }
         });
-    });
+        document.getElementById('invoice-totals').innerHTML = data.footer_html;
+        document.getElementById('item-count').textContent =
+            `${data.item_count} tratamiento${data.item_count === 1 ? '' : 's'}`;
+    }
     
-    function deleteItem(itemId) {
-        const csrfToken = document.querySelector('[name=csrfmiddlewaretoken]')?.value;
+    function showMessage(level, message) {
+        const alert = document.createElement('div');
+        alert.className = `alert alert-${level === 'error' ? 'danger' : level} alert-dismissible fade show`;
+        alert.setAttribute('role', 'alert');
+        alert.textContent = message;
+        const close = document.createElement('button');
+        close.type = 'button';
+        close.className = 'btn-close';
+        close.dataset.bsDismiss = 'alert';
+        alert.appendChild(close);
         
-        if (!csrfToken) {
-            alert('Error: Token de seguridad no encontrado. Recargue la página.');
+        document.querySelector('.main-content').prepend(alert);
+        setTimeout(() => bootstrap.Alert.getOrCreateInstance(alert).close(), 5000);
+    }
+    
+    // Save treatment
+    saveTreatmentBtn.addEventListener('click', function() {
+        const treatmentIds = Array.from(treatmentSelect.selectedOptions)
+            .map(option => option.value)
+            .filter(Boolean);
+        
+        if (!treatmentIds.length) {
+            alert('Por favor seleccione un tratamiento.');
             return;
         }
         
-        const form = document.createElement('form');
-        form.method = 'POST';
-        form.action = window.location.href;
+        const button = this;
+        showLoading(button);
         
-        form.innerHTML = `
-            <input type="hidden" name="csrfmiddlewaretoken" value="${csrfToken}">
-            <input type="hidden" name="action" value="delete_item">
-            <input type="hidden" name="item_id" value="${itemId}">
-        `;
-        
-        document.body.appendChild(form);
-        form.submit();
-    }
+        // All selected treatments are added in one request
+        postItemAction([
+            ['action', 'add_treatment'],
+            ...treatmentIds.map(treatmentId => ['treatment_id', treatmentId])
+        ])
+            .then(data => {
+                if (data.level !== 'error') {
+                    addTreatmentModal.hide();
+                }
+            })
+            .catch(() => {})
+            .finally(() => hideLoading(button));
+    });
+    
+    // Delete and quantity changes are delegated so replaced rows keep working
+    document.addEventListener('click', function(event) {
+        const btn = event.target.closest('.delete-item-btn');
+        if (!btn) {
+            return;
+        }
+        if (confirmAction('¿Está seguro de que desea eliminar este tratamiento?')) {
+            const itemId = btn.closest('tr').dataset.itemId;
+            btn.disabled = true;
+            postItemAction({action: 'delete_item', item_id: itemId})
+                .catch(() => {})
+                .finally(() => { btn.disabled = false; });
+        }
+    });
+    
+    document.addEventListener('change', function(event) {
+        const input = event.target.closest('.item-quantity-input');
+        if (!input) {
+            return;
+        }
+        const quantity = parseInt(input.value, 10);
+        if (!quantity || quantity <= 0) {
+            showMessage('error', 'La cantidad debe ser mayor a cero.');
+            input.value = input.dataset.quantity;
+            return;
+        }
+        const itemId = input.closest('tr').dataset.itemId;
+        input.disabled = true;
+        postItemAction({action: 'update_quantity', item_id: itemId, quantity: quantity})
+            .then(data => {
+                if (data.level === 'error') {
+                    input.value = input.dataset.quantity;
+                }
+            })
+            .catch(() => { input.value = input.dataset.quantity; })
+            .finally(() => { input.disabled = false; });
+    });
     
     console.log('Invoice detail JavaScript loaded');
 });
\ No newline at end of file